@@ -11,6 +11,12 @@ import numpy as np
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
+# shared modules (keyword_index.py, keyword_matcher.py) live in the repo root
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from keyword_index import keyword_params, matching_posts_sql
+from keyword_matcher import KeywordMatcher
+
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -140,17 +146,17 @@ def figure2_toxicity_distribution():
     
     #4chan toxicity
     df_4chan = pd.read_sql("""
-        SELECT (toxicity_scores->>'toxicity')::float as toxicity
-        FROM posts WHERE toxicity_scores IS NOT NULL
+        SELECT toxicity
+        FROM posts WHERE toxicity IS NOT NULL
     """, conn)
     
     #reddit toxicity
     df_reddit = pd.read_sql("""
-        SELECT (toxicity_scores->>'toxicity')::float as toxicity
+        SELECT toxicity
         FROM (
-            SELECT toxicity_scores FROM reddit_posts WHERE toxicity_scores IS NOT NULL
+            SELECT toxicity FROM reddit_posts WHERE toxicity IS NOT NULL
             UNION ALL
-            SELECT toxicity_scores FROM reddit_comments WHERE toxicity_scores IS NOT NULL
+            SELECT toxicity FROM reddit_comments WHERE toxicity IS NOT NULL
         ) AS combined
     """, conn)
     
@@ -180,17 +186,17 @@ def figure3_toxicity_cdf():
     
     #4chan toxicity
     df_4chan = pd.read_sql("""
-        SELECT (toxicity_scores->>'toxicity')::float as toxicity
-        FROM posts WHERE toxicity_scores IS NOT NULL
+        SELECT toxicity
+        FROM posts WHERE toxicity IS NOT NULL
     """, conn)
     
     #reddit toxicity
     df_reddit = pd.read_sql("""
-        SELECT (toxicity_scores->>'toxicity')::float as toxicity
+        SELECT toxicity
         FROM (
-            SELECT toxicity_scores FROM reddit_posts WHERE toxicity_scores IS NOT NULL
+            SELECT toxicity FROM reddit_posts WHERE toxicity IS NOT NULL
             UNION ALL
-            SELECT toxicity_scores FROM reddit_comments WHERE toxicity_scores IS NOT NULL
+            SELECT toxicity FROM reddit_comments WHERE toxicity IS NOT NULL
         ) AS combined
     """, conn)
     
@@ -232,20 +238,12 @@ def figure3_toxicity_cdf():
 def figure4_keyword_shifts_during_spikes():
     conn = get_db()
     
-    #posts with HIGH toxicity (>0.35)
-    df_high = pd.read_sql("""
-        SELECT data::text as text
-        FROM posts
-        WHERE toxicity_scores IS NOT NULL
-        AND (toxicity_scores->>'toxicity')::float > 0.35
-    """, conn)
-    
-    #posts with LOW toxicity (<=0.35)
-    df_low = pd.read_sql("""
-        SELECT data::text as text
+    #every scored post once, tagged with its toxicity group
+    df = pd.read_sql("""
+        SELECT COALESCE(data->>'sub', '') || ' ' || COALESCE(data->>'com', '') as text,
+               toxicity > 0.35 as high
         FROM posts
-        WHERE toxicity_scores IS NOT NULL
-        AND (toxicity_scores->>'toxicity')::float <= 0.35
+        WHERE toxicity IS NOT NULL
     """, conn)
     
     conn.close()
@@ -254,17 +252,16 @@ def figure4_keyword_shifts_during_spikes():
                 'election', 'china', 'taiwan', 'iran', 'nato', 
                 'jew', 'muslim', 'war', 'genocide']
     
-    #count keyword frequencies
-    high_counts = {}
-    low_counts = {}
-    
-    for kw in keywords:
-        high_counts[kw] = sum(df_high['text'].str.contains(kw, case=False, na=False))
-        low_counts[kw] = sum(df_low['text'].str.contains(kw, case=False, na=False))
+    #one pass over each post for all keywords (whole words + plurals)
+    matcher = KeywordMatcher(keywords)
+    counts = matcher.counts(matcher.masks(df['text']), df['high'])
+    counts = counts.reindex([True, False], fill_value=0)
+    n_high = int(df['high'].sum())
+    n_low = len(df) - n_high
     
     #normalize by document count
-    high_rates = {k: (v / len(df_high) * 100) for k, v in high_counts.items()}
-    low_rates = {k: (v / len(df_low) * 100) for k, v in low_counts.items()}
+    high_rates = {k: (counts.loc[True, k] / n_high * 100) if n_high else 0 for k in keywords}
+    low_rates = {k: (counts.loc[False, k] / n_low * 100) if n_low else 0 for k in keywords}
     
     #plot
     x = np.arange(len(keywords))
@@ -273,10 +270,10 @@ def figure4_keyword_shifts_during_spikes():
     fig, ax = plt.subplots(figsize=(14, 6))
     
     ax.bar(x - width/2, [high_rates[k] for k in keywords], width, 
-           label=f'High Toxicity (>0.35, n={len(df_high):,})', 
+           label=f'High Toxicity (>0.35, n={n_high:,})', 
            color='#FF6B6B', alpha=0.8, edgecolor='black')
     ax.bar(x + width/2, [low_rates[k] for k in keywords], width, 
-           label=f'Low Toxicity (≤0.35, n={len(df_low):,})', 
+           label=f'Low Toxicity (≤0.35, n={n_low:,})', 
            color='#4ECDC4', alpha=0.8, edgecolor='black')
     
     ax.set_xlabel('Keywords', fontsize=12, fontweight='bold')
@@ -297,32 +294,24 @@ def figure5_multi_attribute_toxicity():
     conn = get_db()
     cur = conn.cursor()
     
+    #averages come from the hourly rollups (sum / count per attribute)
+    attrs = ['toxicity', 'severe_toxicity', 'identity_attack', 'insult', 'profanity', 'threat']
+    means = ', '.join(f"SUM(sum_{a}) / NULLIF(SUM(n_{a}), 0) as {a}" for a in attrs)
+    
     #4chan: average of all toxicity attributes
-    cur.execute("""
-        SELECT 
-            AVG((toxicity_scores->>'toxicity')::float) as toxicity,
-            AVG((toxicity_scores->>'severe_toxicity')::float) as severe_toxicity,
-            AVG((toxicity_scores->>'identity_attack')::float) as identity_attack,
-            AVG((toxicity_scores->>'insult')::float) as insult,
-            AVG((toxicity_scores->>'profanity')::float) as profanity,
-            AVG((toxicity_scores->>'threat')::float) as threat
-        FROM posts WHERE toxicity_scores IS NOT NULL
+    cur.execute(f"""
+        SELECT {means}
+        FROM posts_toxicity_hourly
     """)
     chan_scores = cur.fetchone()
     
     #reddit: average of all toxicity attributes  
-    cur.execute("""
-        SELECT 
-            AVG((toxicity_scores->>'toxicity')::float) as toxicity,
-            AVG((toxicity_scores->>'severe_toxicity')::float) as severe_toxicity,
-            AVG((toxicity_scores->>'identity_attack')::float) as identity_attack,
-            AVG((toxicity_scores->>'insult')::float) as insult,
-            AVG((toxicity_scores->>'profanity')::float) as profanity,
-            AVG((toxicity_scores->>'threat')::float) as threat
+    cur.execute(f"""
+        SELECT {means}
         FROM (
-            SELECT toxicity_scores FROM reddit_posts WHERE toxicity_scores IS NOT NULL
+            SELECT * FROM reddit_posts_toxicity_hourly
             UNION ALL
-            SELECT toxicity_scores FROM reddit_comments WHERE toxicity_scores IS NOT NULL
+            SELECT * FROM reddit_comments_toxicity_hourly
         ) AS combined
     """)
     reddit_scores = cur.fetchone()
@@ -399,24 +388,22 @@ def figure6_event_response_timeline():
     print("Finding peak dates for keywords...")
     
     #find top Ukraine date
-    ukraine_peak = pd.read_sql("""
-        SELECT DATE(created_at) as date, COUNT(*) as mentions
-        FROM posts
-        WHERE data::text ILIKE '%ukraine%'
-        GROUP BY DATE(created_at)
+    ukraine_peak = pd.read_sql(f"""
+        SELECT DATE(p.created_at) as date, COUNT(*) as mentions
+        FROM {matching_posts_sql('posts')}
+        GROUP BY DATE(p.created_at)
         ORDER BY mentions DESC
         LIMIT 1
-    """, conn)
+    """, conn, params=keyword_params(['ukraine']))
     
     #find top Gaza date
-    gaza_peak = pd.read_sql("""
-        SELECT DATE(created_at) as date, COUNT(*) as mentions
-        FROM posts
-        WHERE data::text ILIKE '%gaza%'
-        GROUP BY DATE(created_at)
+    gaza_peak = pd.read_sql(f"""
+        SELECT DATE(p.created_at) as date, COUNT(*) as mentions
+        FROM {matching_posts_sql('posts')}
+        GROUP BY DATE(p.created_at)
         ORDER BY mentions DESC
         LIMIT 1
-    """, conn)
+    """, conn, params=keyword_params(['gaza']))
     
     #build events dictionary from actual data
     events = {}
@@ -442,17 +429,18 @@ def figure6_event_response_timeline():
     
     for idx, (keyword, event_date) in enumerate(events.items()):
         #4chan activity around event
+        terms = keyword_params([keyword])
+        
         df_4chan = pd.read_sql(f"""
             SELECT 
-                DATE(created_at) as date,
+                DATE(p.created_at) as date,
                 COUNT(*) as post_count
-            FROM posts
-            WHERE created_at >= '{event_date}'::date - interval '3 days'
-            AND created_at <= '{event_date}'::date + interval '3 days'
-            AND data::text ILIKE '%{keyword.lower()}%'
-            GROUP BY DATE(created_at)
+            FROM {matching_posts_sql('posts')}
+            WHERE p.created_at >= '{event_date}'::date - interval '3 days'
+            AND p.created_at <= '{event_date}'::date + interval '3 days'
+            GROUP BY DATE(p.created_at)
             ORDER BY date
-        """, conn)
+        """, conn, params=terms)
         
         #reddit activity around event
         df_reddit = pd.read_sql(f"""
@@ -460,17 +448,15 @@ def figure6_event_response_timeline():
                 DATE(created_at) as date,
                 COUNT(*) as post_count
             FROM (
-                SELECT created_at, data FROM reddit_posts
-                WHERE data::text ILIKE '%{keyword.lower()}%'
+                SELECT p.created_at FROM {matching_posts_sql('reddit_posts')}
                 UNION ALL
-                SELECT created_at, data FROM reddit_comments
-                WHERE data::text ILIKE '%{keyword.lower()}%'
+                SELECT p.created_at FROM {matching_posts_sql('reddit_comments')}
             ) AS combined
             WHERE created_at >= '{event_date}'::date - interval '3 days'
             AND created_at <= '{event_date}'::date + interval '3 days'
             GROUP BY DATE(created_at)
             ORDER BY date
-        """, conn)
+        """, conn, params=terms)
         
         df_4chan['date'] = pd.to_datetime(df_4chan['date'])
         df_reddit['date'] = pd.to_datetime(df_reddit['date'])
@@ -513,15 +499,14 @@ def figure6_event_response_timeline():
 def figure7_pol_threads_daily():
     conn = get_db()
     
-    #count threads where the OP post was made that day
+    #count threads where the OP post was made that day (n_threads in the hourly rollup)
     df = pd.read_sql("""
-        SELECT DATE(created_at) as date, 
-               COUNT(*) as thread_count
-        FROM posts
-        WHERE board_name = 'pol'
-        AND created_at >= '2025-11-01' AND created_at < '2025-11-15'
-        AND (data->>'resto')::text = '0'
-        GROUP BY DATE(created_at) 
+        SELECT DATE(bucket) as date, 
+               SUM(n_threads)::int as thread_count
+        FROM posts_toxicity_hourly
+        WHERE community = 'pol'
+        AND bucket >= '2025-11-01' AND bucket < '2025-11-15'
+        GROUP BY DATE(bucket) 
         ORDER BY date
     """, conn)
     
@@ -552,12 +537,13 @@ def figure7_pol_threads_daily():
 def figure8_pol_posts_hourly():
     conn = get_db()
     
+    #one rollup row per hour per board
     df = pd.read_sql("""
-        SELECT DATE_TRUNC('hour', created_at) as hour, COUNT(*) as post_count
-        FROM posts
-        WHERE board_name = 'pol'
-        AND created_at >= '2025-11-01' AND created_at < '2025-11-15'
-        GROUP BY hour ORDER BY hour
+        SELECT bucket as hour, n_rows as post_count
+        FROM posts_toxicity_hourly
+        WHERE community = 'pol'
+        AND bucket >= '2025-11-01' AND bucket < '2025-11-15'
+        ORDER BY hour
     """, conn)
     df['hour'] = pd.to_datetime(df['hour'])
     conn.close()
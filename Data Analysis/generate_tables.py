@@ -2,10 +2,15 @@
 #summary stats table for project 2 report
 
 import os
+import sys
 import psycopg2
 import pandas as pd
 from dotenv import load_dotenv
 
+# shared modules (keyword_index.py) live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from keyword_index import keyword_params, keyword_posts_sql
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
@@ -27,13 +32,13 @@ def generate_summary_statistics_table():
     chan_start, chan_end = cur.fetchone()
     
     #posts with toxicity scores
-    cur.execute("SELECT COUNT(*) FROM posts WHERE toxicity_scores IS NOT NULL")
+    cur.execute("SELECT COUNT(*) FROM posts WHERE toxicity IS NOT NULL")
     chan_toxicity_count = cur.fetchone()[0]
     
     #average toxicity
     cur.execute("""
-        SELECT AVG((toxicity_scores->>'toxicity')::float)
-        FROM posts WHERE toxicity_scores IS NOT NULL
+        SELECT AVG(toxicity)
+        FROM posts WHERE toxicity IS NOT NULL
     """)
     chan_avg_tox = cur.fetchone()[0] or 0
     
@@ -49,13 +54,13 @@ def generate_summary_statistics_table():
     reddit_start, reddit_end = cur.fetchone()
     
     #posts with toxicity scores
-    cur.execute("SELECT COUNT(*) FROM reddit_posts WHERE toxicity_scores IS NOT NULL")
+    cur.execute("SELECT COUNT(*) FROM reddit_posts WHERE toxicity IS NOT NULL")
     reddit_toxicity_count = cur.fetchone()[0]
     
     #average toxicity
     cur.execute("""
-        SELECT AVG((toxicity_scores->>'toxicity')::float)
-        FROM reddit_posts WHERE toxicity_scores IS NOT NULL
+        SELECT AVG(toxicity)
+        FROM reddit_posts WHERE toxicity IS NOT NULL
     """)
     reddit_avg_tox = cur.fetchone()[0] or 0
     
@@ -67,13 +72,13 @@ def generate_summary_statistics_table():
     reddit_comments_total = cur.fetchone()[0]
     
     #comments with toxicity scores
-    cur.execute("SELECT COUNT(*) FROM reddit_comments WHERE toxicity_scores IS NOT NULL")
+    cur.execute("SELECT COUNT(*) FROM reddit_comments WHERE toxicity IS NOT NULL")
     reddit_comments_toxicity_count = cur.fetchone()[0]
     
     #average toxicity
     cur.execute("""
-        SELECT AVG((toxicity_scores->>'toxicity')::float)
-        FROM reddit_comments WHERE toxicity_scores IS NOT NULL
+        SELECT AVG(toxicity)
+        FROM reddit_comments WHERE toxicity IS NOT NULL
     """)
     reddit_comments_avg_tox = cur.fetchone()[0] or 0
     
@@ -185,21 +190,25 @@ def generate_keyword_table():
     #data dictionary
     data = {'Keyword': [], '4chan': [], 'Reddit Posts': [], 'Reddit Comments': [], 'Total': []}
     
+    #counts come from the inverted keyword index (word + plural match)
+    count_query = "SELECT COUNT(*) FROM ({}) as hits"
+    
     for keyword in keywords:
         data['Keyword'].append(keyword.capitalize())
+        params = keyword_params([keyword])
         
         #count in 4chan
-        cur.execute(f"SELECT COUNT(*) FROM posts WHERE data::text ILIKE '%{keyword}%'")
+        cur.execute(count_query.format(keyword_posts_sql('posts')), params)
         chan = cur.fetchone()[0]
         data['4chan'].append(f'{chan:,}')
         
         #count in Reddit posts
-        cur.execute(f"SELECT COUNT(*) FROM reddit_posts WHERE data::text ILIKE '%{keyword}%'")
+        cur.execute(count_query.format(keyword_posts_sql('reddit_posts')), params)
         reddit = cur.fetchone()[0]
         data['Reddit Posts'].append(f'{reddit:,}')
         
         #count in Reddit comments
-        cur.execute(f"SELECT COUNT(*) FROM reddit_comments WHERE data::text ILIKE '%{keyword}%'")
+        cur.execute(count_query.format(keyword_posts_sql('reddit_comments')), params)
         comments = cur.fetchone()[0]
         data['Reddit Comments'].append(f'{comments:,}')
         
@@ -1,7 +1,9 @@
 #how to run- python3 perspective_toxicity.py all
+#after the typed score columns migration, once: python3 perspective_toxicity.py backfill
 
 import os
 import time
+from datetime import timedelta
 import psycopg2
 from googleapiclient import discovery
 import json
@@ -12,6 +14,11 @@ load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL")
 PERSPECTIVE_API_KEY = os.getenv("PERSPECTIVE_API_KEY")
 
+#attributes also stored as typed columns (see migrations/20261017130000_add_toxicity_columns.sql)
+ATTRIBUTES = ['toxicity', 'severe_toxicity', 'identity_attack',
+              'insult', 'profanity', 'threat']
+TABLES = ['posts', 'reddit_posts', 'reddit_comments']
+
 def get_api_client():
     #connect to Perspective API
     return discovery.build(
@@ -51,6 +58,17 @@ def get_toxicity_score(text, client):
     except:
         return None
 
+def record_watermark(cur, table, rows_scored):
+    #tell the dashboard cache that scores changed (see data_watermarks migration)
+    if rows_scored == 0:
+        return
+    cur.execute("""
+        INSERT INTO data_watermarks (table_name, scored_at, rows_scored)
+        VALUES (%s, now(), %s)
+        ON CONFLICT (table_name) DO UPDATE
+        SET scored_at = now(), rows_scored = data_watermarks.rows_scored + EXCLUDED.rows_scored
+    """, (table, rows_scored))
+
 def process_platform(table, text_field, id_fields, platform_name):
     #process all posts from a platform
     print(f"\n--- {platform_name} ---")
@@ -59,9 +77,12 @@ def process_platform(table, text_field, id_fields, platform_name):
     conn = psycopg2.connect(dsn=DATABASE_URL)
     cur = conn.cursor()
     
-    #create toxicity_scores column if it doesn't exist
+    #create toxicity_scores, typed attribute and scored_at columns if they don't exist
     try:
         cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS toxicity_scores JSONB")
+        for attr in ATTRIBUTES:
+            cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {attr} DOUBLE PRECISION")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS scored_at TIMESTAMPTZ")
         conn.commit()
     except:
         conn.rollback()
@@ -81,6 +102,7 @@ def process_platform(table, text_field, id_fields, platform_name):
     print(f"Estimated time: {(total * 1.05 / 3600):.1f} hrs")
     
     processed = 0
+    scored = 0
     
     try:
         #process in batches until all posts are done
@@ -99,6 +121,7 @@ def process_platform(table, text_field, id_fields, platform_name):
                 break
             
             #process each post in batch
+            scored = 0
             for row in rows:
                 *ids, text = row
                 
@@ -108,9 +131,12 @@ def process_platform(table, text_field, id_fields, platform_name):
                 #save scores to database
                 if scores:
                     where_clause = ' AND '.join([f"{field} = %s" for field in id_fields])
+                    set_attrs = ', '.join([f"{attr} = %s" for attr in ATTRIBUTES])
                     cur.execute(f"""
-                        UPDATE {table} SET toxicity_scores = %s WHERE {where_clause}
-                    """, (json.dumps(scores), *ids))
+                        UPDATE {table} SET toxicity_scores = %s, {set_attrs}, scored_at = now()
+                        WHERE {where_clause}
+                    """, (json.dumps(scores), *[scores.get(attr) for attr in ATTRIBUTES], *ids))
+                    scored += 1
                 
                 processed += 1
                 
@@ -121,16 +147,55 @@ def process_platform(table, text_field, id_fields, platform_name):
                 # Wait 1.05 seconds between requests (API rate limit is 1 per second)
                 time.sleep(1.05)
             
+            record_watermark(cur, table, scored)
             conn.commit()
     
     except KeyboardInterrupt:
         print("\nstopped, run again to continue")
+        record_watermark(cur, table, scored)
         conn.commit()
     
     cur.close()
     conn.close()
     print(f"Processed {processed:,} posts")
 
+def backfill_columns(table):
+    #copy existing toxicity_scores into the typed columns, one day per
+    #transaction; rerunning only touches rows whose columns are out of date
+    #(touched rows get a scored_at, so the TF-IDF model refresh picks them up)
+    conn = psycopg2.connect(dsn=DATABASE_URL)
+    cur = conn.cursor()
+    
+    cur.execute(f"SELECT MIN(created_at), MAX(created_at) FROM {table} WHERE toxicity_scores IS NOT NULL")
+    first, last = cur.fetchone()
+    if first is None:
+        print(f"{table}: nothing scored yet")
+        cur.close()
+        conn.close()
+        return
+    
+    columns = ', '.join(ATTRIBUTES)
+    from_json = ', '.join([f"(toxicity_scores->>'{attr}')::float" for attr in ATTRIBUTES])
+    
+    day = first.replace(hour=0, minute=0, second=0, microsecond=0)
+    updated = 0
+    while day <= last:
+        cur.execute(f"""
+            UPDATE {table} SET ({columns}) = ROW({from_json}), scored_at = now()
+            WHERE created_at >= %s AND created_at < %s
+            AND toxicity_scores IS NOT NULL
+            AND ROW({columns}) IS DISTINCT FROM ROW({from_json})
+        """, (day, day + timedelta(days=1)))
+        updated += cur.rowcount
+        conn.commit()
+        day += timedelta(days=1)
+    
+    record_watermark(cur, table, updated)
+    conn.commit()
+    cur.close()
+    conn.close()
+    print(f"{table}: {updated:,} rows backfilled")
+
 def process_all():
     #process all platforms in sequence
     print("\n" + "-"*25)
@@ -162,12 +227,16 @@ if __name__ == "__main__":
     
     #check command line arguments
     if len(sys.argv) < 2:
-        print("Usage: python3 perspective_toxicity.py [4chan|reddit|reddit_comments|all]")
+        print("Usage: python3 perspective_toxicity.py [4chan|reddit|reddit_comments|all|backfill]")
         sys.exit(1)
     
     platform = sys.argv[1]
     
-    if platform == "all":
+    if platform == "backfill":
+        #fill the typed score columns from toxicity_scores (run once after the migration)
+        for table in TABLES:
+            backfill_columns(table)
+    elif platform == "all":
         process_all()
     elif platform == "4chan":
         process_platform('posts', "data->>'com'", 
@@ -179,4 +248,4 @@ if __name__ == "__main__":
         process_platform('reddit_comments', "data->>'body'",
                         ['subreddit', 'post_id', 'comment_id'], 'Reddit Comments')
     else:
-        print("Invalid. Use: 4chan, reddit, reddit_comments, or all")
\ No newline at end of file
+        print("Invalid. Use: 4chan, reddit, reddit_comments, all, or backfill")
\ No newline at end of file
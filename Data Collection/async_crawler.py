@@ -0,0 +1,96 @@
+#One asyncio worker for the 4chan and Reddit crawl jobs
+#
+#Handles the job types of chan_crawler.py and reddit_crawler.py (run it
+#instead of them, seeded the same way by cold_start_board.py and
+#cold_start_reddit.py) as coroutines of one event loop sharing one
+#crawl_engine.Fetcher: requests to a host are spaced by its rate limit
+#however many jobs run, and a job waiting for its slot costs no process.
+#CRAWL_CONCURRENCY jobs (default 50) run at once; fetching happens on the
+#loop, storing in worker threads through the in-process bulk writer.
+
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from pyfaktory import Client
+
+from chan_client import ChanClient
+from chan_crawler import FACTORY_SERVER_URL, previous_listing, queue_listing, save_thread
+from reddit_crawler import queue_subreddit_listing, save_comments, save_submission
+from crawl_engine import CONCURRENCY, AsyncChanClient, AsyncConsumer, AsyncRedditJSON, Fetcher
+
+log = logging.getLogger("async crawler")
+
+# seconds between two stats lines
+REPORT_EVERY = 60
+
+fetcher = Fetcher()
+
+
+async def crawl_thread(board, thread_number):
+    client = AsyncChanClient(fetcher)
+    thread = await client.get_thread(board, thread_number, conditional=True)
+    await asyncio.to_thread(save_thread, client, board, thread_number, thread)
+
+
+async def crawl_thread_listing(board, old_threads=None):
+    client = AsyncChanClient(fetcher)
+    listing = await client.get_threads(board, conditional=True)
+    await asyncio.to_thread(queue_listing, client, board, previous_listing(old_threads), listing)
+
+
+async def crawl_subreddit_listing(sub, after=None):
+    payload = await AsyncRedditJSON(fetcher).list_new(sub, after=after, limit=100)
+    await asyncio.to_thread(queue_subreddit_listing, sub, after, payload)
+
+
+async def crawl_submission_json(sub, post_id):
+    thread = await AsyncRedditJSON(fetcher).comments(post_id, sort="new", depth=1, limit=500)
+    await asyncio.to_thread(save_submission, sub, post_id, thread)
+
+
+async def crawl_comments_json(sub, post_id):
+    thread = await AsyncRedditJSON(fetcher).comments(post_id, sort="new", depth=1, limit=500)
+    await asyncio.to_thread(save_comments, sub, post_id, thread)
+
+
+async def report(consumer):
+    while True:
+        await asyncio.sleep(REPORT_EVERY)
+        chan = ChanClient.stats()
+        log.info(f"{consumer.stats['done']} jobs done, {consumer.stats['failed']} failed; "
+                 f"{fetcher.stats['requests']} requests ({fetcher.stats['retries']} retries, "
+                 f"{fetcher.stats['paused']} host pauses), {fetcher.stats['throttled_seconds']:.0f}s "
+                 f"waited for rate limits; {chan['not_modified']} 4chan 304s")
+
+
+async def main():
+    concurrency = int(os.getenv("CRAWL_CONCURRENCY", CONCURRENCY))
+    # the storing halves of the jobs (and the rate limiter's queries) run in threads
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(concurrency + 4))
+    # the first ChanClient opens (and prunes) the shared SQLite validator store
+    await asyncio.to_thread(ChanClient)
+
+    with Client(faktory_url=FACTORY_SERVER_URL, role="consumer") as client:
+        consumer = AsyncConsumer(
+            client,
+            queues=["default", "crawl-thread", "crawl-thread-listing", "reddit-json"],
+            concurrency=concurrency,
+        )
+        consumer.register("crawl_thread", crawl_thread)
+        consumer.register("crawl_thread_listing", crawl_thread_listing)
+        consumer.register("crawl_subreddit_listing", crawl_subreddit_listing)
+        consumer.register("crawl_submission_json", crawl_submission_json)
+        consumer.register("crawl_comments_json", crawl_comments_json)
+        reporter = asyncio.create_task(report(consumer))
+        try:
+            await consumer.run()
+        finally:
+            reporter.cancel()
+            await fetcher.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO))
+    asyncio.run(main())
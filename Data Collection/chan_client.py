@@ -1,6 +1,11 @@
+import json
 import requests
 import logging
 import os
+import sqlite3
+import threading
+import time
+from requests.adapters import HTTPAdapter
 
 # r = requests.get("http://a.4cdn.org/pol/threads.json")
 
@@ -10,6 +15,15 @@ import os
 
 API_BASE_URL = "http://a.4cdn.org"
 
+# Last-Modified/ETag per URL, kept across worker restarts
+VALIDATOR_DB = os.getenv("CHAN_VALIDATOR_DB", "chan_validators.sqlite3")
+# validators of URLs not fetched for this long are dropped (threads die within days)
+VALIDATOR_MAX_AGE = 7 * 24 * 3600
+REQUEST_TIMEOUT = 20
+
+# returned by conditional requests when the content did not change (HTTP 304)
+NOT_MODIFIED = object()
+
 logger = logging.getLogger("4chan client")
 logger.propagate = False
 
@@ -23,14 +37,103 @@ sh.setFormatter(formatter)
 logger.addHandler(sh)
 
 
+class ValidatorStore:
+    """
+    Last-Modified/ETag of previously fetched URLs in a local SQLite file,
+    plus the body size so a 304 can be counted as bytes saved. Shared by
+    every ChanClient (and thread) of the process.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS validators (
+                url TEXT PRIMARY KEY,
+                last_modified TEXT,
+                etag TEXT,
+                size INTEGER NOT NULL,
+                checked_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("DELETE FROM validators WHERE checked_at < ?", (time.time() - VALIDATOR_MAX_AGE,))
+        self.conn.commit()
+
+    def get(self, url):
+        #(last_modified, etag, size) or None
+        with self.lock:
+            return self.conn.execute(
+                "SELECT last_modified, etag, size FROM validators WHERE url = ?", (url,)
+            ).fetchone()
+
+    def put(self, url, last_modified, etag, size):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)",
+                (url, last_modified, etag, size, time.time()),
+            )
+            self.conn.commit()
+
+    def touch(self, url):
+        with self.lock:
+            self.conn.execute("UPDATE validators SET checked_at = ? WHERE url = ?", (time.time(), url))
+            self.conn.commit()
+
+    def delete(self, url):
+        with self.lock:
+            self.conn.execute("DELETE FROM validators WHERE url = ?", (url,))
+            self.conn.commit()
+
+
+# one keep-alive connection pool and validator store per worker process
+_session = None
+_validators = None
+_shared_lock = threading.Lock()
+
+# transfer counters of this process, see ChanClient.stats()
+_stats = {"requests": 0, "not_modified": 0, "bytes_downloaded": 0, "bytes_saved": 0}
+
+
+def _shared():
+    global _session, _validators
+    with _shared_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+            _validators = ValidatorStore(VALIDATOR_DB)
+    return _session, _validators
+
+
+def _count(**deltas):
+    with _shared_lock:
+        for key, value in deltas.items():
+            _stats[key] += value
+
+
 class ChanClient:
-    def get_threads(self, board):
+    """
+    4chan API client over a pooled keep-alive session
+
+    Calls made with conditional=True send the URL's stored If-Modified-Since
+    / If-None-Match and return NOT_MODIFIED on a 304. The validators of a
+    new response are only stored once the caller calls confirm() (i.e. after
+    the content is saved), so a failed job refetches the content in full.
+    """
+
+    def __init__(self):
+        self.session, self.validators = _shared()
+        # url -> (last_modified, etag, size) of responses awaiting confirm()
+        self.pending = {}
+
+    def get_threads(self, board, conditional=False):
         api_call = self.build_request([board, "threads.json"])
-        return self.execute_request(api_call)
+        return self.execute_request(api_call, conditional)
 
-    def get_thread(self, board, thread_number):
+    def get_thread(self, board, thread_number, conditional=False):
         api_call = self.build_request([board, "thread", f"{thread_number}.json"])
-        return self.execute_request(api_call)
+        return self.execute_request(api_call, conditional)
 
     def get_catalog(self, board):
         api_call = self.build_request([board, "catalog.json"])
@@ -54,15 +157,65 @@ class ChanClient:
     This should execute an api call, so go out and actuall do the http get
     """
 
-    def execute_request(self, api_call):
+    def execute_request(self, api_call, conditional=False):
         logger.info(f"api call: {api_call}")
-        r = requests.get(api_call)
-        if r.status_code == 404:
+        headers, stored = self.request_headers(api_call, conditional)
+        r = self.session.get(api_call, headers=headers, timeout=REQUEST_TIMEOUT)
+        return self.handle_response(api_call, conditional, stored, r.status_code, r.headers, r.content)
+
+    # the two halves of a request around the HTTP call, shared with the
+    # asyncio client (crawl_engine.AsyncChanClient)
+
+    def request_headers(self, api_call, conditional):
+        #(headers, stored validators or None) for a request of api_call
+        headers = {}
+        stored = self.validators.get(api_call) if conditional else None
+        if stored:
+            last_modified, etag, _ = stored
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            if etag:
+                headers["If-None-Match"] = etag
+        return headers, stored
+
+    def handle_response(self, api_call, conditional, stored, status, headers, content):
+        #NOT_MODIFIED, {} for a 404, or the parsed JSON body
+        if status == 304 and stored:
+            _count(requests=1, not_modified=1, bytes_saved=stored[2])
+            self.validators.touch(api_call)
+            logger.debug(f"304 for {api_call}")
+            return NOT_MODIFIED
+
+        _count(requests=1, bytes_downloaded=len(content))
+        if status == 404:
             logger.info(f"404 for {api_call}")
+            if conditional:
+                self.validators.delete(api_call)
             return dict()
+        if status >= 400:
+            raise requests.HTTPError(f"{status} for {api_call}")
+
+        last_modified, etag = headers.get("Last-Modified"), headers.get("ETag")
+        if conditional and (last_modified or etag):
+            self.pending[api_call] = (last_modified, etag, len(content))
 
         # logger.info(f"{r.text}")
-        return r.json()
+        return json.loads(content)
+
+    def confirm(self, api_call=None):
+        #store the validators of conditional responses once their content is
+        #saved (all pending ones, or one URL)
+        urls = [api_call] if api_call else list(self.pending)
+        for url in urls:
+            if url in self.pending:
+                self.validators.put(url, *self.pending.pop(url))
+
+    @staticmethod
+    def stats():
+        #process-wide transfer counters: requests, not_modified (304s),
+        #bytes_downloaded and bytes_saved (size of the bodies 304s replaced)
+        with _shared_lock:
+            return dict(_stats)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,7 @@
 import datetime
-from chan_client import ChanClient
+import hashlib
+import json
+from chan_client import NOT_MODIFIED, ChanClient
 import os
 import time
 from pyfaktory import Client, Consumer, Job, Producer
@@ -8,11 +10,17 @@ import logging
 # these three lines allow psycopg to insert a dict into
 # a jsonb coloumn
 import psycopg2
-from psycopg2.extras import Json
+from psycopg2.extras import Json, execute_values
 from psycopg2.extensions import register_adapter
 
 register_adapter(dict, Json)
 
+# shared modules (bulk_writer.py, db.py) live in the repo root
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bulk_writer import get_writer, start_server
+from db import get_pool
+
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -45,6 +53,26 @@ def threads_list_to_thread_number(thread_list):
     return thread_numbers
 
 
+def threads_list_to_last_modified(thread_list):
+    #thread number -> last_modified (unix time of its newest change) of every live thread
+    return {
+        thread["no"]: thread.get("last_modified")
+        for page in thread_list
+        for thread in page["threads"]
+    }
+
+
+def previous_listing(old_threads):
+    #the listing state a rescheduled job carries: {thread: last_modified} with
+    #JSON (string) keys, or a plain thread list from jobs queued before it
+    #had last_modified (those threads count as changed)
+    if not old_threads:
+        return {}
+    if isinstance(old_threads, dict):
+        return {int(thread): last_modified for thread, last_modified in old_threads.items()}
+    return {int(thread): None for thread in old_threads}
+
+
 """enqueue a thread crawl job to get the posts in a thread"""
 
 
@@ -52,7 +80,19 @@ def enqueue_crawl_thread(board, thread_number):
     client = ChanClient()
     # we probably want to save teh output of get_thread somewherE (e.g., database)
     logger.info(f"Getting thread /{board}/{thread_number}")
-    thread = client.get_thread(board, thread_number)
+    # conditional fetch: a thread unchanged since its last stored crawl is a 304
+    thread = client.get_thread(board, thread_number, conditional=True)
+    save_thread(client, board, thread_number, thread)
+
+
+def save_thread(client, board, thread_number, thread):
+    #everything crawl_thread does after the fetch (also run by async_crawler.py)
+    if thread is NOT_MODIFIED:
+        stats = client.stats()
+        logger.info(f"/{board}/{thread_number} not modified, skipped "
+                    f"({stats['not_modified']}/{stats['requests']} requests unchanged, "
+                    f"{stats['bytes_saved'] / 1e6:.1f} MB saved so far)")
+        return
     # id BIGSERIAL NOT NULL,
     # board_name TEXT NOT NULL,
     # thread_number BIGINT NOT NULL,
@@ -67,47 +107,142 @@ def enqueue_crawl_thread(board, thread_number):
         logger.warning("Empty thread!")
         return
 
-    import psycopg2
-    from psycopg2.extras import Json
-    conn = psycopg2.connect(dsn=DATABASE_URL)
-    cur = conn.cursor()
+    inserted, deleted, edited = store_thread(board, thread_number, thread["posts"])
+    # the posts are stored, later crawls may now be answered with 304s
+    client.confirm()
+    logger.info(f"Inserted {inserted} new of {len(thread['posts'])} posts for /{board}/{thread_number}"
+                f" ({deleted} deleted, {edited} edited)")
+
+
+# post fields that change with every reply (counters, bump state) and are
+# not edits of the post itself
+VOLATILE_FIELDS = {"replies", "images", "unique_ips", "last_modified", "bumplimit", "imagelimit", "omitted_posts", "omitted_images"}
+
+
+def edit_hash(posts):
+    #fingerprint of the editable parts of `posts` (text, file deletions, flags)
+    stable = [{k: v for k, v in post.items() if k not in VOLATILE_FIELDS} for post in posts]
+    return hashlib.md5(json.dumps(stable, sort_keys=True).encode()).hexdigest()
+
 
+def post_row(board, thread_number, post):
+    return (board, thread_number, post["no"], datetime.datetime.fromtimestamp(post["time"]), post)
 
-    q = """
-    INSERT INTO posts (board_name, thread_number, post_number, created_at, data)
-    VALUES (%s, %s, %s, %s, %s)
-    ON CONFLICT DO NOTHING
+
+def store_thread(board, thread_number, posts):
+    """
+    Write a fetched thread against the thread's crawl_thread_state:
+    only posts above the stored high-water mark are inserted (and indexed,
+    through the shared bulk writer),
+    posts at or below it that vanished get deleted_at, and when the editable
+    parts of the older posts changed the rows that differ are updated.
+    Returns (inserted, deleted, edited) counts.
+
+    The wait for the bulk writer holds neither a pooled connection nor the
+    state row lock; only the short transaction after it does, so the
+    high-water mark moves once the new posts are committed.
     """
-    rows = []
-    for post in thread["posts"]:
-        post_number = post["no"]
-        created_at = datetime.datetime.fromtimestamp(post["time"])
-        rows.append((board, thread_number, post_number, created_at, post))
-    if rows:
-        cur.executemany(q, rows)
+    pool = get_pool(DATABASE_URL)
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT max_post_number FROM crawl_thread_state
+                WHERE board_name = %s AND thread_number = %s
+            """, (board, thread_number))
+            state = cur.fetchone()
+    high_water = state[0] if state else 0
+
+    # a thread without state may have been stored before the state table
+    # existed, the writer skips posts already in the table (and their index rows)
+    new_posts = [post for post in posts if post["no"] > high_water]
+    inserted = get_writer().write("posts", [post_row(board, thread_number, post) for post in new_posts]).wait()
+
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            # the row is created first so a thread's first crawls have one to
+            # lock too; FOR UPDATE serializes concurrent crawls of the thread
+            cur.execute("""
+                INSERT INTO crawl_thread_state (board_name, thread_number, max_post_number, post_count, edit_hash)
+                VALUES (%s, %s, 0, 0, '')
+                ON CONFLICT DO NOTHING
+            """, (board, thread_number))
+            cur.execute("""
+                SELECT max_post_number, post_count, edit_hash FROM crawl_thread_state
+                WHERE board_name = %s AND thread_number = %s
+                FOR UPDATE
+            """, (board, thread_number))
+            # re-read under the lock: another crawl may have moved it meanwhile
+            high_water, post_count, previous_hash = cur.fetchone()
+            old_posts = [post for post in posts if post["no"] <= high_water]
+
+            deleted = 0
+            if len(old_posts) < post_count:
+                # some posts the last crawl saw are gone from the thread
+                cur.execute("""
+                    UPDATE posts SET deleted_at = now()
+                    WHERE board_name = %s AND thread_number = %s AND post_number <= %s
+                    AND deleted_at IS NULL AND NOT (post_number = ANY(%s))
+                """, (board, thread_number, high_water, [post["no"] for post in old_posts]))
+                deleted = cur.rowcount
+
+            edited = 0
+            old_hash = edit_hash(old_posts)
+            # previous_hash is '' for a thread crawled for the first time
+            if previous_hash and old_hash != previous_hash:
+                # moderator edits, deleted files, closed/sticky OP: rewrite rows whose data differs
+                execute_values(cur, """
+                    UPDATE posts SET data = v.data
+                    FROM (VALUES %s) as v(board_name, thread_number, post_number, created_at, data)
+                    WHERE posts.board_name = v.board_name AND posts.post_number = v.post_number
+                    AND posts.created_at = v.created_at AND posts.data IS DISTINCT FROM v.data
+                """, [post_row(board, thread_number, post) for post in old_posts],
+                    template="(%s, %s, %s, %s, %s::jsonb)", page_size=max(len(old_posts), 1))
+                edited = cur.rowcount
+
+            cur.execute("""
+                UPDATE crawl_thread_state SET
+                    max_post_number = %s, post_count = %s, edit_hash = %s, updated_at = now()
+                WHERE board_name = %s AND thread_number = %s
+            """, (max([high_water] + [post["no"] for post in posts]), len(posts), edit_hash(posts),
+                  board, thread_number))
         conn.commit()
-    cur.close()
-    conn.close()
-    logger.info(f"Inserted {len(rows)} posts for /{board}/{thread_number}")
+
+    return len(inserted), deleted, edited
 
 
 """enqueue a thread list carwl to get the live threads on a board"""
 
 
-def enqueue_crawl_threads_listing(board, old_threads=[]):
-    if old_threads is None:
-        old_threads = []
+def enqueue_crawl_threads_listing(board, old_threads=None):
+    previous = previous_listing(old_threads)
 
     client = ChanClient()
-    current = threads_list_to_thread_number(client.get_threads(board))
+    listing = client.get_threads(board, conditional=True)
+    queue_listing(client, board, previous, listing)
+
+
+def queue_listing(client, board, previous, listing):
+    #everything crawl_thread_listing does after the fetch (also run by async_crawler.py)
+    # threads.json unchanged (304) since the last listing: neither is any thread
+    current = previous if listing is NOT_MODIFIED else threads_list_to_last_modified(listing)
+
+    #only threads that are new or changed since the previous listing need a crawl
+    new_threads = {t for t in current if t not in previous}
+    changed_threads = {
+        t for t, last_modified in current.items()
+        if t in previous and (last_modified is None or previous[t] != last_modified)
+    }
+
+    #get threads that existed before but are gone now, crawled once more for
+    #their final posts (fix error from previous collection system)
+    dead_threads = set(previous) - set(current)
+
+    targets = new_threads | changed_threads | dead_threads
+    skipped = len(current) - len(new_threads) - len(changed_threads)
 
-    #get threads that existed before but are gone now)
-    dead_threads = set(old_threads) - set(current) if old_threads else set()
-    
-    #crawl both current and dead threads (fix error from previous collection system)
-    targets = current.union(dead_threads)
-    
-    logger.info(f"/{board}/ targets to crawl: {len(targets)} ({len(current)} current + {len(dead_threads)} dead)")
+    logger.info(f"/{board}/ targets to crawl: {len(targets)} ({len(new_threads)} new + "
+                f"{len(changed_threads)} changed + {len(dead_threads)} dead), "
+                f"skipped {skipped} unchanged of {len(current)} live")
 
     if targets:
         with Client(faktory_url=FACTORY_SERVER_URL, role="producer") as c:
@@ -120,10 +255,12 @@ def enqueue_crawl_threads_listing(board, old_threads=[]):
     with Client(faktory_url=FACTORY_SERVER_URL, role="producer") as c:
         Producer(client=c).push(Job(
             jobtype="crawl_thread_listing",
-            args=(board, list(current)),
+            args=(board, {str(t): last_modified for t, last_modified in current.items()}),
             queue="crawl-thread-listing",
             at=run_at,
         ))
+    # this listing is acted on, the next one may be answered with a 304
+    client.confirm()
 
 
 """Get a set of the threads that are now dead"""
@@ -158,7 +295,13 @@ if __name__ == "__main__":
         )
         consumer.register("crawl_thread", enqueue_crawl_thread)
         consumer.register("crawl_thread_listing", enqueue_crawl_threads_listing)
-        consumer.run()
+        # started before the consumer forks its pool processes, which all
+        # write their posts through it
+        writer = start_server(DATABASE_URL)
+        try:
+            consumer.run()
+        finally:
+            writer.stop()
 
     # print(f"we found dead threads: {dead_threads}")
     # loop until we've discovered some new thread
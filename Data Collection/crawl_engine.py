@@ -0,0 +1,354 @@
+#Asyncio fetch engine shared by the crawl jobs of one process
+#
+#- Fetcher: one pooled HTTP client that every job awaits (aiohttp when it is
+#  installed, otherwise the requests session driven from worker threads)
+#- per-host rate limits (HOST_LIMITS) as token buckets, kept with the GCRA:
+#  one "theoretical arrival time" (tat) per host that every request pushes
+#  back by the host's interval. PostgresLimiter keeps it in crawl_rate_limits
+#  (migrations/20261017160000_create_crawl_rate_limits.sql) so all crawler
+#  processes share one budget per host; LocalLimiter keeps it in memory
+#- a 429 (or a Reddit 403 sent with Retry-After) pauses the host for every
+#  job, not just the one that got it; any other 403 drops only its own job
+#  (logged, no payload, like the blocking RedditJSON)
+#- AsyncChanClient / AsyncRedditJSON: the existing clients with awaitable
+#  requests, AsyncConsumer: a Faktory worker for coroutine job handlers
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import logging
+import traceback
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from pyfaktory.util.enums import State
+
+from chan_client import ChanClient, REQUEST_TIMEOUT
+from reddit_client import RedditJSON
+
+# shared modules (db.py) live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from db import get_pool
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# failures of a request that are retried
+TRANSPORT_ERRORS = (requests.RequestException, asyncio.TimeoutError) + ((aiohttp.ClientError,) if aiohttp else ())
+
+log = logging.getLogger("crawl engine")
+
+# host -> (requests per second, burst): 4chan allows one request per second,
+# Reddit's JSON endpoints about as much for unauthenticated clients
+HOST_LIMITS = {
+    "a.4cdn.org": (float(os.getenv("CHAN_REQUESTS_PER_SECOND", 1.0)), 1),
+    "www.reddit.com": (float(os.getenv("REDDIT_REQUESTS_PER_SECOND", 1.0)), 1),
+}
+# any other host
+DEFAULT_LIMIT = (1.0, 1)
+
+# open connections of one Fetcher, across hosts
+CONNECTIONS = 20
+# tries per request (network errors, 5xx and backoff statuses are retried)
+ATTEMPTS = 6
+# jobs an AsyncConsumer runs at once
+CONCURRENCY = 50
+
+Response = namedtuple("Response", "status headers content")
+
+
+class FetchFailed(RuntimeError):
+    #every attempt of a request failed
+    pass
+
+
+def host_limit(host):
+    #(seconds between requests, burst) of host
+    rate, burst = HOST_LIMITS.get(host, DEFAULT_LIMIT)
+    if rate <= 0 or burst < 1:
+        raise ValueError(f"invalid rate limit for {host}: {rate} requests/s, burst {burst}")
+    return 1.0 / rate, burst
+
+
+class LocalLimiter:
+    #per-host GCRA buckets of this process
+
+    def __init__(self):
+        self.tat = {}
+
+    def _reserve(self, host):
+        interval, burst = host_limit(host)
+        now = time.monotonic()
+        tat = max(self.tat.get(host, now), now)
+        self.tat[host] = tat + interval
+        return max(tat - (burst - 1) * interval - now, 0.0)
+
+    def _penalize(self, host, seconds):
+        interval, burst = host_limit(host)
+        pause_until = time.monotonic() + seconds + (burst - 1) * interval
+        self.tat[host] = max(self.tat.get(host, pause_until), pause_until)
+
+    async def acquire(self, host):
+        #wait for host's next slot; returns the seconds waited
+        wait = self._reserve(host)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    async def penalize(self, host, seconds):
+        #no request to host for `seconds`
+        self._penalize(host, seconds)
+
+
+class PostgresLimiter:
+    """
+    Per-host GCRA buckets in the crawl_rate_limits table: a slot is
+    reserved with one atomic upsert, so processes on any machine that share
+    the database never exceed a host's limit together
+    """
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    def _reserve(self, host):
+        interval, burst = host_limit(host)
+        with get_pool(self.dsn).connection() as conn:
+            with conn.cursor() as cur:
+                # the slot starts at the old tat (or now), the burst lets
+                # requests go up to burst - 1 intervals before their slot
+                cur.execute("""
+                    INSERT INTO crawl_rate_limits AS l (host, tat)
+                    VALUES (%(host)s, clock_timestamp() + make_interval(secs => %(interval)s))
+                    ON CONFLICT (host) DO UPDATE
+                    SET tat = greatest(l.tat, clock_timestamp()) + make_interval(secs => %(interval)s)
+                    RETURNING greatest(extract(epoch FROM tat - clock_timestamp()) - %(interval)s - %(tolerance)s, 0)
+                """, {"host": host, "interval": interval, "tolerance": (burst - 1) * interval})
+                wait = float(cur.fetchone()[0])
+            conn.commit()
+        return wait
+
+    def _penalize(self, host, seconds):
+        interval, burst = host_limit(host)
+        with get_pool(self.dsn).connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO crawl_rate_limits AS l (host, tat)
+                    VALUES (%s, clock_timestamp() + make_interval(secs => %s))
+                    ON CONFLICT (host) DO UPDATE SET tat = greatest(l.tat, EXCLUDED.tat)
+                """, (host, seconds + (burst - 1) * interval))
+            conn.commit()
+
+    async def acquire(self, host):
+        wait = await asyncio.to_thread(self._reserve, host)
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    async def penalize(self, host, seconds):
+        await asyncio.to_thread(self._penalize, host, seconds)
+
+
+def get_limiter():
+    #CRAWL_RATE_LIMITER: postgres (default, shared by all processes) or local
+    kind = os.getenv("CRAWL_RATE_LIMITER", "postgres")
+    if kind == "local":
+        return LocalLimiter()
+    if kind != "postgres":
+        raise ValueError(f"unknown CRAWL_RATE_LIMITER {kind!r}, use postgres or local")
+    dsn = os.getenv("DATABASE_URL")
+    if not dsn:
+        raise ValueError("DATABASE_URL not found in environment variables!")
+    return PostgresLimiter(dsn)
+
+
+class Fetcher:
+    """
+    Rate-limited GET over one pooled HTTP client, shared by all jobs of the
+    event loop. Network errors and 5xx are retried with backoff, statuses
+    in backoff_statuses pause the whole host (Retry-After when sent), and
+    statuses in retry_after_statuses pause it only when Retry-After is sent;
+    otherwise they are returned to the caller like any other response.
+
+    - stats: requests, retries, throttled_seconds (time jobs waited for a
+      slot) and paused (backoff statuses received)
+    """
+
+    def __init__(self, limiter=None, connections=CONNECTIONS):
+        self.limiter = limiter or get_limiter()
+        self.connections = connections
+        self.session = None
+        self.stats = {"requests": 0, "retries": 0, "throttled_seconds": 0.0, "paused": 0}
+
+    async def get(self, url, params=None, headers=None, backoff_statuses=(429,), retry_after_statuses=()):
+        host = urlsplit(url).hostname
+        for attempt in range(ATTEMPTS):
+            if attempt:
+                self.stats["retries"] += 1
+            self.stats["throttled_seconds"] += await self.limiter.acquire(host)
+            self.stats["requests"] += 1
+            try:
+                response = await self._get(url, params, headers)
+            except TRANSPORT_ERRORS as e:
+                wait = min(30, 2 ** attempt) + random.uniform(0, 0.5)
+                log.warning(f"HTTP error {e!r} on {url}; retry in {wait:.1f}s")
+                await asyncio.sleep(wait)
+                continue
+
+            retry_after = response.headers.get("Retry-After", "")
+            if response.status in backoff_statuses or (response.status in retry_after_statuses and retry_after):
+                wait = float(retry_after) if retry_after.isdigit() else min(60, 2 ** attempt) + random.uniform(0, 0.5)
+                log.warning(f"{response.status} on {url}; pausing {host} for {wait:.1f}s")
+                self.stats["paused"] += 1
+                await self.limiter.penalize(host, wait)
+                continue
+            if response.status >= 500:
+                wait = min(30, 2 ** attempt) + random.uniform(0, 0.5)
+                log.warning(f"{response.status} on {url}; retry in {wait:.1f}s")
+                await asyncio.sleep(wait)
+                continue
+            return response
+        raise FetchFailed(f"giving up on {url} after {ATTEMPTS} attempts")
+
+    async def _get(self, url, params, headers):
+        if aiohttp is None:
+            if self.session is None:
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.connections)
+                self.session.mount("http://", adapter)
+                self.session.mount("https://", adapter)
+            r = await asyncio.to_thread(self.session.get, url, params=params, headers=headers,
+                                        timeout=REQUEST_TIMEOUT)
+            return Response(r.status_code, r.headers, r.content)
+
+        if self.session is None:
+            # created on first use, inside the running loop
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+            )
+        async with self.session.get(url, params=params, headers=headers) as r:
+            return Response(r.status, r.headers, await r.read())
+
+    async def close(self):
+        if self.session is not None:
+            if aiohttp is None:
+                self.session.close()
+            else:
+                await self.session.close()
+            self.session = None
+
+
+class AsyncChanClient(ChanClient):
+    #ChanClient whose get_* calls are awaited: same validators, confirm() and stats()
+    #the validator store is SQLite (commits, busy timeout), so both halves
+    #around the HTTP call run in a worker thread, never on the loop
+
+    def __init__(self, fetcher):
+        super().__init__()
+        self.fetcher = fetcher
+
+    async def execute_request(self, api_call, conditional=False):
+        log.debug(f"api call: {api_call}")
+        headers, stored = await asyncio.to_thread(self.request_headers, api_call, conditional)
+        r = await self.fetcher.get(api_call, headers=headers)
+        return await asyncio.to_thread(self.handle_response, api_call, conditional, stored,
+                                       r.status, r.headers, r.content)
+
+
+class AsyncRedditJSON(RedditJSON):
+    #RedditJSON whose list_new/comments are awaited; None when a request
+    #fails like the blocking client, but without its per-process sleeps
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+
+    async def _get(self, url, **kwargs):
+        try:
+            r = await self.fetcher.get(url, params=kwargs.get("params"), retry_after_statuses=(403,))
+        except FetchFailed as e:
+            log.error(str(e))
+            return None
+        if r.status >= 400:
+            log.error(f"{r.status} on {url}")
+            return None
+        return json.loads(r.content)
+
+
+class AsyncConsumer:
+    """
+    Faktory worker for coroutine handlers: up to `concurrency` jobs run as
+    tasks of one event loop. As with pyfaktory's Consumer a job is acked
+    when its handler returns and failed (with its traceback) when it
+    raises. On SIGINT/SIGTERM no further jobs are fetched and the running
+    ones get grace_period seconds; jobs still running after it are
+    cancelled and Faktory hands them out again once their reservation expires.
+    """
+
+    def __init__(self, client, queues, concurrency=CONCURRENCY, grace_period=25):
+        self.client = client
+        self.queues = list(queues)
+        self.concurrency = concurrency
+        self.grace_period = grace_period
+        self.handlers = {}
+        self.stats = {"done": 0, "failed": 0}
+
+    def register(self, name, handler):
+        self.handlers[name] = handler
+        log.info(f"Registered handler for jobtype: {name}")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        running = set()
+        while not stop.is_set() and self.client.state in (State.IDENTIFIED, State.QUIET):
+            if self.client.state == State.QUIET:
+                # quieted from the Faktory web UI: finish, but fetch nothing
+                await asyncio.sleep(1)
+                continue
+            if len(running) >= self.concurrency:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                continue
+            # blocks for up to 2 seconds when the queues are empty
+            job = await asyncio.to_thread(self.client._fetch, random.sample(self.queues, len(self.queues)))
+            if job:
+                task = asyncio.create_task(self._perform(job))
+                running.add(task)
+                task.add_done_callback(running.discard)
+
+        if running:
+            log.info(f"Stopping, {len(running)} jobs get {self.grace_period}s to finish")
+            _, pending = await asyncio.wait(running, timeout=self.grace_period)
+            for task in pending:
+                task.cancel()
+        log.info(f"Run loop exited after {self.stats['done']} jobs done, {self.stats['failed']} failed")
+
+    async def _perform(self, job):
+        jid, jobtype = job.get("jid"), job.get("jobtype")
+        try:
+            handler = self.handlers.get(jobtype)
+            if handler is None:
+                raise ValueError(f"'{jobtype}' has no registered handler")
+            await handler(*job.get("args", []))
+        except Exception as e:
+            self.stats["failed"] += 1
+            log.warning(f"Job {jid} ({jobtype}) raised {type(e).__name__}: {e}")
+            report = (self.client._fail, jid, type(e).__name__, str(e),
+                      traceback.format_tb(e.__traceback__, limit=job.get("backtrace", 0)))
+        else:
+            self.stats["done"] += 1
+            report = (self.client._ack, jid)
+        try:
+            await asyncio.to_thread(*report)
+        except Exception as e:
+            log.error(f"Could not report job {jid} to Faktory: {e}")
@@ -1,8 +1,14 @@
 import os
+import sys
 import psycopg2
 import csv
 from dotenv import load_dotenv
 
+# shared modules (keyword_index.py, keyword_matcher.py) live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from keyword_index import keyword_params, keyword_posts_sql, matching_posts_sql
+from keyword_matcher import KeywordMatcher
+
 load_dotenv()
 
 #keywords based on whats happening rn
@@ -11,33 +17,31 @@ KEYWORDS = ['ukraine', 'russia', 'putin', 'zelensky', 'gaza', 'israel', 'hamas',
 def get_4chan_posts(conn, keywords):
     cur = conn.cursor()
     
-    #build the where clause with OR for each keyword
-    conditions = []
-    for k in keywords:
-        conditions.append(f"data::text ILIKE '%{k}%'")
-    where_clause = " OR ".join(conditions)
-    
+    #posts matching any keyword come straight from the inverted index
     query = f"""
-    SELECT board_name, thread_number, post_number, created_at, data->>'com' as comment_text
-    FROM posts
-    WHERE {where_clause}
-    ORDER BY created_at
+    SELECT p.board_name, p.thread_number, p.post_number, p.created_at, p.data->>'com' as comment_text
+    FROM {matching_posts_sql('posts')}
+    ORDER BY p.created_at
     """
     
-    cur.execute(query)
+    cur.execute(query, keyword_params(keywords))
     rows = cur.fetchall()
     
+    #tag each post with the keywords it mentions, before the text is truncated
+    matcher = KeywordMatcher(keywords)
+    
     # save to csv
     with open('filtered_4chan.csv', 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(['board', 'thread', 'post', 'timestamp', 'text', 'platform'])
+        writer.writerow(['board', 'thread', 'post', 'timestamp', 'text', 'platform', 'keywords'])
         
         for row in rows:
             board, thread, post_num, timestamp, text = row
+            found = ';'.join(matcher.names(matcher.mask(text)))
             # clean up the text a bit
             if text:
                 text = text.replace('\n', ' ')[:500]
-            writer.writerow([board, thread, post_num, timestamp, text, '4chan'])
+            writer.writerow([board, thread, post_num, timestamp, text, '4chan', found])
     
     print(f"\nsaved {len(rows)} 4chan posts")
     cur.close()
@@ -46,32 +50,30 @@ def get_4chan_posts(conn, keywords):
 def get_reddit_posts(conn, keywords):
     cur = conn.cursor()
     
-    conditions = []
-    for k in keywords:
-        conditions.append(f"data::text ILIKE '%{k}%'")
-    where_clause = " OR ".join(conditions)
-    
+    #posts matching any keyword come straight from the inverted index
     query = f"""
-    SELECT subreddit, post_id, created_at, title, data->>'selftext' as body
-    FROM reddit_posts
-    WHERE {where_clause}
-    ORDER BY created_at
+    SELECT p.subreddit, p.post_id, p.created_at, p.title, p.data->>'selftext' as body
+    FROM {matching_posts_sql('reddit_posts')}
+    ORDER BY p.created_at
     """
 
-    cur.execute(query)
+    cur.execute(query, keyword_params(keywords))
     rows = cur.fetchall()
     
+    matcher = KeywordMatcher(keywords)
+    
     with open('filtered_reddit.csv', 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(['subreddit', 'post_id', 'timestamp', 'title', 'body', 'platform'])
+        writer.writerow(['subreddit', 'post_id', 'timestamp', 'title', 'body', 'platform', 'keywords'])
         
         for row in rows:
             subreddit, post_id, timestamp, title, body = row
+            found = ';'.join(matcher.names(matcher.mask(f"{title or ''} {body or ''}")))
             if title:
                 title = title.replace('\n', ' ')[:200]
             if body:
                 body = body.replace('\n', ' ')[:500]
-            writer.writerow([subreddit, post_id, timestamp, title, body, 'reddit'])
+            writer.writerow([subreddit, post_id, timestamp, title, body, 'reddit', found])
     
     print(f"saved {len(rows)} reddit posts")
     cur.close()
@@ -80,30 +82,28 @@ def get_reddit_posts(conn, keywords):
 def get_reddit_comments(conn, keywords):
     cur = conn.cursor()
     
-    conditions = []
-    for k in keywords:
-        conditions.append(f"data::text ILIKE '%{k}%'")
-    where_clause = " OR ".join(conditions)
-    
+    #posts matching any keyword come straight from the inverted index
     query = f"""
-    SELECT subreddit, post_id, comment_id, created_at, data->>'body' as body
-    FROM reddit_comments
-    WHERE {where_clause}
-    ORDER BY created_at
+    SELECT p.subreddit, p.post_id, p.comment_id, p.created_at, p.data->>'body' as body
+    FROM {matching_posts_sql('reddit_comments')}
+    ORDER BY p.created_at
     """
     
-    cur.execute(query)
+    cur.execute(query, keyword_params(keywords))
     rows = cur.fetchall()
     
+    matcher = KeywordMatcher(keywords)
+    
     with open('filtered_reddit_comments.csv', 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow(['subreddit', 'post_id', 'comment_id', 'timestamp', 'body', 'platform'])
+        writer.writerow(['subreddit', 'post_id', 'comment_id', 'timestamp', 'body', 'platform', 'keywords'])
         
         for row in rows:
             subreddit, post_id, comment_id, timestamp, body = row
+            found = ';'.join(matcher.names(matcher.mask(body)))
             if body:
                 body = body.replace('\n', ' ')[:500]
-            writer.writerow([subreddit, post_id, comment_id, timestamp, body, 'reddit'])
+            writer.writerow([subreddit, post_id, comment_id, timestamp, body, 'reddit', found])
     
     print(f"saved {len(rows)} reddit comments")
     cur.close()
@@ -117,17 +117,22 @@ def print_keyword_stats(conn):
     print(f"{'Keyword':<15} {'4chan':<10} {'Reddit Posts':<15} {'Reddit Comments':<15} {'Total'}")
     print("-" * 70)
     
+    #one index lookup per keyword and source instead of a full table scan
+    count_query = "SELECT COUNT(*) FROM ({}) as hits"
+    
     for keyword in KEYWORDS:
+        params = keyword_params([keyword])
+        
         # count in 4chan
-        cur.execute(f"SELECT COUNT(*) FROM posts WHERE data::text ILIKE '%{keyword}%'")
+        cur.execute(count_query.format(keyword_posts_sql('posts')), params)
         chan_count = cur.fetchone()[0]
         
         # count in reddit posts
-        cur.execute(f"SELECT COUNT(*) FROM reddit_posts WHERE data::text ILIKE '%{keyword}%'")
+        cur.execute(count_query.format(keyword_posts_sql('reddit_posts')), params)
         reddit_posts = cur.fetchone()[0]
         
         # count in reddit comments
-        cur.execute(f"SELECT COUNT(*) FROM reddit_comments WHERE data::text ILIKE '%{keyword}%'")
+        cur.execute(count_query.format(keyword_posts_sql('reddit_comments')), params)
         reddit_comments = cur.fetchone()[0]
         
         total = chan_count + reddit_posts + reddit_comments
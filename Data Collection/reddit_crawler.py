@@ -1,13 +1,14 @@
-import os, datetime, logging, psycopg2
-from psycopg2.extras import Json
-from psycopg2.extensions import register_adapter
+import os, sys, datetime, logging
 
 from pyfaktory import Client, Consumer, Producer, Job
 from reddit_client import RedditJSON
 
+# shared modules (bulk_writer.py) live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bulk_writer import get_writer, start_server
+
 from dotenv import load_dotenv
 
-register_adapter(dict, Json)
 load_dotenv()
 
 logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL","INFO").upper(), 20))
@@ -19,6 +20,11 @@ FACTORY_SERVER_URL = os.getenv("FACTORY_SERVER_URL")
 def crawl_subreddit_listing(sub, after=None):
     rc = RedditJSON()
     payload = rc.list_new(sub, after=after, limit=100)
+    queue_subreddit_listing(sub, after, payload)
+
+# the parts of the jobs after their fetch, also run by async_crawler.py
+
+def queue_subreddit_listing(sub, after, payload):
     if not payload or "data" not in payload:
         log.warning(f"no listing data for r/{sub} after={after}")
         return
@@ -50,22 +56,19 @@ def crawl_subreddit_listing(sub, after=None):
 def crawl_submission_json(sub, post_id):
     rc = RedditJSON()
     thread = rc.comments(post_id, sort="new", depth=1, limit=500)
+    save_submission(sub, post_id, thread)
+
+def save_submission(sub, post_id, thread):
     if not thread or not isinstance(thread, list) or not thread[0]["data"]["children"]:
         log.info(f"no submission body for r/{sub} {post_id}")
         return
 
     submission = thread[0]["data"]["children"][0]["data"]
 
-    conn = psycopg2.connect(dsn=DATABASE_URL); cur = conn.cursor()
-    q = """
-    INSERT INTO reddit_posts (subreddit, post_id, created_at, author, title, data) VALUES (%s,%s,%s,%s,%s,%s)
-    ON CONFLICT (created_at, subreddit, post_id) DO NOTHING
-    """
     created = datetime.datetime.utcfromtimestamp(submission["created_utc"]).replace(tzinfo=datetime.timezone.utc)
-    cur.execute(q, (sub, post_id, created, submission.get("author"), submission.get("title"), Json(submission)))
-    conn.commit(); 
-    cur.close(); 
-    conn.close()
+    # batched with the other jobs' rows, indexed if new; returns once committed
+    get_writer().write("reddit_posts", [(sub, post_id, created, submission.get("author"),
+                                         submission.get("title"), submission)]).wait()
 
     # enqueue comments crawl
     with Client(faktory_url=FACTORY_SERVER_URL, role="producer") as c:
@@ -74,15 +77,13 @@ def crawl_submission_json(sub, post_id):
 def crawl_comments_json(sub, post_id):
     rc = RedditJSON()
     thread = rc.comments(post_id, sort="new", depth=1, limit=500)
+    save_comments(sub, post_id, thread)
+
+def save_comments(sub, post_id, thread):
     if not thread or len(thread) < 2:
         return
     comments = thread[1]["data"]["children"]
 
-    conn = psycopg2.connect(dsn=DATABASE_URL); cur = conn.cursor()
-    q = """
-    INSERT INTO reddit_comments (subreddit, post_id, comment_id, created_at, data) VALUES (%s,%s,%s,%s,%s)
-    ON CONFLICT (created_at, post_id, comment_id) DO NOTHING
-    """
     rows = []
     for c in comments:
         if c.get("kind") != "t1": 
@@ -90,11 +91,9 @@ def crawl_comments_json(sub, post_id):
         d = c["data"]
         cid = d["id"]
         created = datetime.datetime.utcfromtimestamp(d["created_utc"]).replace(tzinfo=datetime.timezone.utc)
-        rows.append((sub, post_id, cid, created, Json(d)))
-    if rows:
-        cur.executemany(q, rows); 
-        conn.commit()
-    cur.close(); conn.close()
+        rows.append((sub, post_id, cid, created, d))
+    inserted = get_writer().write("reddit_comments", rows).wait()
+    log.info(f"inserted {len(inserted)} new of {len(rows)} comments for r/{sub} {post_id}")
 
 if __name__ == "__main__":
     with Client(faktory_url=FACTORY_SERVER_URL, role="consumer") as cl:
@@ -102,4 +101,9 @@ if __name__ == "__main__":
         consumer.register("crawl_subreddit_listing", crawl_subreddit_listing)
         consumer.register("crawl_submission_json", crawl_submission_json)
         consumer.register("crawl_comments_json", crawl_comments_json)
-        consumer.run()
+        # one writer process batches the rows of all pool processes
+        writer = start_server(DATABASE_URL)
+        try:
+            consumer.run()
+        finally:
+            writer.stop()
@@ -1,11 +1,19 @@
 import os
+import sys
 import csv
 import matplotlib.pyplot as plt
 import numpy as np
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
+# shared modules (keyword_matcher.py) live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from keyword_matcher import KeywordMatcher
+
+KEYWORDS = ['ukraine', 'gaza', 'israel', 'taiwan', 'election', 'trump', 'russia']
+
 def analyze_sentiment(csv_file, platform):
     analyzer = SentimentIntensityAnalyzer()
+    matcher = KeywordMatcher(KEYWORDS)
     scores = []
     keyword_scores = {}
 
@@ -28,11 +36,9 @@ def analyze_sentiment(csv_file, platform):
             compound = result['compound']
             scores.append(compound)
 
-            text_lower = text.lower()
-            keywords = ['ukraine', 'gaza', 'israel', 'taiwan', 'election', 'trump', 'russia']
-            for kw in keywords:
-                if kw in text_lower:
-                    keyword_scores.setdefault(kw, []).append(compound)
+            #one pass over the text for all keywords (whole words + plurals)
+            for kw in matcher.names(matcher.mask(text)):
+                keyword_scores.setdefault(kw, []).append(compound)
 
     return scores, keyword_scores
 
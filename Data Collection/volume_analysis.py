@@ -1,4 +1,5 @@
 import os
+import sys
 import psycopg2
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
@@ -7,6 +8,10 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+# shared modules (keyword_index.py) live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from keyword_index import keyword_params, matching_posts_sql
+
 def plot_collection_over_time(conn):
     #this makes the plot showing how much data we collected over time
     cur = conn.cursor()
@@ -120,24 +125,24 @@ def plot_keyword_trends(conn):
         axes = [axes]
     
     for i, keyword in enumerate(keywords):
+        terms = keyword_params([keyword])
+        
         # 4chan mentions per day
         cur.execute(f"""
-            SELECT date_trunc('day', created_at) as day, COUNT(*) as count
-            FROM posts
-            WHERE data::text ILIKE '%{keyword}%'
+            SELECT date_trunc('day', p.created_at) as day, COUNT(*) as count
+            FROM {matching_posts_sql('posts')}
             GROUP BY day
             ORDER BY day
-        """)
+        """, terms)
         chan_data = cur.fetchall()
         
         # reddit mentions per day
         cur.execute(f"""
-            SELECT date_trunc('day', created_at) as day, COUNT(*) as count
-            FROM reddit_posts
-            WHERE data::text ILIKE '%{keyword}%'
+            SELECT date_trunc('day', p.created_at) as day, COUNT(*) as count
+            FROM {matching_posts_sql('reddit_posts')}
             GROUP BY day
             ORDER BY day
-        """)
+        """, terms)
         reddit_data = cur.fetchall()
         
         ax = axes[i]
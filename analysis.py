@@ -1,80 +1,343 @@
 import os
-import psycopg2
+import math
+import time
+import threading
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer, ENGLISH_STOP_WORDS
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from db import get_pool
+from metrics import metrics
+from sketch import KLLSketch, SketchStore
+from keyword_index import keyword_hits_sql, keyword_params
+from tfidf_model import ModelFile, TfidfModel
+
+# histogram bins shown on the dashboard, and points on the sketch-based CDF
+HISTOGRAM_BINS = 20
+CDF_POINTS = 200
+
+# most thresholds one contrastive-terms sweep may ask for
+MAX_THRESHOLDS = 101
+
+# Perspective API attributes, stored as typed columns on every table
+# (migrations/20261017130000_add_toxicity_columns.sql)
+ATTRIBUTES = ['toxicity', 'severe_toxicity', 'identity_attack',
+              'insult', 'profanity', 'threat']
+
+# hourly continuous aggregates, see migrations/*_create_toxicity_rollups.sql
+ROLLUP_VIEWS = [
+    ('4chan', 'posts_toxicity_hourly'),
+    ('reddit', 'reddit_posts_toxicity_hourly'),
+    ('reddit', 'reddit_comments_toxicity_hourly'),
+]
+
+# raw tables behind each dashboard platform
+PLATFORM_TABLES = [
+    ('4chan', 'posts'),
+    ('reddit', 'reddit_posts'),
+    ('reddit', 'reddit_comments'),
+]
+
+# board / subreddit column per table, usable as {community} in query columns
+COMMUNITY_COLUMNS = {
+    'posts': 'board_name',
+    'reddit_posts': 'subreddit',
+    'reddit_comments': 'subreddit',
+}
+
+# optional group-by dimensions for the multi-attribute breakdown
+BREAKDOWNS = (None, 'community', 'day')
+
+# accuracy='fast' answers from a block sample of about this many rows,
+# with 95% confidence intervals (z below)
+ACCURACY_MODES = ('exact', 'fast')
+FAST_SAMPLE_ROWS = 200000
+CONFIDENCE_Z = 1.96
+# seconds a table row-count estimate is reused
+ROW_ESTIMATE_TTL = 300
+
+# type of the time column per table/rollup: posts.created_at is TIMESTAMP,
+# the reddit tables use TIMESTAMPTZ (bucket inherits it in the rollups)
+TIME_TYPES = {
+    'posts': 'timestamp',
+    'reddit_posts': 'timestamptz',
+    'reddit_comments': 'timestamptz',
+    'posts_toxicity_hourly': 'timestamp',
+    'reddit_posts_toxicity_hourly': 'timestamptz',
+    'reddit_comments_toxicity_hourly': 'timestamptz',
+}
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError(f"invalid date {value!r}, expected YYYY-MM-DD")
+
+
+def date_params(start_date=None, end_date=None):
+    #query parameters for an inclusive start_date..end_date filter, as the
+    #half-open range [start_date, end_date + 1 day)
+    params = {}
+    if start_date:
+        params['range_start'] = _as_date(start_date)
+    if end_date:
+        params['range_end'] = _as_date(end_date) + timedelta(days=1)
+    return params
+
+
+def date_range(table, params, column='created_at'):
+    #predicates on the raw time column (no DATE() wrapper, so Timescale can
+    #exclude chunks); bounds are cast to the column's own type so TIMESTAMP
+    #and TIMESTAMPTZ tables both compare against local calendar days
+    cast = TIME_TYPES[table]
+    conditions = []
+    if 'range_start' in params:
+        conditions.append(f"{column} >= %(range_start)s::{cast}")
+    if 'range_end' in params:
+        conditions.append(f"{column} < %(range_end)s::{cast}")
+    return conditions
+
+
+def scored_rows_query(platform, columns, start_date=None, end_date=None, sample=None):
+    #UNION ALL of the scored rows of every table behind `platform` as
+    #(columns..., platform); returns (sql, params)
+    #columns may refer to the table's board/subreddit column as {community}
+    #sample: a Sample to read only part of each table
+    params = date_params(start_date, end_date)
+    tablesample = sample.clause() if sample else ''
+    queries = []
+    for plat, table in PLATFORM_TABLES:
+        if platform in [plat, 'all']:
+            conditions = ['toxicity IS NOT NULL'] + date_range(table, params)
+            select = ', '.join(columns).replace('{community}', COMMUNITY_COLUMNS[table])
+            queries.append(f"""
+                SELECT {select}, '{plat}' as platform
+                FROM {table} {tablesample}
+                WHERE {' AND '.join(conditions)}
+            """)
+    if not queries:
+        raise ValueError(f"unknown platform {platform!r}, use 4chan, reddit or all")
+    return " UNION ALL ".join(queries), params
+
+
+class Sample:
+    """
+    Block sample behind a fast (approximate) answer
+
+    TABLESAMPLE SYSTEM reads `percent` of each table's pages. The fixed
+    REPEATABLE seed makes every query of one answer read the same pages, so
+    keyword hits and group totals come from the same rows, and repeating a
+    click gives the same estimate. Intervals treat the sampled rows as
+    independent, which understates the spread when similar posts share pages.
+    """
+    
+    SEED = 17
+    
+    def __init__(self, percent):
+        self.percent = percent
+        self.fraction = percent / 100
+    
+    def clause(self):
+        return f"TABLESAMPLE SYSTEM ({self.percent:.6f}) REPEATABLE ({self.SEED})"
+    
+    def scale(self, n):
+        #population count estimated from n sampled rows
+        return n / self.fraction
+    
+    def count_ci(self, n):
+        #95% interval (low, high) of that estimate (Poisson), n may be an array
+        n = np.asarray(n, dtype=float)
+        half = CONFIDENCE_Z * np.sqrt(n)
+        return np.maximum(n - half, 0) / self.fraction, (n + half) / self.fraction
+    
+    def info(self):
+        return {'mode': 'fast', 'sampled': True, 'sample_percent': self.percent,
+                'confidence': 0.95}
+
+
+def check_accuracy(accuracy):
+    if accuracy not in ACCURACY_MODES:
+        raise ValueError(f"unknown accuracy {accuracy!r}, use exact or fast")
+
+
+def mean_ci(n, total, total_sq):
+    #95% interval of a mean from the sampled count, sum and sum of squares
+    if n < 2:
+        return [None, None]
+    mean = total / n
+    variance = max(total_sq - n * mean * mean, 0) / (n - 1)
+    half = CONFIDENCE_Z * math.sqrt(variance / n)
+    return [float(mean - half), float(mean + half)]
+
+
+def proportion_ci(hits, n):
+    #95% Wilson interval of hits / n
+    if n == 0:
+        return [None, None]
+    z2 = CONFIDENCE_Z ** 2
+    p = hits / n
+    center = (p + z2 / (2 * n)) / (1 + z2 / n)
+    half = CONFIDENCE_Z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n)) / (1 + z2 / n)
+    return [max(center - half, 0.0), min(center + half, 1.0)]
+
 
 class ToxicityAnalyzer:
     
-    def __init__(self):
+    def __init__(self, pool=None, use_rollups=None):
         self.database_url = os.getenv('DATABASE_URL')
         if not self.database_url:
             raise ValueError("DATABASE_URL not found in environment variables!")
+        # share the app's pool when given one, otherwise the process-wide pool
+        self.pool = pool or get_pool(self.database_url)
+        self.sketch_store = SketchStore()
+        # read date-filtered aggregates from the hourly rollups (USE_ROLLUPS=0 to disable)
+        if use_rollups is None:
+            use_rollups = os.getenv('USE_ROLLUPS', '1') != '0'
+        self.use_rollups = use_rollups
+        self._trace = threading.local()
+        # corpus-wide term counts kept by tfidf_model.py (None until built)
+        self.tfidf_model = ModelFile()
+        # rows a fast answer samples, and the cached table size estimates
+        self.fast_sample_rows = int(os.getenv('FAST_SAMPLE_ROWS', FAST_SAMPLE_ROWS))
+        self._row_estimates = (0.0, {})
     
     def get_connection(self):
-        #create a database connection
-        return psycopg2.connect(dsn=self.database_url)
+        #borrow a pooled connection, use as `with self.get_connection() as conn:`
+        return self.pool.connection()
+    
+    @contextmanager
+    def explain_queries(self, analyze=False):
+        #collect {'sql', 'plan'} for every query this thread runs in the block
+        #(analyze=True runs EXPLAIN ANALYZE, i.e. executes each query twice)
+        trace = []
+        self._trace.queries = trace
+        self._trace.analyze = analyze
+        try:
+            yield trace
+        finally:
+            self._trace.queries = None
+    
+    def _explain(self, conn, query, params=None):
+        trace = getattr(self._trace, 'queries', None)
+        if trace is None:
+            return
+        with conn.cursor() as cur:
+            sql = cur.mogrify(query, params).decode()
+            options = 'ANALYZE, BUFFERS' if self._trace.analyze else 'COSTS'
+            cur.execute(f"EXPLAIN ({options}) {sql}")
+            plan = [row[0] for row in cur.fetchall()]
+        trace.append({'sql': ' '.join(sql.split()), 'plan': plan})
+    
+    def _read_sql(self, query, conn, params=None):
+        #every analysis query goes through here so it can be explained (and
+        #skipped once the request was superseded, see ConnectionPool)
+        self.pool.raise_if_superseded()
+        self._explain(conn, query, params)
+        started = time.perf_counter()
+        df = pd.read_sql(query, conn, params=params)
+        metrics.record_query(time.perf_counter() - started, len(df))
+        return df
+    
+    def get_watermark(self):
+        #cheap fingerprint of the data behind every analysis: newest row per
+        #table (ordered index probe on the hypertables) plus the scoring
+        #progress perspective_toxicity.py records in data_watermarks
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT 
+                        (SELECT MAX(created_at) FROM posts),
+                        (SELECT MAX(created_at) FROM reddit_posts),
+                        (SELECT MAX(created_at) FROM reddit_comments)
+                """)
+                newest = cur.fetchone()
+                cur.execute("SELECT table_name, scored_at, rows_scored FROM data_watermarks ORDER BY table_name")
+                scored = tuple(cur.fetchall())
+        return tuple(newest) + scored
+    
+    def _estimated_rows(self, tables):
+        #planner row estimates of `tables`, refreshed every ROW_ESTIMATE_TTL
+        #seconds (approximate_row_count covers the chunks of a hypertable)
+        checked, estimates = self._row_estimates
+        if time.monotonic() - checked > ROW_ESTIMATE_TTL:
+            all_tables = sorted({table for _, table in PLATFORM_TABLES} | set(tables))
+            with self.get_connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT to_regproc('approximate_row_count') IS NOT NULL")
+                    if cur.fetchone()[0]:
+                        estimate = "approximate_row_count(t::regclass)"
+                    else:
+                        estimate = "(SELECT GREATEST(reltuples, 0) FROM pg_class WHERE oid = t::regclass)"
+                    cur.execute(f"SELECT t, {estimate} FROM unnest(%s::text[]) as t", (all_tables,))
+                    estimates = {table: float(n or 0) for table, n in cur.fetchall()}
+            self._row_estimates = (time.monotonic(), estimates)
+        return sum(estimates.get(table, 0.0) for table in tables)
     
-    def get_toxicity_distribution(self, platform='all', start_date=None, end_date=None):
+    def _sample(self, accuracy, tables):
+        #Sample for a fast answer over `tables`, None to answer exactly
+        #(exact requested, or the tables are small enough to read whole)
+        check_accuracy(accuracy)
+        if accuracy == 'exact':
+            return None
+        rows = self._estimated_rows(tables)
+        if rows <= self.fast_sample_rows:
+            return None
+        return Sample(100 * self.fast_sample_rows / rows)
+    
+    def sampled_panels(self):
+        #dashboard panels whose accuracy='fast' request reads less than the
+        #exact one: not served by the rollups, over tables too big to read whole
+        raw = [table for _, table in PLATFORM_TABLES]
+        posts = ['posts', 'reddit_posts']
+        panels = []
+        if not self.use_rollups and self._estimated_rows(raw) > self.fast_sample_rows:
+            panels += ['distribution', 'multi']
+        if self._estimated_rows(posts) > self.fast_sample_rows:
+            panels.append('keywords')
+        return panels
+    
+    def _with_accuracy(self, result, accuracy, sample):
+        #fast answers say whether (and how much) they sampled; exact ones are unchanged
+        if accuracy == 'fast' and 'error' not in result:
+            result['accuracy'] = sample.info() if sample else {'mode': 'fast', 'sampled': False}
+        return result
+    
+    def _toxicity_scores_query(self, platform='all', start_date=None, end_date=None, sample=None):
+        #every scored row as (toxicity, day, platform); returns (sql, params)
+        return scored_rows_query(platform, ['toxicity', 'DATE(created_at) as day'],
+                                 start_date, end_date, sample)
+    
+    def get_toxicity_distribution(self, platform='all', start_date=None, end_date=None,
+                                  aggregate='server', accuracy='exact'):
         #Analysis 1: Get toxicity score distributions
-        conn = self.get_connection()
-
-        # need to query different tables depending on platform
-        queries = []
-        
-        if platform in ['4chan', 'all']:
-            # Query 4chan posts table
-            query_4chan = """
-                SELECT 
-                    (toxicity_scores->>'toxicity')::float as toxicity,
-                    '4chan' as platform
-                FROM posts
-                WHERE toxicity_scores IS NOT NULL
-                AND (toxicity_scores->>'toxicity')::float IS NOT NULL
-            """
-            # Add date filters if provided (use DATE() to compare only date part)
-            if start_date:
-                query_4chan += f" AND DATE(created_at) >= '{start_date}'"
-            if end_date:
-                query_4chan += f" AND DATE(created_at) <= '{end_date}'"
-            queries.append(query_4chan)
-        
-        if platform in ['reddit', 'all']:
-            # Query Reddit posts and comments
-            query_reddit = """
-                SELECT 
-                    (toxicity_scores->>'toxicity')::float as toxicity,
-                    'reddit' as platform
-                FROM reddit_posts
-                WHERE toxicity_scores IS NOT NULL
-                AND (toxicity_scores->>'toxicity')::float IS NOT NULL
-            """
-            if start_date:
-                query_reddit += f" AND DATE(created_at) >= '{start_date}'"
-            if end_date:
-                query_reddit += f" AND DATE(created_at) <= '{end_date}'"
-            queries.append(query_reddit)
-            
-            #include Reddit comments
-            query_comments = """
-                SELECT 
-                    (toxicity_scores->>'toxicity')::float as toxicity,
-                    'reddit' as platform
-                FROM reddit_comments
-                WHERE toxicity_scores IS NOT NULL
-                AND (toxicity_scores->>'toxicity')::float IS NOT NULL
-            """
-            if start_date:
-                query_comments += f" AND DATE(created_at) >= '{start_date}'"
-            if end_date:
-                query_comments += f" AND DATE(created_at) <= '{end_date}'"
-            queries.append(query_comments)
-        
-        full_query = " UNION ALL ".join(queries)
+        #aggregate='server' bins and averages inside Postgres and draws the CDF
+        #from the per-day quantile sketches; aggregate='client' pulls every
+        #score (exact, but the payload grows with the table)
+        #accuracy='fast' bins a sample of the raw rows (the rollups are read
+        #whole, they are already small) and adds 95% intervals under 'ci'
+        #histogram/CDF x and y are NumPy arrays, see transport.py
+        tables = [table for plat, table in PLATFORM_TABLES if platform in [plat, 'all']]
+        if aggregate == 'server':
+            if self.use_rollups:
+                sample = None
+                check_accuracy(accuracy)
+                histograms, totals = self._histogram_from_rollups(platform, start_date, end_date)
+                squares = None
+            else:
+                sample = self._sample(accuracy, tables)
+                histograms, totals, squares = self._histogram_from_buckets(platform, start_date,
+                                                                           end_date, sample)
+            result = self._server_distribution(histograms, totals, platform, start_date, end_date,
+                                               sample, refresh=accuracy == 'exact', squares=squares)
+            return self._with_accuracy(result, accuracy, sample)
         
-        df = pd.read_sql(full_query, conn)
-        conn.close()
+        sample = self._sample(accuracy, tables)
+        df = self._scores_frame(platform, start_date, end_date, sample)
         
         if df.empty:
             return {'error': 'No data found for the selected filters'}
@@ -93,8 +356,8 @@ class ToxicityAnalyzer:
             counts, edges = np.histogram(plat_data, bins=bins)
             
             result['histogram'][plat] = {
-                'x': edges[:-1].tolist(),  
-                'y': counts.tolist(),      
+                'x': edges[:-1],  
+                'y': counts,      
                 'name': plat
             }
             
@@ -103,8 +366,8 @@ class ToxicityAnalyzer:
             cumulative = np.arange(1, len(sorted_scores) + 1) / len(sorted_scores)
             
             result['cdf'][plat] = {
-                'x': sorted_scores.tolist(),
-                'y': cumulative.tolist(),
+                'x': sorted_scores,
+                'y': cumulative,
                 'name': plat
             }
         
@@ -118,53 +381,298 @@ class ToxicityAnalyzer:
             }
         }
         
+        if sample:
+            self._scale_client_distribution(result, df, sample)
+        
+        return self._with_accuracy(result, accuracy, sample)
+    
+    def _scale_client_distribution(self, result, df, sample):
+        #turn a sampled client distribution into population estimates: counts
+        #scaled up with Poisson intervals, mean intervals, and the DKW band
+        #(max distance of the sample CDF from the true one at 95%)
+        ci = {'histogram': {}, 'mean_toxicity': {}, 'cdf_epsilon': {}}
+        for plat, hist in result['histogram'].items():
+            counts = hist['y']
+            low, high = sample.count_ci(counts)
+            hist['y'] = np.rint(sample.scale(counts)).astype(np.int64)
+            ci['histogram'][plat] = {'low': low, 'high': high}
+            
+            scores = df.loc[df['platform'] == plat, 'toxicity']
+            ci['mean_toxicity'][plat] = mean_ci(len(scores), scores.sum(), (scores * scores).sum())
+            ci['cdf_epsilon'][plat] = math.sqrt(math.log(2 / 0.05) / (2 * len(scores)))
+        
+        stats = result['stats']
+        stats['total_posts'] = int(round(sample.scale(stats['total_posts'])))
+        stats['platforms'] = {plat: int(round(sample.scale(n))) for plat, n in stats['platforms'].items()}
+        result['ci'] = ci
+    
+    def _scores_frame(self, platform, start_date, end_date, sample=None):
+        #every scored row as a (toxicity, day, platform) DataFrame
+        query, params = self._toxicity_scores_query(platform, start_date, end_date, sample)
+        with self.get_connection() as conn:
+            return self._read_sql(query, conn, params)
+    
+    def _histogram_from_buckets(self, platform, start_date, end_date, sample=None):
+        #bin scores with width_bucket inside Postgres, one GROUP BY gives
+        #histogram counts, score sums and sums of squares (for the sampled
+        #mean's interval) without shipping raw scores
+        scores_query, params = self._toxicity_scores_query(platform, start_date, end_date, sample)
+        query = f"""
+            SELECT 
+                platform,
+                LEAST(GREATEST(width_bucket(toxicity, 0, 1, {HISTOGRAM_BINS}), 1), {HISTOGRAM_BINS}) as bucket,
+                COUNT(*) as n,
+                SUM(toxicity) as total,
+                SUM(toxicity * toxicity) as total_sq
+            FROM ({scores_query}) as scored
+            GROUP BY platform, bucket
+        """
+        
+        with self.get_connection() as conn:
+            df = self._read_sql(query, conn, params)
+        
+        histograms = {}
+        totals = {}
+        squares = {}
+        for plat, plat_data in df.groupby('platform'):
+            counts = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+            counts[plat_data['bucket'].to_numpy() - 1] = plat_data['n'].to_numpy()
+            histograms[plat] = counts
+            totals[plat] = float(plat_data['total'].sum())
+            squares[plat] = float(plat_data['total_sq'].sum())
+        return histograms, totals, squares
+    
+    def _histogram_from_rollups(self, platform, start_date, end_date):
+        #same numbers as _histogram_from_buckets, read from the hourly rollups
+        df = self._rollup_totals(platform, start_date, end_date)
+        
+        hist_columns = [f'hist_{i:02d}' for i in range(1, HISTOGRAM_BINS + 1)]
+        histograms = {}
+        totals = {}
+        for _, row in df[df['n_toxicity'] > 0].iterrows():
+            histograms[row['platform']] = row[hist_columns].to_numpy(dtype=np.int64)
+            totals[row['platform']] = float(row['sum_toxicity'])
+        return histograms, totals
+    
+    def _server_distribution(self, histograms, totals, platform, start_date, end_date,
+                             sample=None, refresh=True, squares=None):
+        #histograms/totals from a sample are rescaled to population estimates
+        #here (squares: per-platform sums of squared scores, for the mean's
+        #interval); refresh=False answers the CDF from the stored sketches as they are
+        if not histograms:
+            return {'error': 'No data found for the selected filters'}
+        
+        result = {
+            'histogram': {},
+            'cdf': {}
+        }
+        platform_counts = {}
+        mean_toxicity = {}
+        
+        edges = np.linspace(0, 1, HISTOGRAM_BINS + 1)
+        
+        ci = {'histogram': {}, 'mean_toxicity': {}}
+        
+        for plat, counts in histograms.items():
+            n = int(counts.sum())
+            result['histogram'][plat] = {
+                'x': edges[:-1],
+                'y': counts,
+                'name': plat
+            }
+            platform_counts[plat] = n
+            mean_toxicity[plat] = totals[plat] / n
+            
+            if sample:
+                low, high = sample.count_ci(counts)
+                result['histogram'][plat]['y'] = np.rint(sample.scale(counts)).astype(np.int64)
+                platform_counts[plat] = int(round(sample.scale(n)))
+                ci['histogram'][plat] = {'low': low, 'high': high}
+                ci['mean_toxicity'][plat] = mean_ci(n, totals[plat], squares[plat])
+        
+        if sample:
+            result['ci'] = ci
+        
+        # fixed-resolution CDF from the mergeable per-day sketches; each
+        # platform's sketch has its own error bound, rank_error is the largest
+        rank_errors = {}
+        for plat, sketch in self.get_sketches(platform, start_date, end_date, refresh).items():
+            x, y = sketch.cdf_curve(CDF_POINTS)
+            result['cdf'][plat] = {
+                'x': x,
+                'y': y,
+                'name': plat
+            }
+            rank_errors[plat] = sketch.rank_error()
+        if rank_errors:
+            result['cdf_error'] = {
+                'points': CDF_POINTS,
+                'rank_error': max(rank_errors.values()),
+                'platforms': rank_errors
+            }
+        
+        result['stats'] = {
+            'total_posts': int(sum(platform_counts.values())),
+            'platforms': platform_counts,
+            'mean_toxicity': mean_toxicity
+        }
+        
         return result
     
-    def get_keyword_frequency(self, platform='all', threshold=0.35, keywords=None):
-        #Analysis 2: Compare keyword usage in high vs low toxicity posts
-        #Do certain words appear more often in toxic discussions?
+    def _rollup_totals(self, platform='all', start_date=None, end_date=None,
+                       group_by=('platform',)):
+        """
+        Sum the hourly continuous aggregates over a date range
 
-        # Default keywords if none provided
-        if not keywords or len(keywords) == 0:
-            keywords = ['ukraine', 'russia', 'gaza', 'israel', 'china', 
-                       'trump', 'election', 'jew', 'muslim', 'immigrant']
+        Returns one row per group_by key (any of platform, day, community)
+        with n_rows, n_<attr>/sum_<attr> for the six attributes and the
+        hist_01..hist_20 toxicity bins. Timescale serves materialized hours
+        from the rollup and aggregates raw rows only for the recent tail.
+        """
+        count_columns = (['n_rows'] + [f'n_{attr}' for attr in ATTRIBUTES]
+                         + [f'hist_{i:02d}' for i in range(1, HISTOGRAM_BINS + 1)])
+        sum_columns = [f'sum_{attr}' for attr in ATTRIBUTES]
         
-        conn = self.get_connection()
+        # buckets are hour-aligned, so this matches filtering raw rows by day
+        params = date_params(start_date, end_date)
         
-        # query to get posts with their text and toxicity
         queries = []
+        for plat, view in ROLLUP_VIEWS:
+            if platform in [plat, 'all']:
+                conditions = date_range(view, params, column='bucket')
+                where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+                queries.append(f"""
+                    SELECT 
+                        '{plat}' as platform,
+                        DATE(bucket) as day,
+                        community,
+                        {', '.join(count_columns + sum_columns)}
+                    FROM {view}
+                    {where}
+                """)
         
-        if platform in ['4chan', 'all']:
-            queries.append("""
-                SELECT 
-                    data->>'com' as text,
-                    (toxicity_scores->>'toxicity')::float as toxicity,
-                    '4chan' as platform
-                FROM posts
-                WHERE toxicity_scores IS NOT NULL
-                AND data->>'com' IS NOT NULL
-            """)
+        if not queries:
+            raise ValueError(f"unknown platform {platform!r}, use 4chan, reddit or all")
         
-        if platform in ['reddit', 'all']:
-            queries.append("""
-                SELECT 
-                    title || ' ' || COALESCE(data->>'selftext', '') as text,
-                    (toxicity_scores->>'toxicity')::float as toxicity,
-                    'reddit' as platform
-                FROM reddit_posts
-                WHERE toxicity_scores IS NOT NULL
-            """)
+        keys = ', '.join(group_by)
+        aggregates = ([f"SUM({col})::bigint as {col}" for col in count_columns]
+                      + [f"SUM({col})::float as {col}" for col in sum_columns])
+        query = f"""
+            SELECT {keys}, {', '.join(aggregates)}
+            FROM ({" UNION ALL ".join(queries)}) as rollup
+            GROUP BY {keys}
+        """
         
-        full_query = " UNION ALL ".join(queries)
-        df = pd.read_sql(full_query, conn)
-        conn.close()
+        with self.get_connection() as conn:
+            return self._read_sql(query, conn, params)
+    
+    def get_sketches(self, platform='all', start_date=None, end_date=None, refresh=True):
+        """
+        Quantile sketches of toxicity per platform for a date range
+
+        Day sketches live in toxicity_sketches; any day whose scored row
+        count changed since it was sketched is rebuilt (streamed once),
+        then the requested days are merged per platform. refresh=False
+        skips the row count check and merges the stored sketches as they
+        are, unless none are stored for the range yet.
+        """
+        if not refresh:
+            with self.get_connection() as conn:
+                with metrics.timed('sql'):
+                    stored = self.sketch_store.load(conn, start_date, end_date)
+            if stored:
+                return self._merge_sketches(stored, platform)
         
-        if df.empty:
-            return {'error': 'No data found'}
+        if self.use_rollups:
+            daily = self._rollup_totals(platform, start_date, end_date, group_by=('platform', 'day'))
+            daily = daily[daily['n_toxicity'] > 0]
+            current = dict(zip(zip(daily['platform'], daily['day']), daily['n_toxicity']))
+        else:
+            daily = None
         
-        #split into high and low toxicity groups
-        high_toxic = df[df['toxicity'] > threshold]
-        low_toxic = df[df['toxicity'] <= threshold]
+        with self.get_connection() as conn:
+            if daily is None:
+                scores_query, params = self._toxicity_scores_query(platform, start_date, end_date)
+                counts = self._read_sql(f"""
+                    SELECT platform, day, COUNT(*) as n
+                    FROM ({scores_query}) as scored
+                    GROUP BY platform, day
+                """, conn, params)
+                current = dict(zip(zip(counts['platform'], counts['day']), counts['n']))
+            
+            with metrics.timed('sql'):
+                stored = self.sketch_store.load(conn, start_date, end_date)
+            stale = self.sketch_store.stale_days(current, stored)
+            if stale:
+                # stream only the chunks between the first and last stale day
+                stale_days = sorted({day for _, day in stale})
+                rebuild_query, rebuild_params = self._toxicity_scores_query(
+                    platform, stale_days[0], stale_days[-1])
+                with metrics.timed('sql'):
+                    rebuilt = self.sketch_store.rebuild(conn, rebuild_query, stale, rebuild_params)
+                    # stored with the count they were compared against (the
+                    # rollup's may trail the raw rows until its refresh)
+                    self.sketch_store.save(conn, rebuilt, stale)
+                stored.update({key: (stale[key], sketch) for key, sketch in rebuilt.items()})
+        
+        return self._merge_sketches(stored, platform)
+    
+    def _merge_sketches(self, stored, platform):
+        #one sketch per platform from the {(platform, day): (n, sketch)} day sketches
+        wanted = ['4chan', 'reddit'] if platform == 'all' else [platform]
+        merged = {}
+        for (plat, day), (n, sketch) in sorted(stored.items()):
+            if plat in wanted:
+                merged.setdefault(plat, KLLSketch(self.sketch_store.k)).merge(sketch)
+        return merged
+    
+    def get_percentiles(self, platform='all', start_date=None, end_date=None,
+                        quantiles=(0.5, 0.75, 0.9, 0.95, 0.99), accuracy='exact'):
+        #arbitrary toxicity quantiles answered from the same sketches as the CDF
+        #(accuracy='fast' uses the stored sketches without the freshness check)
+        check_accuracy(accuracy)
+        sketches = self.get_sketches(platform, start_date, end_date, refresh=accuracy == 'exact')
+        
+        if not sketches:
+            return {'error': 'No data found for the selected filters'}
+        
+        # every sketch shares k, so they share the error bound too
+        rank_error = next(iter(sketches.values())).rank_error()
+        
+        if len(sketches) > 1:
+            combined = KLLSketch(self.sketch_store.k)
+            for sketch in sketches.values():
+                combined.merge(sketch)
+            sketches['all'] = combined
+        
+        result = {
+            'quantiles': list(quantiles),
+            'platforms': {
+                plat: sketch.quantiles(quantiles).tolist()
+                for plat, sketch in sketches.items()
+            },
+            'counts': {plat: sketch.n for plat, sketch in sketches.items()},
+            'rank_error': rank_error
+        }
+        return self._with_accuracy(result, accuracy, None)
+    
+    def get_keyword_frequency(self, platform='all', threshold=0.35, keywords=None,
+                              accuracy='exact'):
+        #Analysis 2: Compare keyword usage in high vs low toxicity posts
+        #Do certain words appear more often in toxic discussions?
+        #accuracy='fast' counts over a sample of the posts, with 95% intervals
+
+        # Default keywords if none provided
+        if not keywords or len(keywords) == 0:
+            keywords = ['ukraine', 'russia', 'gaza', 'israel', 'china', 
+                       'trump', 'election', 'jew', 'muslim', 'immigrant']
+        
+        tables = [table for plat, table in [('4chan', 'posts'), ('reddit', 'reddit_posts')]
+                  if platform in [plat, 'all']]
+        sample = self._sample(accuracy, tables)
+        hits, high_total, low_total = self._keyword_counts(platform, threshold, keywords, sample)
+        if high_total + low_total == 0:
+            return {'error': 'No data found'}
         
         # Count keyword occurrences
         result = {
@@ -175,12 +683,12 @@ class ToxicityAnalyzer:
         }
         
         for keyword in keywords:
-            high_count = high_toxic['text'].str.contains(keyword, case=False, na=False).sum()
-            low_count = low_toxic['text'].str.contains(keyword, case=False, na=False).sum()
+            high_count = int(hits['high'].get(keyword, 0))
+            low_count = int(hits['low'].get(keyword, 0))
             
             # Normalize by group size 
-            high_freq = (high_count / len(high_toxic) * 100) if len(high_toxic) > 0 else 0
-            low_freq = (low_count / len(low_toxic) * 100) if len(low_toxic) > 0 else 0
+            high_freq = (high_count / high_total * 100) if high_total > 0 else 0
+            low_freq = (low_count / low_total * 100) if low_total > 0 else 0
             
             result['high_toxicity'][keyword] = high_freq
             result['low_toxicity'][keyword] = low_freq
@@ -188,14 +696,90 @@ class ToxicityAnalyzer:
         
         result['stats'] = {
             'threshold': threshold,
-            'high_toxic_count': len(high_toxic),
-            'low_toxic_count': len(low_toxic)
+            'high_toxic_count': high_total,
+            'low_toxic_count': low_total
         }
         
-        return result
+        if sample:
+            result['ci'] = self._keyword_intervals(hits, high_total, low_total, keywords)
+            result['stats']['high_toxic_count'] = int(round(sample.scale(high_total)))
+            result['stats']['low_toxic_count'] = int(round(sample.scale(low_total)))
+        
+        return self._with_accuracy(result, accuracy, sample)
+    
+    def _keyword_intervals(self, hits, high_total, low_total, keywords):
+        #95% intervals of the sampled frequencies (Wilson, in %) and of their
+        #ratio (delta method on the log ratio)
+        ci = {'high_toxicity': {}, 'low_toxicity': {}, 'ratio': {}}
+        for keyword in keywords:
+            high_count = int(hits['high'].get(keyword, 0))
+            low_count = int(hits['low'].get(keyword, 0))
+            ci['high_toxicity'][keyword] = [100 * p if p is not None else None
+                                            for p in proportion_ci(high_count, high_total)]
+            ci['low_toxicity'][keyword] = [100 * p if p is not None else None
+                                           for p in proportion_ci(low_count, low_total)]
+            if high_count and low_count:
+                ratio = (high_count / high_total) / (low_count / low_total)
+                spread = CONFIDENCE_Z * math.sqrt(
+                    (1 - high_count / high_total) / high_count + (1 - low_count / low_total) / low_count)
+                ci['ratio'][keyword] = [ratio * math.exp(-spread), ratio * math.exp(spread)]
+            else:
+                ci['ratio'][keyword] = [None, None]
+        return ci
+    
+    def _keyword_counts(self, platform, threshold, keywords, sample=None):
+        #(DataFrame keyword -> high/low post counts, high total, low total)
+        #sample: a Sample of the posts both counts are taken over
+        
+        # 4chan posts without a comment body have always been left out
+        sources = []
+        if platform in ['4chan', 'all']:
+            sources.append(('posts', "p.data->>'com' IS NOT NULL"))
+        if platform in ['reddit', 'all']:
+            sources.append(('reddit_posts', "TRUE"))
+        
+        # posts per keyword come from the inverted index (all of its words,
+        # plurals too), group sizes from a count over the scored rows; no post
+        # text is fetched
+        params = {'threshold': threshold, **keyword_params(keywords)}
+        tablesample = sample.clause() if sample else ''
+        
+        hit_queries = []
+        for source, condition in sources:
+            hit_queries.append(f"""
+                SELECT k.keyword, p.toxicity
+                FROM {keyword_hits_sql(source, tablesample)}
+                WHERE p.toxicity IS NOT NULL AND {condition}
+            """)
+        total_queries = [
+            f"""
+                SELECT toxicity
+                FROM {source} p {tablesample}
+                WHERE toxicity IS NOT NULL AND {condition}
+            """
+            for source, condition in sources
+        ]
+        
+        with self.get_connection() as conn:
+            hits = self._read_sql(f"""
+                SELECT keyword,
+                    COUNT(*) FILTER (WHERE toxicity > %(threshold)s) as high,
+                    COUNT(*) FILTER (WHERE toxicity <= %(threshold)s) as low
+                FROM ({" UNION ALL ".join(hit_queries)}) as hits
+                GROUP BY keyword
+            """, conn, params).set_index('keyword')
+            totals = self._read_sql(f"""
+                SELECT
+                    COUNT(*) FILTER (WHERE toxicity > %(threshold)s) as high,
+                    COUNT(*) FILTER (WHERE toxicity <= %(threshold)s) as low
+                FROM ({" UNION ALL ".join(total_queries)}) as scored
+            """, conn, params).iloc[0]
+        
+        return hits, int(totals['high']), int(totals['low'])
     
     def get_multi_attribute_toxicity(self, platform='all', start_date=None, 
-                                     end_date=None, show_ratio=False):
+                                     end_date=None, show_ratio=False, breakdown=None,
+                                     accuracy='exact'):
         """
         Analysis 3: Break down toxicity into 6 different types
         
@@ -207,189 +791,262 @@ class ToxicityAnalyzer:
         -profanity - swear words
         -threat - violence/intimidation
         
-        FIXED: Now properly includes Reddit comments alongside posts
-        """
-        conn = self.get_connection()
-        
-        # Attributes to extract from toxicity_scores JSON
-        attributes = ['toxicity', 'severe_toxicity', 'identity_attack', 
-                     'insult', 'profanity', 'threat']
-        
-        queries = []
-        
-        if platform in ['4chan', 'all']:
-            select_parts = [f"(toxicity_scores->>'{attr}')::float as {attr}" 
-                           for attr in attributes]
-            query_4chan = f"""
-                SELECT 
-                    {', '.join(select_parts)},
-                    '4chan' as platform
-                FROM posts
-                WHERE toxicity_scores IS NOT NULL
-            """
-            if start_date:
-                query_4chan += f" AND DATE(created_at) >= '{start_date}'"
-            if end_date:
-                query_4chan += f" AND DATE(created_at) <= '{end_date}'"
-            queries.append(query_4chan)
+        breakdown='community' (board/subreddit) or 'day' adds per-group
+        means under result['breakdown']. Means are computed in SQL as
+        sum / count, so the response size does not grow with the rows.
         
-        if platform in ['reddit', 'all']:
-            select_parts = [f"(toxicity_scores->>'{attr}')::float as {attr}" 
-                           for attr in attributes]
-            
-            # Reddit posts
-            query_reddit_posts = f"""
-                SELECT 
-                    {', '.join(select_parts)},
-                    'reddit' as platform
-                FROM reddit_posts
-                WHERE toxicity_scores IS NOT NULL
-            """
-            if start_date:
-                query_reddit_posts += f" AND created_at >= '{start_date}'"
-            if end_date:
-                query_reddit_posts += f" AND created_at <= '{end_date}'"
-            queries.append(query_reddit_posts)
-            
-            # Reddit comments - THIS WAS MISSING!
-            query_reddit_comments = f"""
-                SELECT 
-                    {', '.join(select_parts)},
-                    'reddit' as platform
-                FROM reddit_comments
-                WHERE toxicity_scores IS NOT NULL
-            """
-            if start_date:
-                query_reddit_comments += f" AND DATE(created_at) >= '{start_date}'"
-            if end_date:
-                query_reddit_comments += f" AND DATE(created_at) <= '{end_date}'"
-            queries.append(query_reddit_comments)
+        accuracy='fast' averages a sample of the raw rows and adds 95%
+        intervals of the means under 'ci' (rollup answers stay exact).
+        """
+        if breakdown not in BREAKDOWNS:
+            raise ValueError(f"unknown breakdown {breakdown!r}, use community or day")
+        group_by = ('platform', breakdown) if breakdown else ('platform',)
         
-        full_query = " UNION ALL ".join(queries)
-        df = pd.read_sql(full_query, conn)
-        conn.close()
+        if self.use_rollups:
+            check_accuracy(accuracy)
+            sample = None
+            df = self._rollup_totals(platform, start_date, end_date, group_by=group_by)
+        else:
+            tables = [table for plat, table in PLATFORM_TABLES if platform in [plat, 'all']]
+            sample = self._sample(accuracy, tables)
+            df = self._attribute_totals(platform, start_date, end_date, group_by, sample)
+        df = df[df['n_toxicity'] > 0]
         
         if df.empty:
             return {'error': 'No data found'}
         
-        #calculate means for each attribute by platform
-        result = {'attributes': attributes}
+        def means(row):
+            return {
+                attr: row[f'sum_{attr}'] / row[f'n_{attr}'] if row[f'n_{attr}'] > 0 else None
+                for attr in ATTRIBUTES
+            }
         
-        for plat in df['platform'].unique():
-            plat_data = df[df['platform'] == plat]
-            result[plat] = {
-                attr: plat_data[attr].mean() 
-                for attr in attributes
+        def intervals(row):
+            return {
+                attr: mean_ci(row[f'n_{attr}'], row[f'sum_{attr}'], row[f'sq_{attr}'])
+                for attr in ATTRIBUTES
             }
         
-        # Calculate ratios 
+        aggregates = ('n', 'sum', 'sq') if sample else ('n', 'sum')
+        total_columns = [f'{agg}_{attr}' for attr in ATTRIBUTES for agg in aggregates]
+        platforms = df.groupby('platform')[total_columns].sum()
+        
+        result = {'attributes': ATTRIBUTES}
+        for plat, row in platforms.iterrows():
+            result[plat] = means(row)
+        if sample:
+            result['ci'] = {plat: intervals(row) for plat, row in platforms.iterrows()}
+        
         if show_ratio and '4chan' in result and 'reddit' in result:
             result['ratio'] = {
                 attr: result['4chan'][attr] / result['reddit'][attr] 
-                      if result['reddit'][attr] > 0 else 0
-                for attr in attributes
+                      if result['reddit'][attr] else 0
+                for attr in ATTRIBUTES
             }
         
-        return result
+        if breakdown:
+            groups = {}
+            for _, row in df.sort_values(['platform', breakdown]).iterrows():
+                group = {**means(row), 'n': int(row['n_toxicity'])}
+                if sample:
+                    group['n'] = int(round(sample.scale(group['n'])))
+                    group['ci'] = intervals(row)
+                groups.setdefault(row['platform'], {})[str(row[breakdown])] = group
+            result['breakdown'] = {'dimension': breakdown, 'groups': groups}
+        
+        return self._with_accuracy(result, accuracy, sample)
+    
+    def _attribute_totals(self, platform, start_date, end_date, group_by, sample=None):
+        #per-group counts and sums of the six attributes over the raw tables,
+        #same columns as _rollup_totals (one GROUP BY, no rows shipped);
+        #a sampled query adds the sq_<attr> sums of squares for the intervals
+        columns = ATTRIBUTES + ['{community} as community', 'DATE(created_at) as day']
+        scored, params = scored_rows_query(platform, columns, start_date, end_date, sample)
+        
+        keys = ', '.join(group_by)
+        aggregates = ([f"COUNT({attr}) as n_{attr}" for attr in ATTRIBUTES]
+                      + [f"SUM({attr}) as sum_{attr}" for attr in ATTRIBUTES])
+        if sample:
+            aggregates += [f"SUM({attr} * {attr}) as sq_{attr}" for attr in ATTRIBUTES]
+        query = f"""
+            SELECT {keys}, {', '.join(aggregates)}
+            FROM ({scored}) as scored
+            GROUP BY {keys}
+        """
+        
+        with self.get_connection() as conn:
+            return self._read_sql(query, conn, params)
     
     def get_temporal_analysis(self, keyword='ukraine', window_days=3, 
-                             platform='all', metric='volume'):
+                             platform='all', metric='volume', keywords=None,
+                             accuracy='exact'):
         #Analysis 4: Show how toxicity changes with time
         #finds the peak day for a keyword and shows activity ±3 days around it
+        #pass keywords=[...] to compare several keywords in one query; the
+        #result then holds one keyword result per entry under 'keywords'
+        #accuracy='fast' follows a sample of the posts (the peak day is the
+        #sample's busiest day) and adds 95% intervals per day under 'ci'
+        tables = [table for plat, table in [('4chan', 'posts'), ('reddit', 'reddit_posts')]
+                  if platform in [plat, 'all']]
+        sample = self._sample(accuracy, tables)
+        if keywords:
+            series = self._temporal_series(keywords, window_days, platform, sample)
+            result = {
+                'window_days': window_days,
+                'keywords': {
+                    kw: self._temporal_result(series[series['keyword'] == kw], kw,
+                                              window_days, metric, sample)
+                    for kw in keywords
+                }
+            }
+            return self._with_accuracy(result, accuracy, sample)
         
-        conn = self.get_connection()
-        
-        # find posts containing the keyword
-        queries = []
-        
-        if platform in ['4chan', 'all']:
-            queries.append(f"""
-                SELECT 
-                    DATE(created_at) as date,
-                    (toxicity_scores->>'toxicity')::float as toxicity,
-                    '4chan' as platform
-                FROM posts
-                WHERE data->>'com' ILIKE '%{keyword}%'
-                AND toxicity_scores IS NOT NULL
-            """)
-        
-        if platform in ['reddit', 'all']:
-            queries.append(f"""
-                SELECT 
-                    DATE(created_at) as date,
-                    (toxicity_scores->>'toxicity')::float as toxicity,
-                    'reddit' as platform
-                FROM reddit_posts
-                WHERE (title ILIKE '%{keyword}%' OR data->>'selftext' ILIKE '%{keyword}%')
-                AND toxicity_scores IS NOT NULL
-            """)
-        
-        full_query = " UNION ALL ".join(queries)
-        df = pd.read_sql(full_query, conn)
-        conn.close()
+        series = self._temporal_series([keyword], window_days, platform, sample)
+        return self._with_accuracy(self._temporal_result(series, keyword, window_days, metric, sample),
+                                   accuracy, sample)
+    
+    def _temporal_series(self, keywords, window_days, platform, sample=None):
+        """
+        Daily volume and mean toxicity around each keyword's peak day
+
+        One pass in SQL: posts per keyword come from the inverted index,
+        are counted per (keyword, platform, day), the busiest day (earliest
+        on ties) is the peak, and only days within ±window_days of it are
+        returned. A sampled series also returns the daily toxicity_sd.
+        """
+        tablesample = sample.clause() if sample else ''
+        spread = ', STDDEV_SAMP(toxicity) as toxicity_sd' if sample else ''
+        # keyword timelines cover 4chan posts and reddit submissions
+        hit_queries = [
+            f"""
+                SELECT k.keyword, '{plat}' as platform, DATE(p.created_at) as date, p.toxicity
+                FROM {keyword_hits_sql(table, tablesample)}
+                WHERE p.toxicity IS NOT NULL
+            """
+            for plat, table in [('4chan', 'posts'), ('reddit', 'reddit_posts')]
+            if platform in [plat, 'all']
+        ]
+        if not hit_queries:
+            raise ValueError(f"unknown platform {platform!r}, use 4chan, reddit or all")
         
-        if df.empty:
+        params = {'window_days': int(window_days), **keyword_params(keywords)}
+        query = f"""
+            WITH daily AS (
+                SELECT keyword, platform, date, COUNT(*) as volume, AVG(toxicity) as toxicity{spread}
+                FROM ({" UNION ALL ".join(hit_queries)}) as hits
+                GROUP BY keyword, platform, date
+            ),
+            peaks AS (
+                SELECT DISTINCT ON (keyword, platform) keyword, platform, date as peak_date
+                FROM daily
+                ORDER BY keyword, platform, volume DESC, date
+            )
+            SELECT d.keyword, d.platform, p.peak_date,
+                d.date - p.peak_date as days_from_peak, d.volume, d.toxicity{', d.toxicity_sd' if sample else ''}
+            FROM daily d
+            JOIN peaks p USING (keyword, platform)
+            WHERE d.date BETWEEN p.peak_date - %(window_days)s AND p.peak_date + %(window_days)s
+            ORDER BY d.keyword, d.platform, d.date
+        """
+        with self.get_connection() as conn:
+            return self._read_sql(query, conn, params)
+    
+    def _temporal_result(self, series, keyword, window_days, metric, sample=None):
+        if series.empty:
             return {'error': f'No posts found containing keyword: {keyword}'}
         
-        # find peak day for each platform
         result = {
             'keyword': keyword,
             'window_days': window_days,
             'platforms': {}
         }
         
-        for plat in df['platform'].unique():
-            plat_data = df[df['platform'] == plat]
-            
-            # Count posts per day
-            daily_counts = plat_data.groupby('date').size()
-            peak_date = daily_counts.idxmax()
-            
-            # Get window around peak
-            start_date = peak_date - timedelta(days=window_days)
-            end_date = peak_date + timedelta(days=window_days)
-            
-            window_data = plat_data[
-                (plat_data['date'] >= start_date) & 
-                (plat_data['date'] <= end_date)
-            ]
-            
-            if metric == 'volume':
-                daily_metric = window_data.groupby('date').size()
-            else:
-                daily_metric = window_data.groupby('date')['toxicity'].mean()
-
-            dates = daily_metric.index.tolist()
-            days_from_peak = [(d - peak_date).days for d in dates]
-            values = daily_metric.values.tolist()
-            
+        for plat, plat_data in series.groupby('platform', sort=True):
+            values = plat_data['volume'] if metric == 'volume' else plat_data['toxicity']
             result['platforms'][plat] = {
-                'peak_date': str(peak_date),
-                'days_from_peak': days_from_peak,
-                'values': values,
+                'peak_date': str(plat_data['peak_date'].iloc[0]),
+                'days_from_peak': plat_data['days_from_peak'].astype(int).tolist(),
+                'values': values.tolist(),
                 'metric': metric
             }
+            if sample:
+                self._scale_temporal(result['platforms'][plat], plat_data, metric, sample)
         
         return result
     
+    def _scale_temporal(self, entry, plat_data, metric, sample):
+        #sampled daily values as population estimates with 95% intervals
+        volume = plat_data['volume'].to_numpy()
+        if metric == 'volume':
+            low, high = sample.count_ci(volume)
+            entry['values'] = np.rint(sample.scale(volume)).astype(int).tolist()
+            entry['ci'] = [[float(lo), float(hi)] for lo, hi in zip(low, high)]
+        else:
+            half = CONFIDENCE_Z * plat_data['toxicity_sd'].to_numpy(dtype=float) / np.sqrt(volume)
+            mean = plat_data['toxicity'].to_numpy(dtype=float)
+            entry['ci'] = [[float(lo), float(hi)] if np.isfinite(lo) else [None, None]
+                           for lo, hi in zip(mean - half, mean + half)]
+    
     def get_tfidf_toxic_words(self, platform='4chan', threshold=0.35, top_n=20):
         """
         TF-IDF Analysis to find words that define toxic speech
         
-        TF-IDF finds words that are:
-        - Common in toxic posts
-        - Rare in non-toxic posts
+        Ranks words by mean TF-IDF over the toxic posts, i.e. words that are
+        common in toxic posts (get_contrastive_terms compares them against
+        non-toxic posts).
+        
+        Uses the whole scored corpus from the persisted model (tfidf_model.py)
+        when one has been built, otherwise a sample of posts; both are
+        already fast, so there is no accuracy='fast' variant.
         """
-        conn = self.get_connection()
+        model = self.tfidf_model.get() or self._sampled_tfidf_model(platform)
+        return self._tfidf_from_model(model, platform, threshold, top_n)
+    
+    def get_contrastive_terms(self, platform='4chan', thresholds=(0.35,), top_n=20):
+        """
+        Words over-represented in toxic vs non-toxic posts, at every threshold
+        
+        Log-odds with an informative Dirichlet prior over the shared term
+        counts (TfidfModel.contrast_terms), so a whole threshold sweep costs
+        about as much as one threshold and the dashboard slider only picks
+        from the precomputed answers (read from the TF-IDF model, so
+        there is no accuracy='fast' variant).
+        """
+        thresholds = [float(t) for t in thresholds]
+        if not thresholds or len(thresholds) > MAX_THRESHOLDS:
+            raise ValueError(f"give between 1 and {MAX_THRESHOLDS} thresholds")
+        if any(not 0 <= t <= 1 for t in thresholds):
+            raise ValueError("thresholds must be between 0 and 1")
         
-        # Get posts with text and toxicity
+        model = self.tfidf_model.get() or self._sampled_tfidf_model(platform)
+        corpus = '4chan' if platform == '4chan' else 'reddit'
+        sweep = model.contrast_terms(corpus, thresholds, top_n)
+        for result in sweep:
+            if result['toxic_posts_analyzed'] < 10 or result['nontoxic_posts_analyzed'] < 10:
+                result.update(top_words=[], scores=[], log_odds=[],
+                              error='Not enough posts in toxic or non-toxic group')
+        
+        result = {
+            'platform': platform,
+            'method': 'log-odds ratio, informative Dirichlet prior',
+            'thresholds': sweep,
+            'model_updated_at': model.updated_at,
+            'interpretation': (
+                'Scores are z-scores of the log-odds of a word in toxic vs non-toxic posts. '
+                'Words above ~2 are reliably more frequent in toxic posts.'
+            )
+        }
+        return result
+    
+    def _sampled_tfidf_model(self, platform):
+        #term counts of a sample of posts, when no persisted model exists yet
         if platform == '4chan':
             query = """
                 SELECT 
                     data->>'com' as text,
-                    (toxicity_scores->>'toxicity')::float as toxicity
+                    toxicity
                 FROM posts
-                WHERE toxicity_scores IS NOT NULL
+                WHERE toxicity IS NOT NULL
                 AND data->>'com' IS NOT NULL
                 AND LENGTH(data->>'com') > 10
                 LIMIT 10000
@@ -398,74 +1055,51 @@ class ToxicityAnalyzer:
             query = """
                 (SELECT 
                     title || ' ' || COALESCE(data->>'selftext', '') as text,
-                    (toxicity_scores->>'toxicity')::float as toxicity
+                    toxicity
                 FROM reddit_posts
-                WHERE toxicity_scores IS NOT NULL
+                WHERE toxicity IS NOT NULL
                 AND title IS NOT NULL
                 AND LENGTH(title || ' ' || COALESCE(data->>'selftext', '')) > 10
                 LIMIT 7000)
                 UNION ALL
                 (SELECT 
                     data->>'body' as text,
-                    (toxicity_scores->>'toxicity')::float as toxicity
+                    toxicity
                 FROM reddit_comments
-                WHERE toxicity_scores IS NOT NULL
+                WHERE toxicity IS NOT NULL
                 AND data->>'body' IS NOT NULL
                 AND LENGTH(data->>'body') > 10
                 LIMIT 3000)
             """
         
-        df = pd.read_sql(query, conn)
-        conn.close()
+        with self.get_connection() as conn:
+            df = self._read_sql(query, conn)
         
-        if df.empty or len(df) < 50:
-            return {'error': 'Insufficient data for TF-IDF analysis'}
-        
-        # Split into toxic and non-toxic
-        toxic_posts = df[df['toxicity'] > threshold]['text'].tolist()
-        nontoxic_posts = df[df['toxicity'] <= threshold]['text'].tolist()
+        corpus = '4chan' if platform == '4chan' else 'reddit'
+        model = TfidfModel()
+        model.add([corpus] * len(df), df['toxicity'].tolist(), list(range(len(df))), df['text'].tolist())
+        return model
+    
+    def _tfidf_from_model(self, model, platform, threshold, top_n):
+        #TF-IDF of the toxic posts, from the model's stored term counts
+        corpus = '4chan' if platform == '4chan' else 'reddit'
+        top_words, top_scores, n_toxic, n_nontoxic = model.top_terms(corpus, threshold, top_n)
         
-        if len(toxic_posts) < 10 or len(nontoxic_posts) < 10:
+        if n_toxic + n_nontoxic < 50:
+            return {'error': 'Insufficient data for TF-IDF analysis'}
+        if n_toxic < 10 or n_nontoxic < 10:
             return {'error': 'Not enough posts in toxic or non-toxic group'}
         
-        # Custom stop words to filter HTML markup and common non-toxic terms
-        custom_stop_words = list(ENGLISH_STOP_WORDS) + [
-            'span', 'br', 'quote', 'gt', 'class', 'href', 
-            '039', 'quot', 'div', 'greentext', 'http', 'https',
-            'www', 'com', 'html', 'link', 'post', 'thread'
-        ]
-
-        # Calculate TF-IDF for toxic posts
-        vectorizer = TfidfVectorizer(
-            max_features=500,     
-            stop_words=custom_stop_words,
-            min_df=2,              
-            max_df=0.8,            
-            ngram_range=(1, 2),     
-            token_pattern=r'\b[a-zA-Z]{2,}\b'
-        )
-        
-        toxic_tfidf = vectorizer.fit_transform(toxic_posts)
-        
-        feature_names = vectorizer.get_feature_names_out()
-        
-        # Calculate mean TF-IDF score for each word across all toxic posts
-        mean_tfidf = toxic_tfidf.mean(axis=0).A1
-        
-        # Get top N words
-        top_indices = mean_tfidf.argsort()[-top_n:][::-1]
-        top_words = [feature_names[i] for i in top_indices]
-        top_scores = [mean_tfidf[i] for i in top_indices]
-        
         return {
             'platform': platform,
             'threshold': threshold,
-            'toxic_posts_analyzed': len(toxic_posts),
-            'nontoxic_posts_analyzed': len(nontoxic_posts),
+            'toxic_posts_analyzed': n_toxic,
+            'nontoxic_posts_analyzed': n_nontoxic,
             'top_words': top_words,
             'scores': top_scores,
+            'model_updated_at': model.updated_at,
             'interpretation': (
-                'These words appear frequently in toxic posts but rarely in normal posts. '
+                'These words appear frequently in toxic posts. '
                 'Higher scores indicate stronger association with toxicity.'
             )
         }
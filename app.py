@@ -1,22 +1,191 @@
 #Flask Dashboard for Interactive Toxicity Analysis
 
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, g
+import psycopg2
+from psycopg2 import errors as pg_errors
 from analysis import ToxicityAnalyzer
+from cache import ResultCache
+from db import RequestSuperseded, get_pool
+from metrics import metrics
+import transport
 import os
+import cProfile
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
 #create Flask app
 app = Flask(__name__)
+# jsonify() through orjson when available, NumPy arrays included
+app.json = transport.NumpyJSONProvider(app)
 
-analyzer = ToxicityAnalyzer()
+# one pool for the whole app, sized by DB_POOL_MIN / DB_POOL_MAX
+pool = get_pool()
+analyzer = ToxicityAnalyzer(pool=pool)
+
+# results keyed on normalized filters + data watermark, see cache.py
+cache = ResultCache(
+    analyzer.get_watermark,
+    max_entries=int(os.getenv('RESULT_CACHE_ENTRIES', 256)),
+    max_bytes=int(float(os.getenv('RESULT_CACHE_MB', 64)) * 1024 * 1024),
+    watermark_ttl=float(os.getenv('WATERMARK_TTL', 5)),
+)
+
+# seconds a single query may run, per endpoint (others use DB_STATEMENT_TIMEOUT);
+# the dashboard retries with new filters long before these are hit
+STATEMENT_TIMEOUTS = {
+    'percentiles': 10,
+    'toxicity_distribution': 30,
+    'keyword_analysis': 30,
+    'multi_attribute': 30,
+    'temporal_analysis': 30,
+    'tfidf_analysis': 60,
+    'contrastive_terms': 60,
+}
+
+# views requested by a fresh templates/index.html, computed into the result
+# cache at startup (see warm_up_enabled); (url, Accept header) as the page sends them
+WARMUP_VIEWS = [
+    ('/api/toxicity-distribution?platform=all', f"{transport.F32_PACK}, application/json"),
+    ('/api/keyword-analysis?platform=all&threshold=0.35&keywords=ukraine%2Crussia%2Cgaza%2Cisrael', '*/*'),
+    ('/api/multi-attribute?platform=all&show_ratio=false', '*/*'),
+    ('/api/tfidf-analysis?platform=4chan&threshold=0.35&top_n=20', '*/*'),
+    ('/api/contrastive-terms?platform=4chan&top_n=20&thresholds='
+     + ','.join(f"{(i + 1) * 0.05:.2f}" for i in range(19)), '*/*'),
+    ('/api/percentiles?platform=all', '*/*'),
+    ('/api/temporal-analysis', '*/*'),
+]
+# what browsers offer, so warmed bodies match their cache keys
+WARMUP_ENCODING = 'gzip, deflate, br'
+
+warmup = {'state': 'disabled', 'seconds': None, 'views': {}}
+
+# ?profile=1 writes a cProfile dump of the request here (one request at a time)
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+profile_lock = threading.Lock()
+
+def cached_json(endpoint, compute, **params):
+    #serve the stored body when the same normalized request was answered
+    #since the last ingest/scoring change, otherwise compute and store it;
+    #bodies are stored per representation (JSON or packed, compression)
+    explain = request.args.get('explain')
+    if explain in ('1', 'analyze'):
+        return explained_json(compute, explain == 'analyze', **params)
+    
+    mimetype, encoding = transport.negotiate(request.headers.get('Accept'),
+                                             request.headers.get('Accept-Encoding'))
+    key = (endpoint, tuple(sorted(params.items())), mimetype, encoding)
+    cached, watermark = cache.get(key)
+    status = 'HIT'
+    if cached is None or request.args.get('profile') == '1':
+        # profiled requests always compute, a cache hit has nothing to profile
+        status = 'MISS'
+        try:
+            with metrics.timed('compute'):
+                result = compute(**params)
+        except ValueError as e:
+            # bad filter values (dates, platform) rejected by the analyzer
+            return jsonify({'error': str(e)}), 400
+        with metrics.timed('serialize'):
+            cached = transport.encode(result, mimetype, encoding)
+        cache.put(key, watermark, cached)
+    metrics.set_cache(status.lower())
+    response = app.response_class(cached, mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept, Accept-Encoding'
+    response.headers['X-Cache'] = status
+    return response
+
+def explained_json(compute, analyze, **params):
+    #?explain=1 (or =analyze): run uncached and return the generated SQL and
+    #query plans next to the result, for debugging slow filters
+    try:
+        with analyzer.explain_queries(analyze=analyze) as queries:
+            result = compute(**params)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'result': result, 'queries': queries})
+
+@app.before_request
+def begin_request():
+    #the dashboard tags every fetch with X-Request-ID: <session>/<panel>/<seq>;
+    #a newer seq for the same session and panel cancels the older request's
+    #queries (the analyst moved on, its answer would be thrown away)
+    slot, seq = None, None
+    parts = request.headers.get('X-Request-ID', '').rsplit('/', 1)
+    if len(parts) == 2 and parts[1].isdigit():
+        slot, seq = parts[0], int(parts[1])
+    pool.begin_request(slot, seq, STATEMENT_TIMEOUTS.get(request.endpoint))
+    
+    if request.path.startswith('/api/') and request.endpoint != 'metrics_text':
+        metrics.begin()
+        if request.args.get('profile') == '1' and profile_lock.acquire(blocking=False):
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+@app.after_request
+def record_metrics(response):
+    #per-phase timings of /api/* requests, see metrics.py
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_lock.release()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{request.endpoint}-{time.time_ns()}.prof")
+        profiler.dump_stats(path)
+        response.headers['X-Profile'] = path
+    elif request.args.get('profile') == '1':
+        response.headers['X-Profile'] = 'busy, another request is being profiled'
+    if request.path.startswith('/api/') and request.endpoint != 'metrics_text':
+        metrics.finish(request.endpoint or 'unknown', response.calculate_content_length())
+    return response
+
+@app.teardown_request
+def end_request(exc):
+    pool.end_request()
+    # a request that failed before after_request still stops its profiler
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_lock.release()
+
+@app.errorhandler(RequestSuperseded)
+def superseded(e):
+    return jsonify({'error': 'superseded by a newer request', 'superseded': True}), 409
+
+@app.errorhandler(pg_errors.QueryCanceled)
+def query_cancelled(e):
+    #cancelled either on purpose (superseded) or by the statement timeout
+    if pool.superseded():
+        return superseded(e)
+    return jsonify({'error': 'query took too long and was cancelled, try narrower filters'}), 504
+
+@app.after_request
+def report_checkout_wait(response):
+    #how long this request waited for pooled connections
+    checkouts, waited = pool.request_wait()
+    if checkouts:
+        response.headers['X-DB-Checkout-Wait-Ms'] = f"{waited * 1000:.2f}"
+        app.logger.debug(f"{request.path}: {checkouts} checkout(s), waited {waited * 1000:.2f} ms")
+    return response
+
+def date_arg(name):
+    #empty date inputs come through as '' -- treat them like missing ones
+    return request.args.get(name) or None
 
 @app.route('/')
 def index():
     #Main dashboard page
-    return render_template('index.html')
+    try:
+        # panels for which a sampled first answer is worth a second request
+        sampled_panels = analyzer.sampled_panels()
+    except psycopg2.Error:
+        sampled_panels = []
+    return render_template('index.html', sampled_panels=sampled_panels)
 
 @app.route('/api/toxicity-distribution')
 def toxicity_distribution():
@@ -26,18 +195,52 @@ def toxicity_distribution():
     """
     # Get user filter choices from the URL parameters
     platform = request.args.get('platform', 'all')  
-    start_date = request.args.get('start_date')     
-    end_date = request.args.get('end_date')
+    start_date = date_arg('start_date')     
+    end_date = date_arg('end_date')
+    # 'server' bins in Postgres and uses a 200-point sketch CDF,
+    # 'client' pulls every score for an exact CDF
+    aggregate = request.args.get('aggregate', 'server')
+    # 'fast' answers from a sample with 95% intervals, the dashboard shows
+    # it first and replaces it with the exact answer
+    accuracy = request.args.get('accuracy', 'exact')
     
-    # Call analyzer to put numbers
-    result = analyzer.get_toxicity_distribution(
+    # Call analyzer to put numbers, send results back as JSON
+    return cached_json(
+        'toxicity-distribution',
+        analyzer.get_toxicity_distribution,
         platform=platform,
         start_date=start_date,
-        end_date=end_date
+        end_date=end_date,
+        aggregate=aggregate,
+        accuracy=accuracy
     )
+
+@app.route('/api/percentiles')
+def percentiles():
+    #toxicity quantiles from the per-day sketches, e.g. ?q=0.5,0.9,0.99
+    platform = request.args.get('platform', 'all')
+    start_date = date_arg('start_date')
+    end_date = date_arg('end_date')
+    q_str = request.args.get('q', '')
+    
+    try:
+        quantiles = [float(q) for q in q_str.split(',') if q.strip()]
+    except ValueError:
+        return jsonify({'error': f'quantiles must be numbers, got {q_str!r}'}), 400
+    # written as 0 <= q <= 1 so nan is rejected too
+    if not all(0 <= q <= 1 for q in quantiles):
+        return jsonify({'error': 'quantiles must be finite numbers between 0 and 1'}), 400
+    accuracy = request.args.get('accuracy', 'exact')
     
-    # Send results back as JSON
-    return jsonify(result)
+    return cached_json(
+        'percentiles',
+        analyzer.get_percentiles,
+        platform=platform,
+        start_date=start_date,
+        end_date=end_date,
+        quantiles=tuple(quantiles) or (0.5, 0.75, 0.9, 0.95, 0.99),
+        accuracy=accuracy
+    )
 
 @app.route('/api/keyword-analysis')
 def keyword_analysis():
@@ -45,47 +248,60 @@ def keyword_analysis():
     threshold = float(request.args.get('threshold', 0.35))
     keywords_str = request.args.get('keywords', '')
     
-    keywords = [k.strip() for k in keywords_str.split(',') if k.strip()]
+    keywords = tuple(k.strip().lower() for k in keywords_str.split(',') if k.strip())
+    accuracy = request.args.get('accuracy', 'exact')
     
-    result = analyzer.get_keyword_frequency(
+    return cached_json(
+        'keyword-analysis',
+        analyzer.get_keyword_frequency,
         platform=platform,
         threshold=threshold,
-        keywords=keywords
+        keywords=keywords,
+        accuracy=accuracy
     )
-    
-    return jsonify(result)
 
 @app.route('/api/multi-attribute')
 def multi_attribute():
     platform = request.args.get('platform', 'all')
-    start_date = request.args.get('start_date')
-    end_date = request.args.get('end_date')
+    start_date = date_arg('start_date')
+    end_date = date_arg('end_date')
     show_ratio = request.args.get('show_ratio', 'false') == 'true'
+    # optional per-group means: 'community' (board/subreddit) or 'day'
+    breakdown = request.args.get('breakdown') or None
+    accuracy = request.args.get('accuracy', 'exact')
     
-    result = analyzer.get_multi_attribute_toxicity(
+    return cached_json(
+        'multi-attribute',
+        analyzer.get_multi_attribute_toxicity,
         platform=platform,
         start_date=start_date,
         end_date=end_date,
-        show_ratio=show_ratio
+        show_ratio=show_ratio,
+        breakdown=breakdown,
+        accuracy=accuracy
     )
-    
-    return jsonify(result)
 
 @app.route('/api/temporal-analysis')
 def temporal_analysis():
-    keyword = request.args.get('keyword', 'ukraine')
+    keyword = request.args.get('keyword', 'ukraine').strip().lower()
     window_days = int(request.args.get('window_days', 3))
     platform = request.args.get('platform', 'all')
     metric = request.args.get('metric', 'volume')  # 'volume' or 'toxicity'
+    # ?keywords=ukraine,gaza compares several keywords in one query
+    keywords_str = request.args.get('keywords', '')
+    keywords = tuple(dict.fromkeys(k.strip().lower() for k in keywords_str.split(',') if k.strip()))
+    accuracy = request.args.get('accuracy', 'exact')
     
-    result = analyzer.get_temporal_analysis(
+    return cached_json(
+        'temporal-analysis',
+        analyzer.get_temporal_analysis,
         keyword=keyword,
         window_days=window_days,
         platform=platform,
-        metric=metric
+        metric=metric,
+        keywords=keywords or None,
+        accuracy=accuracy
     )
-    
-    return jsonify(result)
 
 @app.route('/api/tfidf-analysis')
 def tfidf_analysis():
@@ -93,13 +309,92 @@ def tfidf_analysis():
     threshold = float(request.args.get('threshold', 0.35))
     top_n = int(request.args.get('top_n', 20))
     
-    result = analyzer.get_tfidf_toxic_words(
+    return cached_json(
+        'tfidf-analysis',
+        analyzer.get_tfidf_toxic_words,
         platform=platform,
         threshold=threshold,
         top_n=top_n
     )
-    
-    return jsonify(result)
+
+@app.route('/api/contrastive-terms')
+def contrastive_terms():
+    platform = request.args.get('platform', '4chan')
+    # ?thresholds=0.2,0.35,0.5 scores every threshold in one pass
+    thresholds_str = request.args.get('thresholds', '0.35')
+    try:
+        thresholds = [float(t) for t in thresholds_str.split(',') if t.strip()]
+    except ValueError:
+        return jsonify({'error': f'thresholds must be numbers, got {thresholds_str!r}'}), 400
+    # written as 0 <= t <= 1 so nan is rejected too
+    if not all(0 <= t <= 1 for t in thresholds):
+        return jsonify({'error': 'thresholds must be finite numbers between 0 and 1'}), 400
+    thresholds = tuple(sorted({round(t, 4) for t in thresholds}))
+    top_n = int(request.args.get('top_n', 20))
+
+    return cached_json(
+        'contrastive-terms',
+        analyzer.get_contrastive_terms,
+        platform=platform,
+        thresholds=thresholds,
+        top_n=top_n
+    )
+
+@app.route('/api/cancel', methods=['POST'])
+def cancel():
+    #sent with the next X-Request-ID of a panel whose pending answer the
+    #dashboard no longer wants; begin_request() already cancelled its queries
+    return '', 204
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    #hit/miss/eviction counters of the result cache
+    return jsonify({**cache.snapshot(), 'warmup': warmup})
+
+@app.route('/api/_metrics')
+def metrics_text():
+    #per-endpoint latency/row/size histograms for Prometheus to scrape
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def warm_up():
+    #request every default view once so the first visitor hits the cache
+    warmup['state'] = 'running'
+    started = time.perf_counter()
+    client = app.test_client()
+    for url, accept in WARMUP_VIEWS:
+        view_started = time.perf_counter()
+        try:
+            response = client.get(url, headers={'Accept': accept, 'Accept-Encoding': WARMUP_ENCODING})
+            status = response.status_code
+        except Exception as e:
+            # a failing view is computed again on its first real request
+            app.logger.warning(f"warm-up of {url} failed: {e}")
+            status = None
+        warmup['views'][url] = {'status': status, 'seconds': round(time.perf_counter() - view_started, 3)}
+    warmup['seconds'] = round(time.perf_counter() - started, 3)
+    warmup['state'] = 'done'
+    app.logger.info(f"warm-up: {len(WARMUP_VIEWS)} views in {warmup['seconds']:.2f} s")
+
+def start_warm_up():
+    #warm the cache in the background, the server accepts requests meanwhile
+    warmup['state'] = 'pending'
+    thread = threading.Thread(target=warm_up, name='warm-up', daemon=True)
+    thread.start()
+    return thread
+
+def warm_up_enabled(default):
+    #WARMUP=1 (or 0) turns the startup warm-up on (off), default otherwise;
+    #never in the debug reloader's parent, which only watches files and
+    #starts the serving child (WERKZEUG_RUN_MAIN=true)
+    if os.getenv('WARMUP', default) != '1':
+        return False
+    return not (app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true')
+
+# served by gunicorn/uwsgi/flask run: every process importing the app warms
+# its own cache when WARMUP=1 (off by default, so scripts importing app.py
+# do not query the database)
+if __name__ != '__main__' and warm_up_enabled('0'):
+    start_warm_up()
 
 if __name__ == '__main__':
     
@@ -108,4 +403,9 @@ if __name__ == '__main__':
     print("-"*25)
     print("\nDashboard at: http://localhost:5000")
     
+    # python3 app.py warms up unless WARMUP=0
+    app.debug = True
+    if warm_up_enabled('1'):
+        start_warm_up()
+    
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
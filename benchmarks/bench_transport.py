@@ -0,0 +1,90 @@
+#Payload size and encode time of each API transport format
+#
+#Runs the toxicity distribution analysis (histogram + CDF) once per
+#aggregate mode and times every representation transport.py can send:
+#   python3 benchmarks/bench_transport.py [--platform all] [--repeat 20]
+#"tolist + json" is what the API did before (analyzer .tolist(), jsonify).
+
+import os
+import sys
+import gzip
+import json
+import time
+import argparse
+
+import numpy as np
+from dotenv import load_dotenv
+
+# shared modules (analysis, transport) live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import transport
+from analysis import ToxicityAnalyzer
+
+
+def tolist(obj):
+    #the result as the API used to build it, arrays converted to lists
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, dict):
+        return {key: tolist(value) for key, value in obj.items()}
+    return obj
+
+
+def stdlib_json(result):
+    return json.dumps(tolist(result)).encode('utf-8')
+
+
+FORMATS = [
+    ('tolist + json', stdlib_json),
+    ('json (' + ('orjson' if transport.orjson else 'stdlib') + ')', transport.dumps),
+    ('f32 pack', transport.pack),
+]
+
+ENCODINGS = [
+    ('identity', lambda body: body),
+    ('gzip', lambda body: gzip.compress(body, compresslevel=transport.GZIP_LEVEL)),
+]
+if transport.brotli is not None:
+    ENCODINGS.append(('br', lambda body: transport.brotli.compress(body, quality=transport.BROTLI_QUALITY)))
+
+
+def timed(fn, arg, repeat):
+    #median seconds of `repeat` calls, and the last output
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(arg)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), out
+
+
+def bench(result, repeat):
+    rows = []
+    for fmt_name, serialize in FORMATS:
+        serialize_s, body = timed(serialize, result, repeat)
+        for enc_name, compress in ENCODINGS:
+            compress_s, payload = timed(compress, body, repeat)
+            rows.append((fmt_name, enc_name, len(payload), (serialize_s + compress_s) * 1000))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--platform', default='all')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    load_dotenv()
+    analyzer = ToxicityAnalyzer()
+
+    for aggregate in ('server', 'client'):
+        result = analyzer.get_toxicity_distribution(platform=args.platform, aggregate=aggregate)
+        if 'error' in result:
+            print(f"{aggregate}: {result['error']}")
+            continue
+        points = sum(len(trace['x']) for trace in result['cdf'].values())
+        print(f"\n/api/toxicity-distribution?aggregate={aggregate} ({points:,} CDF points)")
+        print(f"{'format':<16}{'encoding':<10}{'bytes':>12}{'encode ms':>12}")
+        for fmt_name, enc_name, size, ms in bench(result, args.repeat):
+            print(f"{fmt_name:<16}{enc_name:<10}{size:>12,}{ms:>12.2f}")
@@ -0,0 +1,502 @@
+#Synthetic 4chan/Reddit data for benchmarking at production scale
+#
+#Fills posts, reddit_posts and reddit_comments (schemas in migrations/, run
+#them first) of a scratch database with crawler-shaped JSONB payloads,
+#Perspective-like scores and keyword_index rows:
+#   python3 benchmarks/generate_data.py --rows 10M [--days 30] [--truncate]
+#
+#Writes to BENCH_DATABASE_URL -- never point it at the crawl database,
+#--truncate empties the tables first (without it, non-empty tables are refused).
+#
+#What is modelled:
+#- text: Zipf-distributed words (stop words, the dashboard keywords, insults
+#  and a large filler vocabulary), lognormal lengths per source; 4chan
+#  comments carry the site's HTML (quotelinks, <br>, greentext spans)
+#- scores: Beta-distributed base toxicity pushed up by every insult in the
+#  text, the other five attributes correlated with it; a fraction of rows is
+#  left unscored like posts the scorer has not reached yet
+#- time: rows spread over --days with a daily activity cycle, each day
+#  written in created_at order like the crawlers do; --jobs writes several
+#  days at once
+#- threads: 4chan replies and Reddit comments attach to recent threads of
+#  their board / subreddit on the same day
+
+import io
+import os
+import re
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+# shared modules (keyword_index) live in the repo root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from keyword_index import extract_terms
+
+# share of the rows per table, roughly the crawled corpus
+SHARES = {'posts': 0.5, 'reddit_posts': 0.1, 'reddit_comments': 0.4}
+
+BOARDS = {'pol': 0.7, 'b': 0.1, 'int': 0.1, 'news': 0.05, 'k': 0.05}
+SUBREDDITS = {'politics': 0.35, 'worldnews': 0.25, 'news': 0.15, 'conservative': 0.1,
+              'europe': 0.07, 'ukraine': 0.05, 'israel': 0.03}
+
+# dashboard keywords appear far more often than their Zipf rank suggests
+KEYWORDS = ['ukraine', 'russia', 'gaza', 'israel', 'china', 'trump', 'biden', 'election',
+            'jew', 'muslim', 'immigrant', 'immigrants', 'war', 'peace', 'jewelry']
+INSULTS = ['idiot', 'stupid', 'moron', 'trash', 'scum', 'pathetic', 'retard', 'hate',
+           'disgusting', 'loser', 'clown', 'garbage', 'shill', 'kill', 'die']
+STOP = ['the', 'a', 'and', 'to', 'of', 'is', 'in', 'it', 'that', 'you', 'this', 'for',
+        'are', 'not', 'be', 'they', 'on', 'with', 'just', 'have', 'was', 'what', 'but']
+FILLER_WORDS = 20000
+SYLLABLES = ['ka', 'lo', 'mi', 'ren', 'tu', 'sa', 'vel', 'dor', 'pi', 'an', 'gre', 'ost',
+             'ne', 'bru', 'chi', 'fal', 'mon', 'ter', 'ix', 'um', 'zel', 'qua', 'ro', 'ped']
+
+# median words per text and lognormal sigma
+LENGTHS = {'posts': (18, 1.0), 'title': (10, 0.4), 'selftext': (45, 1.1), 'reddit_comments': (22, 1.0)}
+SELFTEXT_SHARE = 0.4
+IMAGE_ONLY_SHARE = 0.12
+OP_SHARE = 0.06
+
+# relative activity per UTC hour (quiet early morning, busy evening)
+HOURLY = 1 + 0.6 * np.sin((np.arange(24) - 9) / 24 * 2 * np.pi)
+
+SCALE_RE = re.compile(r'^(\d+(?:\.\d+)?)([kKmM]?)$')
+
+
+def parse_scale(value):
+    #'1M' / '500k' / '2000' -> rows
+    match = SCALE_RE.match(value.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid row count {value!r}, e.g. 1M, 10M, 500k")
+    number, unit = match.groups()
+    return int(float(number) * {'': 1, 'k': 1_000, 'm': 1_000_000}[unit.lower()])
+
+
+def base36(n):
+    digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+    out = ''
+    while True:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+        if not n:
+            return out
+
+
+class TextModel:
+    #Zipf word sampler and the score model on top of it (vocabulary fixed by seed)
+
+    def __init__(self, seed):
+        rng = np.random.default_rng(seed)
+        filler = set()
+        while len(filler) < FILLER_WORDS:
+            filler.add(''.join(rng.choice(SYLLABLES, size=rng.integers(2, 5))))
+        filler = sorted(filler)
+        rng.shuffle(filler)
+        self.words = np.array(STOP + KEYWORDS + INSULTS + filler, dtype=object)
+
+        ranks = np.arange(1, len(self.words) + 1, dtype=np.float64)
+        weights = 1 / ranks ** 1.05
+        # stop words keep their Zipf head; keywords and insults get a fixed share
+        keyword_slice = slice(len(STOP), len(STOP) + len(KEYWORDS))
+        insult_slice = slice(keyword_slice.stop, keyword_slice.stop + len(INSULTS))
+        weights[keyword_slice] = 0.004
+        weights[insult_slice] = 0.002
+        self.cdf = np.cumsum(weights) / weights.sum()
+        self.insult_ids = (insult_slice.start, insult_slice.stop)
+        self.identity_ids = [len(STOP) + KEYWORDS.index(word) for word in ('jew', 'muslim', 'immigrant', 'immigrants')]
+
+    def texts(self, rng, n, kind):
+        #n texts of one kind, with their insult counts and identity mentions
+        median, sigma = LENGTHS[kind]
+        lengths = np.maximum(1, rng.lognormal(np.log(median), sigma, n).astype(np.int64))
+        ids = np.searchsorted(self.cdf, rng.random(lengths.sum()))
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        lo, hi = self.insult_ids
+        insulting = np.add.reduceat((ids >= lo) & (ids < hi), bounds[:-1])
+        identity = np.add.reduceat(np.isin(ids, self.identity_ids), bounds[:-1]) > 0
+        words = self.words[ids]
+        texts = [' '.join(words[bounds[i]:bounds[i + 1]]) for i in range(n)]
+        return texts, insulting, identity
+
+    def scores(self, rng, insulting, identity):
+        #the six Perspective attributes, one rounded array each
+        n = len(insulting)
+        base = rng.beta(1.3, 4.5, n)
+        toxicity = 1 - (1 - base) * 0.7 ** insulting
+        scores = {
+            'toxicity': toxicity,
+            'severe_toxicity': toxicity ** 3 * rng.uniform(0.3, 1.0, n),
+            'identity_attack': np.clip(toxicity * rng.uniform(0.05, 0.4, n) + 0.35 * toxicity * identity, 0, 1),
+            'insult': np.clip(toxicity * rng.uniform(0.6, 1.1, n), 0, 1),
+            'profanity': np.clip(toxicity * rng.uniform(0.2, 1.0, n), 0, 1),
+            'threat': toxicity ** 2 * rng.uniform(0.0, 0.4, n),
+        }
+        return {attr: np.round(values, 6) for attr, values in scores.items()}
+
+
+def chan_html(text, rng, recent):
+    #4chan comment markup: quotelinks to recent posts, greentext, line breaks
+    parts = []
+    if recent and rng.random() < 0.5:
+        target = recent[rng.integers(len(recent))]
+        parts.append(f'<a href="#p{target}" class="quotelink">&gt;&gt;{target}</a><br>')
+    words = text.split(' ')
+    if len(words) > 8 and rng.random() < 0.3:
+        cut = int(rng.integers(3, len(words) - 3))
+        parts.append(f'<span class="quote">&gt;{" ".join(words[:cut])}</span><br>')
+        words = words[cut:]
+    parts.append(' '.join(words).replace(' the ', ' the<br>', 1))
+    return ''.join(parts)
+
+
+class Generator:
+    """
+    Rows of one table for one day, in created_at order
+
+    Every (table, day) is generated from its own seed, so days can be
+    written by parallel workers and a rerun with the same arguments gives
+    the same rows. IDs are numbered from per-day offsets (first_id), and
+    comments of a day attach to that day's submissions, which
+    submissions() reproduces without generating the posts themselves.
+    """
+
+    def __init__(self, seed, start, scored_share, with_index):
+        self.seed = seed
+        self.text = TextModel(seed)
+        self.start = start
+        self.scored_share = scored_share
+        self.with_index = with_index
+
+    def rng(self, table, day):
+        return np.random.default_rng([self.seed, list(SHARES).index(table), day])
+
+    def timestamps(self, rng, day, n):
+        #n sorted timestamps within one UTC day, following HOURLY, as
+        #datetimes and as ISO strings (naive, i.e. UTC, for posts)
+        hours = rng.choice(24, size=n, p=HOURLY / HOURLY.sum())
+        seconds = np.sort(hours * 3600 + rng.integers(0, 3600, n))
+        midnight = np.datetime64(self.start.replace(tzinfo=None) + timedelta(days=day), 's')
+        stamps = midnight + seconds.astype('timedelta64[s]')
+        naive = np.datetime_as_string(stamps).tolist()
+        epoch = stamps.astype(np.int64).tolist()
+        return epoch, naive
+
+    def communities(self, rng, weights, n):
+        names = list(weights)
+        p = np.array([weights[name] for name in names])
+        return [names[i] for i in rng.choice(len(names), size=n, p=p / p.sum())]
+
+    def score_columns(self, rng, texts, insulting, identity, scored_at):
+        #(toxicity_scores JSON, six typed scores, scored_at) per row; unscored
+        #rows (and rows without text) are all NULL
+        scores = self.text.scores(rng, insulting, identity)
+        scored = rng.random(len(texts)) < self.scored_share
+        values = np.column_stack(list(scores.values())).tolist()
+        columns = []
+        for i, text in enumerate(texts):
+            if not scored[i] or not text:
+                columns.append((None,) * 8)
+                continue
+            columns.append((json.dumps(dict(zip(scores, values[i]))), *values[i], scored_at))
+        return columns
+
+    def index_rows(self, source, keys, created, texts):
+        #keyword_index rows, sorted by term so the btree is filled in order
+        if not self.with_index:
+            return []
+        rows = [(term, source, key, ts) for key, ts, text in zip(keys, created, texts)
+                for term in extract_terms(text)]
+        rows.sort()
+        return rows
+
+    def scored_at(self, day):
+        # the scorer catches up with a day's posts the next day
+        return (self.start + timedelta(days=day + 1)).isoformat()
+
+    def submissions(self, day, n, first_id):
+        #(epoch seconds, ISO timestamps, subreddit, post_id) of a day's submissions
+        rng = np.random.default_rng([self.seed, len(SHARES), day])
+        epoch, stamps = self.timestamps(rng, day, n)
+        subs = self.communities(rng, SUBREDDITS, n)
+        counters = first_id + np.cumsum(rng.integers(1, 50, n))
+        return epoch, stamps, subs, [base36(int(c)) for c in counters]
+
+    def posts(self, day, n, first_id):
+        rng = self.rng('posts', day)
+        epoch, stamps = self.timestamps(rng, day, n)
+        boards = self.communities(rng, BOARDS, n)
+        texts, insulting, identity = self.text.texts(rng, n, 'posts')
+        image_only = rng.random(n) < IMAGE_ONLY_SHARE
+        is_op = rng.random(n) < OP_SHARE
+        numbers = (first_id + np.cumsum(rng.integers(1, 4, n))).tolist()
+        threads = {board: [] for board in BOARDS}
+
+        rows, keys, index_texts = [], [], []
+        plain = [text if not image_only[i] else '' for i, text in enumerate(texts)]
+        for i, board in enumerate(boards):
+            number = numbers[i]
+            recent = threads[board]
+            if is_op[i] or not recent:
+                recent.append(number)
+                del recent[:-200]
+                thread = number
+            else:
+                thread = recent[-1 - min(int(rng.exponential(20)), len(recent) - 1)]
+            data = {'no': number, 'resto': 0 if thread == number else thread,
+                    'time': epoch[i], 'name': 'Anonymous',
+                    'now': datetime.fromtimestamp(epoch[i], timezone.utc).strftime('%m/%d/%y(%a)%H:%M:%S')}
+            if thread == number:
+                data['sub'] = ' '.join(texts[i].split(' ')[:6])
+            if plain[i]:
+                data['com'] = chan_html(plain[i], rng, recent[-20:])
+            if thread == number or image_only[i] or rng.random() < 0.25:
+                data.update({'tim': epoch[i] * 1000 + i % 1000, 'filename': f'image{i}', 'ext': '.jpg',
+                             'w': 1024, 'h': 768, 'fsize': int(rng.integers(20_000, 900_000))})
+            if board == 'pol':
+                data['country_name'] = 'United States'
+            rows.append([board, thread, number, stamps[i], json.dumps(data)])
+            keys.append(f'{board}/{number}')
+            index_texts.append(data.get('sub', '') + ' ' + data.get('com', ''))
+
+        # perspective_toxicity.py scores data->>'com', image-only posts never are
+        for row, columns in zip(rows, self.score_columns(rng, plain, insulting, identity, self.scored_at(day))):
+            row.extend(columns)
+        # keyword_index keeps posts' plain timestamps as UTC (keyword_index.index_rows)
+        return rows, self.index_rows('posts', keys, [ts + '+00:00' for ts in stamps], index_texts)
+
+    def reddit_posts(self, day, n, first_id):
+        rng = self.rng('reddit_posts', day)
+        epoch, stamps, subs, post_ids = self.submissions(day, n, first_id)
+        titles, title_insults, title_identity = self.text.texts(rng, n, 'title')
+        bodies, body_insults, body_identity = self.text.texts(rng, n, 'selftext')
+        has_body = rng.random(n) < SELFTEXT_SHARE
+        selftexts = [body if has_body[i] else '' for i, body in enumerate(bodies)]
+
+        rows, keys, index_texts = [], [], []
+        for i, sub in enumerate(subs):
+            post_id = post_ids[i]
+            title = titles[i][:1].upper() + titles[i][1:]
+            author = f'user_{int(rng.integers(0, 200_000))}'
+            data = {'id': post_id, 'name': f't3_{post_id}', 'subreddit': sub, 'author': author,
+                    'title': title, 'selftext': selftexts[i], 'created_utc': float(epoch[i]),
+                    'score': int(rng.pareto(1.2) * 10), 'upvote_ratio': round(float(rng.uniform(0.5, 1)), 2),
+                    'num_comments': int(rng.pareto(1.1) * 5), 'is_self': bool(selftexts[i]),
+                    'permalink': f'/r/{sub}/comments/{post_id}/', 'over_18': False,
+                    'url': f'https://www.reddit.com/r/{sub}/comments/{post_id}/' if selftexts[i]
+                           else f'https://example.com/article/{post_id}'}
+            rows.append([sub, post_id, stamps[i] + '+00:00', author, title, json.dumps(data)])
+            keys.append(f'{sub}/{post_id}')
+            index_texts.append(title + ' ' + selftexts[i])
+
+        # submissions are scored on title + selftext
+        texts = [title + ' ' + selftext for title, selftext in zip(titles, selftexts)]
+        insulting = title_insults + body_insults * has_body
+        identity = title_identity | (body_identity & has_body)
+        for row, columns in zip(rows, self.score_columns(rng, texts, insulting, identity, self.scored_at(day))):
+            row.extend(columns)
+        return rows, self.index_rows('reddit_posts', keys, [ts + '+00:00' for ts in stamps], index_texts)
+
+    def reddit_comments(self, day, n, first_id, submissions=None):
+        #submissions: (n, first_id) of the day's reddit_posts, comments go to those
+        rng = self.rng('reddit_comments', day)
+        epoch, stamps = self.timestamps(rng, day, n)
+        texts, insulting, identity = self.text.texts(rng, n, 'reddit_comments')
+        comment_ids = first_id + np.cumsum(rng.integers(1, 20, n))
+
+        by_sub = {}
+        if submissions and submissions[0]:
+            _, _, subs, post_ids = self.submissions(day, *submissions)
+            for sub, post_id in zip(subs, post_ids):
+                by_sub.setdefault(sub, []).append(post_id)
+        threads = list(by_sub.items()) or [('politics', [base36(first_id)])]
+        # busy subreddits get more comments, recent submissions most of them
+        weights = np.array([len(post_ids) for _, post_ids in threads], dtype=np.float64)
+        picks = rng.choice(len(threads), size=n, p=weights / weights.sum())
+
+        rows, keys = [], []
+        for i in range(n):
+            sub, post_ids = threads[picks[i]]
+            post_id = post_ids[-1 - min(int(rng.exponential(30)), len(post_ids) - 1)]
+            comment_id = base36(int(comment_ids[i]))
+            data = {'id': comment_id, 'name': f't1_{comment_id}', 'body': texts[i], 'subreddit': sub,
+                    'author': f'user_{int(rng.integers(0, 200_000))}', 'link_id': f't3_{post_id}',
+                    'parent_id': f't3_{post_id}', 'created_utc': float(epoch[i]),
+                    'score': int(rng.pareto(1.5) * 3) - 1, 'depth': 0}
+            rows.append([sub, post_id, comment_id, stamps[i] + '+00:00', json.dumps(data)])
+            keys.append(f'{post_id}/{comment_id}')
+
+        for row, columns in zip(rows, self.score_columns(rng, texts, insulting, identity, self.scored_at(day))):
+            row.extend(columns)
+        return rows, self.index_rows('reddit_comments', keys, [ts + '+00:00' for ts in stamps], texts)
+
+
+SCORE_COLUMNS = ['toxicity_scores', 'toxicity', 'severe_toxicity', 'identity_attack',
+                 'insult', 'profanity', 'threat', 'scored_at']
+COLUMNS = {
+    'posts': ['board_name', 'thread_number', 'post_number', 'created_at', 'data'] + SCORE_COLUMNS,
+    'reddit_posts': ['subreddit', 'post_id', 'created_at', 'author', 'title', 'data'] + SCORE_COLUMNS,
+    'reddit_comments': ['subreddit', 'post_id', 'comment_id', 'created_at', 'data'] + SCORE_COLUMNS,
+}
+INDEX_COLUMNS = ['term', 'source', 'post_key', 'created_at']
+
+# first ID per table and the most one row can advance it (see Generator)
+FIRST_ID = {'posts': 100_000_000, 'reddit_posts': 36 ** 6, 'reddit_comments': 36 ** 7}
+ID_STEP = {'posts': 3, 'reddit_posts': 49, 'reddit_comments': 19}
+
+
+def copy_rows(cur, table, columns, rows):
+    #COPY ... FROM STDIN (CSV: empty unquoted fields are NULL)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def prepare(conn, truncate, with_index):
+    tables = list(COLUMNS) + (['keyword_index'] if with_index else [])
+    with conn.cursor() as cur:
+        for table in tables:
+            cur.execute("SELECT to_regclass(%s)", (table,))
+            if cur.fetchone()[0] is None:
+                raise SystemExit(f"table {table} does not exist, apply migrations/ to the benchmark database first")
+        if truncate:
+            cur.execute(f"TRUNCATE {', '.join(tables)}")
+            cur.execute("SELECT to_regclass('toxicity_sketches')")
+            if cur.fetchone()[0] is not None:
+                cur.execute("TRUNCATE toxicity_sketches")
+        else:
+            for table in tables:
+                cur.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+                if cur.fetchone()[0]:
+                    raise SystemExit(f"{table} is not empty, rerun with --truncate to replace its rows")
+    conn.commit()
+
+
+def finish(conn, counts):
+    #what the crawlers and the scorer leave behind: fresh rollups, watermarks, stats
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regclass('timescaledb_information.continuous_aggregates')")
+        if cur.fetchone()[0] is not None:
+            cur.execute("SELECT view_name FROM timescaledb_information.continuous_aggregates")
+            for (view,) in cur.fetchall():
+                print(f"  refreshing {view}")
+                cur.execute(f"CALL refresh_continuous_aggregate('{view}', NULL, NULL)")
+        cur.execute("SELECT to_regclass('data_watermarks')")
+        if cur.fetchone()[0] is not None:
+            for table, written in counts.items():
+                cur.execute("""
+                    INSERT INTO data_watermarks (table_name, scored_at, rows_scored)
+                    VALUES (%s, now(), %s)
+                    ON CONFLICT (table_name) DO UPDATE
+                    SET scored_at = now(), rows_scored = EXCLUDED.rows_scored
+                """, (table, written))
+        for table in list(COLUMNS) + ['keyword_index']:
+            cur.execute(f"ANALYZE {table}")
+    conn.autocommit = False
+
+
+def plan(rows, days, seed):
+    #(table, day, rows, first id) for every day of every table, plus the
+    #reddit_posts (rows, first id) per day that comments attach to
+    tasks = []
+    submissions = {}
+    for number, (table, share) in enumerate(SHARES.items()):
+        per_day = np.random.default_rng([seed, number]).multinomial(int(rows * share), np.ones(days) / days)
+        first_ids = FIRST_ID[table] + ID_STEP[table] * np.concatenate([[0], np.cumsum(per_day)[:-1]])
+        for day, (n, first_id) in enumerate(zip(per_day.tolist(), first_ids.tolist())):
+            tasks.append((table, day, n, first_id))
+            if table == 'reddit_posts':
+                submissions[day] = (n, first_id)
+    return tasks, submissions
+
+
+_worker = {}
+
+
+def _init_worker(dsn, seed, start, scored_share, with_index, submissions):
+    _worker['conn'] = psycopg2.connect(dsn=dsn)
+    _worker['generator'] = Generator(seed, start, scored_share, with_index)
+    _worker['submissions'] = submissions
+
+
+def _write_day(task, batch_size=50_000):
+    #generate and COPY one table's day, committing every batch
+    table, day, n, first_id = task
+    conn, generator = _worker['conn'], _worker['generator']
+    if table == 'reddit_comments':
+        table_rows, index = generator.reddit_comments(day, n, first_id, _worker['submissions'].get(day))
+    else:
+        table_rows, index = getattr(generator, table)(day, n, first_id)
+    with conn.cursor() as cur:
+        for offset in range(0, len(table_rows), batch_size):
+            copy_rows(cur, table, COLUMNS[table], table_rows[offset:offset + batch_size])
+            conn.commit()
+        for offset in range(0, len(index), batch_size * 10):
+            copy_rows(cur, 'keyword_index', INDEX_COLUMNS, index[offset:offset + batch_size * 10])
+            conn.commit()
+    return table, day, len(table_rows)
+
+
+def generate(dsn, rows, days, start, seed=0, scored_share=0.9, with_index=True, jobs=1):
+    #load `rows` rows split over the three tables; returns rows per table
+    tasks, submissions = plan(rows, days, seed)
+    init_args = (dsn, seed, start, scored_share, with_index, submissions)
+    counts = dict.fromkeys(SHARES, 0)
+    started = time.perf_counter()
+
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, initializer=_init_worker, initargs=init_args)
+        results = pool.imap_unordered(_write_day, tasks)
+    else:
+        pool = None
+        _init_worker(*init_args)
+        results = map(_write_day, tasks)
+
+    for done, (table, day, written) in enumerate(results, 1):
+        counts[table] += written
+        rate = sum(counts.values()) / (time.perf_counter() - started)
+        print(f"  {table} day {day + 1}/{days}: {written:,} rows "
+              f"({done}/{len(tasks)} days, {sum(counts.values()):,}/{rows:,} rows, {rate:,.0f} rows/s)")
+    if pool is not None:
+        pool.close()
+        pool.join()
+    else:
+        _worker['conn'].close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=parse_scale, default='1M', help='total rows, e.g. 1M, 10M, 50M')
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--start', default='2025-11-01', help='first day (UTC)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--scored', type=float, default=0.9, help='share of rows with Perspective scores')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='parallel writer processes')
+    parser.add_argument('--no-index', action='store_true', help='skip keyword_index rows')
+    parser.add_argument('--truncate', action='store_true', help='empty the tables first')
+    args = parser.parse_args()
+
+    load_dotenv()
+    dsn = os.getenv('BENCH_DATABASE_URL')
+    if not dsn:
+        raise SystemExit("set BENCH_DATABASE_URL to a scratch database (migrations applied)")
+
+    start = datetime.strptime(args.start, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+    conn = psycopg2.connect(dsn=dsn)
+    prepare(conn, args.truncate, not args.no_index)
+    print(f"generating {args.rows:,} rows over {args.days} days from {args.start} ({args.jobs} jobs)")
+    started = time.perf_counter()
+    counts = generate(dsn, args.rows, args.days, start, args.seed, args.scored, not args.no_index, args.jobs)
+    finish(conn, counts)
+    conn.close()
+    print(f"done: {sum(counts.values()):,} rows in {time.perf_counter() - started:.0f}s")
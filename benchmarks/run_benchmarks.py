@@ -0,0 +1,258 @@
+#Times every ToxicityAnalyzer method and /api/* route against a database
+#(normally one filled by generate_data.py) and writes the results as JSON:
+#   python3 benchmarks/run_benchmarks.py [--repeat 5] [--out results.json]
+#   python3 benchmarks/run_benchmarks.py compare old.json new.json [--tolerance 0.1]
+#
+#Reads BENCH_DATABASE_URL. Each case runs once cold (empty result cache,
+#sketches and model files as they are) and then --repeat times; API routes
+#bypass the result cache except for the extra "hit" timing. The output
+#records the commit, row counts and settings so runs at 1M/10M/50M rows can
+#be compared between commits; `compare` exits 1 on median regressions.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import tempfile
+from datetime import timedelta
+
+import numpy as np
+import psycopg2
+from dotenv import load_dotenv
+
+# shared modules (analysis, app, tfidf_model) live in the repo root
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(ROOT)
+
+KEYWORDS = ('ukraine', 'russia', 'gaza', 'israel')
+
+
+def method_cases(window):
+    #(name, method, kwargs); `window` is a (start, end) week in the data
+    start, end = window
+    return [
+        ('distribution', 'get_toxicity_distribution', {}),
+        ('distribution_week', 'get_toxicity_distribution', {'start_date': start, 'end_date': end}),
+        ('distribution_client', 'get_toxicity_distribution', {'aggregate': 'client'}),
+        ('distribution_fast', 'get_toxicity_distribution', {'accuracy': 'fast'}),
+        ('percentiles', 'get_percentiles', {}),
+        ('percentiles_week', 'get_percentiles', {'start_date': start, 'end_date': end}),
+        ('keyword_frequency', 'get_keyword_frequency', {}),
+        ('keyword_frequency_4chan', 'get_keyword_frequency', {'platform': '4chan', 'keywords': KEYWORDS}),
+        ('keyword_frequency_fast', 'get_keyword_frequency', {'accuracy': 'fast'}),
+        ('multi_attribute', 'get_multi_attribute_toxicity', {'show_ratio': True}),
+        ('multi_attribute_week', 'get_multi_attribute_toxicity', {'start_date': start, 'end_date': end}),
+        ('multi_attribute_community', 'get_multi_attribute_toxicity', {'breakdown': 'community'}),
+        ('multi_attribute_day', 'get_multi_attribute_toxicity', {'breakdown': 'day'}),
+        ('multi_attribute_fast', 'get_multi_attribute_toxicity', {'accuracy': 'fast'}),
+        ('temporal', 'get_temporal_analysis', {}),
+        ('temporal_keywords', 'get_temporal_analysis', {'keywords': KEYWORDS, 'metric': 'toxicity'}),
+        ('temporal_keywords_fast', 'get_temporal_analysis', {'keywords': KEYWORDS, 'accuracy': 'fast'}),
+        ('tfidf_4chan', 'get_tfidf_toxic_words', {'platform': '4chan'}),
+        ('tfidf_reddit', 'get_tfidf_toxic_words', {'platform': 'reddit'}),
+        ('contrastive_sweep', 'get_contrastive_terms',
+         {'platform': '4chan', 'thresholds': tuple(round(0.05 * i, 2) for i in range(1, 20))}),
+    ]
+
+
+def route_cases(window):
+    #(name, url, Accept header) as the dashboard requests them
+    start, end = window
+    pack = 'application/x-f32-pack, application/json'
+    return [
+        ('toxicity_distribution', '/api/toxicity-distribution?platform=all', pack),
+        ('toxicity_distribution_week', f'/api/toxicity-distribution?platform=all&start_date={start}&end_date={end}', pack),
+        ('percentiles', '/api/percentiles?platform=all', '*/*'),
+        ('keyword_analysis', '/api/keyword-analysis?platform=all&threshold=0.35&keywords=' + ','.join(KEYWORDS), '*/*'),
+        ('multi_attribute', '/api/multi-attribute?platform=all&show_ratio=false', '*/*'),
+        ('multi_attribute_week', f'/api/multi-attribute?platform=all&start_date={start}&end_date={end}', '*/*'),
+        ('temporal_analysis', '/api/temporal-analysis?keyword=ukraine', '*/*'),
+        ('temporal_analysis_keywords', '/api/temporal-analysis?keywords=' + ','.join(KEYWORDS), '*/*'),
+        ('tfidf_analysis', '/api/tfidf-analysis?platform=4chan&threshold=0.35&top_n=20', '*/*'),
+        ('contrastive_terms', '/api/contrastive-terms?platform=4chan&top_n=20&thresholds='
+         + ','.join(f"{0.05 * i:.2f}" for i in range(1, 20)), '*/*'),
+    ]
+
+
+def summarize(times):
+    times_ms = np.array(times) * 1000
+    return {
+        'median_ms': round(float(np.median(times_ms)), 3),
+        'min_ms': round(float(times_ms.min()), 3),
+        'p95_ms': round(float(np.percentile(times_ms, 95)), 3),
+        'runs': len(times),
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    out = fn()
+    return time.perf_counter() - start, out
+
+
+def describe(conn):
+    #row counts and the middle week of the data, for labelling and date filters
+    counts = {}
+    with conn.cursor() as cur:
+        for table in ('posts', 'reddit_posts', 'reddit_comments', 'keyword_index'):
+            cur.execute(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cur.fetchone()[0]
+        cur.execute("SELECT MIN(created_at)::date, MAX(created_at)::date FROM reddit_comments")
+        first, last = cur.fetchone()
+    conn.rollback()
+    if first is None:
+        raise SystemExit("the benchmark database is empty, run benchmarks/generate_data.py first")
+    middle = first + (last - first) / 2
+    return counts, (str(middle - timedelta(days=3)), str(middle + timedelta(days=3)))
+
+
+def build_model(dsn, path):
+    #full TF-IDF model build, itself one of the timed cases
+    from tfidf_model import TfidfModel
+    conn = psycopg2.connect(dsn=dsn)
+    model = TfidfModel()
+    seconds, _ = timed(lambda: model.refresh(conn, full=True))
+    model.save(path)
+    conn.close()
+    return seconds
+
+
+def run(args):
+    dsn = os.getenv('BENCH_DATABASE_URL')
+    if not dsn:
+        raise SystemExit("set BENCH_DATABASE_URL to the generated benchmark database")
+    # the app and analyzer read these at import / construction
+    os.environ['DATABASE_URL'] = dsn
+    if args.no_rollups:
+        os.environ['USE_ROLLUPS'] = '0'
+
+    conn = psycopg2.connect(dsn=dsn)
+    counts, window = describe(conn)
+    conn.close()
+    rows = sum(counts[table] for table in ('posts', 'reddit_posts', 'reddit_comments'))
+    print(f"{rows:,} rows, date filters {window[0]}..{window[1]}")
+
+    results = []
+    model_dir = tempfile.mkdtemp(prefix='bench_tfidf_')
+    os.environ['TFIDF_PATH'] = os.path.join(model_dir, 'tfidf_model.joblib')
+    if not args.skip_model:
+        seconds = build_model(dsn, os.environ['TFIDF_PATH'])
+        results.append({'kind': 'job', 'name': 'tfidf_model_full_build', 'cold_ms': round(seconds * 1000, 3)})
+        print(f"  job    tfidf_model_full_build {seconds * 1000:>12.1f} ms")
+
+    from analysis import ToxicityAnalyzer
+    analyzer = ToxicityAnalyzer()
+    for name, method, kwargs in method_cases(window):
+        if args.only and args.only not in name:
+            continue
+        fn = lambda: getattr(analyzer, method)(**kwargs)
+        cold, _ = timed(fn)
+        summary = summarize([timed(fn)[0] for _ in range(args.repeat)])
+        results.append({'kind': 'method', 'name': name, 'method': method,
+                        'params': {key: list(value) if isinstance(value, tuple) else value
+                                   for key, value in kwargs.items()},
+                        'cold_ms': round(cold * 1000, 3), **summary})
+        print(f"  method {name:<28} cold {cold * 1000:>10.1f} ms   median {summary['median_ms']:>10.1f} ms")
+
+    import app as dashboard
+    client = dashboard.app.test_client()
+    for name, url, accept in route_cases(window):
+        if args.only and args.only not in name:
+            continue
+        headers = {'Accept': accept, 'Accept-Encoding': 'gzip, deflate, br'}
+
+        def request():
+            dashboard.cache.clear()
+            return client.get(url, headers=headers)
+
+        cold, response = timed(request)
+        if response.status_code != 200:
+            print(f"  route  {name:<28} HTTP {response.status_code}, skipped")
+            continue
+        summary = summarize([timed(request)[0] for _ in range(args.repeat)])
+        hit, _ = timed(lambda: client.get(url, headers=headers))
+        results.append({'kind': 'route', 'name': name, 'url': url, 'bytes': len(response.get_data()),
+                        'cold_ms': round(cold * 1000, 3), 'hit_ms': round(hit * 1000, 3), **summary})
+        print(f"  route  {name:<28} cold {cold * 1000:>10.1f} ms   median {summary['median_ms']:>10.1f} ms"
+              f"   hit {hit * 1000:>7.2f} ms")
+
+    return {
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'rows': rows,
+        'tables': counts,
+        'settings': {'repeat': args.repeat, 'use_rollups': not args.no_rollups,
+                     'tfidf_model': not args.skip_model, 'date_window': window},
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': results,
+    }
+
+
+def git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_path, new_path, tolerance):
+    #median (or cold, for jobs) per case; True when nothing got slower than tolerance
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old['rows'] != new['rows']:
+        print(f"warning: row counts differ ({old['rows']:,} vs {new['rows']:,})")
+
+    before = {(r['kind'], r['name']): r for r in old['results']}
+    print(f"{old['commit'] and old['commit'][:10]} -> {new['commit'] and new['commit'][:10]} at {new['rows']:,} rows")
+    print(f"{'case':<40}{'before ms':>12}{'after ms':>12}{'change':>10}")
+    ok = True
+    for result in new['results']:
+        previous = before.get((result['kind'], result['name']))
+        if previous is None:
+            continue
+        metric = 'median_ms' if 'median_ms' in result else 'cold_ms'
+        change = result[metric] / previous[metric] - 1 if previous[metric] else 0.0
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"{result['kind'] + ' ' + result['name']:<40}{previous[metric]:>12.1f}{result[metric]:>12.1f}"
+              f"{change:>+10.1%}{flag}")
+    return ok
+
+
+if __name__ == "__main__":
+    load_dotenv()
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'compare':
+        parser = argparse.ArgumentParser(prog='run_benchmarks.py compare')
+        parser.add_argument('old')
+        parser.add_argument('new')
+        parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown, 0.1 = 10%%')
+        args = parser.parse_args(sys.argv[2:])
+        sys.exit(0 if compare(args.old, args.new, args.tolerance) else 1)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help='results file (default benchmarks/results/<commit>-<rows>.json)')
+    parser.add_argument('--only', help='run only cases whose name contains this')
+    parser.add_argument('--no-rollups', action='store_true', help='query the raw tables (USE_ROLLUPS=0)')
+    parser.add_argument('--skip-model', action='store_true',
+                        help='no TF-IDF model build, term endpoints use the sampled fallback')
+    args = parser.parse_args()
+
+    report = run(args)
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results',
+                                   f"{(report['commit'] or 'nogit')[:10]}-{report['rows']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {out}")
@@ -0,0 +1,473 @@
+#Micro-batched bulk writer shared by the crawlers
+#
+#Crawl jobs hand their rows to writer.write(table, rows) and get a Ticket.
+#A flusher thread collects the rows of every job and flushes them every
+#BULK_FLUSH_ROWS rows or BULK_FLUSH_MS milliseconds in one transaction:
+#per table COPY into a temporary staging table, then
+#INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING the keys of the new
+#rows, whose keyword index rows (keyword_index.py) go through the same
+#COPY path. ticket.wait() returns those keys once the transaction committed
+#and raises if it failed, so a job that waits before returning is only
+#acknowledged to Faktory when its rows are durable.
+#
+#pyfaktory runs every job in a pool process of its own, so the crawlers run
+#one writer process (start_server) that all their pool processes talk to
+#over a local socket (get_writer), which lets it batch across jobs.
+#Outside a crawler get_writer() returns an in-process BulkWriter.
+
+import io
+import os
+import json
+import time
+import signal
+import atexit
+import logging
+import secrets
+import tempfile
+import threading
+import multiprocessing
+from multiprocessing.connection import Client, Listener
+
+import psycopg2
+
+from keyword_index import index_rows
+
+logger = logging.getLogger("bulk writer")
+
+FLUSH_ROWS = 1000
+FLUSH_MS = 200
+# seconds a job waits for its rows to be committed before failing
+ACK_TIMEOUT = 60
+
+# per table: the columns jobs write (in row order), the key RETURNING
+# reports for new rows, and what the keyword index gets for a new row
+# (post_key, created_at, text)
+TABLES = {
+    'posts': {
+        'columns': ('board_name', 'thread_number', 'post_number', 'created_at', 'data'),
+        'key': ('board_name', 'post_number'),
+        'index': lambda row: (f"{row[0]}/{row[2]}", row[3],
+                              row[4].get('sub', '') + ' ' + row[4].get('com', '')),
+    },
+    'reddit_posts': {
+        'columns': ('subreddit', 'post_id', 'created_at', 'author', 'title', 'data'),
+        'key': ('subreddit', 'post_id'),
+        'index': lambda row: (f"{row[0]}/{row[1]}", row[2],
+                              (row[4] or '') + ' ' + (row[5].get('selftext') or '')),
+    },
+    'reddit_comments': {
+        'columns': ('subreddit', 'post_id', 'comment_id', 'created_at', 'data'),
+        'key': ('post_id', 'comment_id'),
+        'index': lambda row: (f"{row[1]}/{row[2]}", row[3], row[4].get('body')),
+    },
+}
+INDEX_COLUMNS = ('term', 'source', 'post_key', 'created_at')
+
+
+class WriteFailed(RuntimeError):
+    #the flush holding a job's rows did not commit (or no ack in time)
+    pass
+
+
+class Ticket:
+    #a job's handle on its rows; wait() blocks until they are committed
+
+    def __init__(self, table, rows):
+        self.table = table
+        self.rows = rows
+        self.inserted = None
+        self.error = None
+        self._done = threading.Event()
+
+    def _resolve(self, inserted=None, error=None):
+        self.inserted = inserted
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout=ACK_TIMEOUT):
+        #keys (TABLES[table]['key'] tuples) of the rows that were new
+        if not self._done.wait(timeout):
+            raise WriteFailed(f"no commit for {len(self.rows)} {self.table} rows within {timeout}s")
+        if self.error is not None:
+            raise WriteFailed(f"writing {len(self.rows)} {self.table} rows failed: {self.error}")
+        return self.inserted
+
+
+def copy_value(value):
+    #one field in COPY text format (\N is NULL)
+    if value is None:
+        return '\\N'
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def copy_into(cur, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+class BulkWriter:
+    """
+    Buffers rows from any number of threads and flushes them from one
+    background thread over its own connection
+
+    - flush_rows / flush_ms: flush once this many rows are buffered, or
+      the oldest buffered row waited this long
+    - stats: flushes, rows, inserted, index_rows, failed_flushes and the
+      last flush's milliseconds and rows per second
+    """
+
+    def __init__(self, dsn, flush_rows=FLUSH_ROWS, flush_ms=FLUSH_MS):
+        self.dsn = dsn
+        self.flush_rows = flush_rows
+        self.flush_ms = flush_ms
+        self.conn = None
+        self._pid = os.getpid()
+        self._pending = []
+        self._pending_rows = 0
+        self._oldest = None
+        self._closing = False
+        self._cond = threading.Condition()
+        self.stats = {
+            'flushes': 0,
+            'rows': 0,
+            'inserted': 0,
+            'index_rows': 0,
+            'failed_flushes': 0,
+            'last_flush_ms': 0.0,
+            'last_rows_per_second': 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name='bulk-writer', daemon=True)
+        self._thread.start()
+
+    def write(self, table, rows):
+        #queue rows (tuples in TABLES[table]['columns'] order) for the next flush
+        if table not in TABLES:
+            raise ValueError(f"unknown table {table!r}, use {', '.join(TABLES)}")
+        ticket = Ticket(table, list(rows))
+        if not ticket.rows:
+            ticket._resolve(inserted=set())
+            return ticket
+        with self._cond:
+            if self._closing:
+                raise WriteFailed("the writer is closed")
+            self._pending.append(ticket)
+            self._pending_rows += len(ticket.rows)
+            if self._oldest is None:
+                # the flusher sleeps until the first row, then for flush_ms
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            elif self._pending_rows >= self.flush_rows:
+                self._cond.notify()
+        return ticket
+
+    def close(self):
+        #flush what is buffered and stop the flusher thread
+        if os.getpid() != self._pid:
+            # a forked child has neither the thread nor its own connection
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join()
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closing:
+                    if self._pending_rows >= self.flush_rows:
+                        break
+                    if self._oldest is not None:
+                        remaining = self.flush_ms / 1000 - (time.monotonic() - self._oldest)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                batch, self._pending = self._pending, []
+                self._pending_rows = 0
+                self._oldest = None
+                closing = self._closing
+            if batch:
+                self._flush(batch)
+            if closing:
+                return
+
+    def _connection(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(dsn=self.dsn)
+        return self.conn
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        rows = sum(len(ticket.rows) for ticket in batch)
+        try:
+            inserted, index_count = self._commit(batch)
+        except Exception as e:
+            self.stats['failed_flushes'] += 1
+            logger.warning(f"flush of {rows} rows from {len(batch)} writes failed: {e}")
+            if len(batch) > 1:
+                # one bad job must not fail the others, retry every write alone
+                for ticket in batch:
+                    self._flush([ticket])
+            else:
+                batch[0]._resolve(error=e)
+            return
+
+        elapsed = time.perf_counter() - started
+        new = sum(len(keys) for keys in inserted)
+        self.stats['flushes'] += 1
+        self.stats['rows'] += rows
+        self.stats['inserted'] += new
+        self.stats['index_rows'] += index_count
+        self.stats['last_flush_ms'] = elapsed * 1000
+        self.stats['last_rows_per_second'] = rows / elapsed if elapsed > 0 else 0.0
+        logger.info(f"flushed {rows} rows ({new} new, {index_count} index rows) from {len(batch)} writes "
+                    f"in {elapsed * 1000:.1f} ms, {self.stats['last_rows_per_second']:.0f} rows/s")
+        for ticket, keys in zip(batch, inserted):
+            ticket._resolve(inserted=keys)
+
+    def _commit(self, batch):
+        #one transaction for the whole batch; returns (new keys per ticket, index rows written)
+        conn = self._connection()
+        try:
+            with conn.cursor() as cur:
+                new_keys = {}
+                for table in TABLES:
+                    rows = [row for ticket in batch if ticket.table == table for row in ticket.rows]
+                    if rows:
+                        new_keys[table] = self._insert(cur, table, rows)
+
+                index = []
+                for table, keys in new_keys.items():
+                    spec = TABLES[table]
+                    key_of = self._key_function(table)
+                    indexed = set()
+                    for ticket in batch:
+                        if ticket.table != table:
+                            continue
+                        for row in ticket.rows:
+                            key = key_of(row)
+                            if key in keys and key not in indexed:
+                                indexed.add(key)
+                                index.extend(index_rows(table, *spec['index'](row)))
+                if index:
+                    self._insert(cur, 'keyword_index', index)
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+
+        # a row written by several jobs of the batch is new for the first only
+        unclaimed = {table: set(keys) for table, keys in new_keys.items()}
+        inserted = []
+        for ticket in batch:
+            key_of = self._key_function(ticket.table)
+            keys = {key_of(row) for row in ticket.rows} & unclaimed[ticket.table]
+            unclaimed[ticket.table] -= keys
+            inserted.append(keys)
+        return inserted, len(index)
+
+    def _key_function(self, table):
+        columns = TABLES[table]['columns']
+        positions = [columns.index(column) for column in TABLES[table]['key']]
+        return lambda row: tuple(row[i] for i in positions)
+
+    def _insert(self, cur, table, rows):
+        #COPY rows into the table's staging table and move the new ones over
+        columns = TABLES[table]['columns'] if table in TABLES else INDEX_COLUMNS
+        staging = f"bulk_{table}"
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {staging}
+            (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+        """)
+        copy_into(cur, staging, columns, rows)
+        column_list = ', '.join(columns)
+        if table not in TABLES:
+            cur.execute(f"""
+                INSERT INTO {table} ({column_list})
+                SELECT {column_list} FROM {staging}
+                ON CONFLICT DO NOTHING
+            """)
+            return set()
+        cur.execute(f"""
+            INSERT INTO {table} ({column_list})
+            SELECT {column_list} FROM {staging}
+            ON CONFLICT DO NOTHING
+            RETURNING {', '.join(TABLES[table]['key'])}
+        """)
+        return {tuple(row) for row in cur.fetchall()}
+
+
+#---------- writer process shared by the pool processes of a crawler ----------
+
+class WriterClient:
+    #get_writer() in a process started under start_server(): forwards writes
+    #to the writer process and waits for its commit
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self.conn = None
+        self.lock = threading.Lock()
+
+    def write(self, table, rows):
+        ticket = Ticket(table, list(rows))
+        if not ticket.rows:
+            ticket._resolve(inserted=set())
+            return ticket
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self.conn is None:
+                        self.conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+                    self.conn.send(('write', table, ticket.rows))
+                    status, value = self.conn.recv()
+                    break
+                except (OSError, EOFError) as e:
+                    # the writer restarted or the socket broke: reconnect once
+                    self.conn = None
+                    if attempt:
+                        raise WriteFailed(f"writer process unreachable: {e}")
+        if status == 'ok':
+            ticket._resolve(inserted=value)
+        else:
+            ticket._resolve(error=value)
+        return ticket
+
+
+def _serve(address, authkey, dsn, flush_rows, flush_ms):
+    #writer process: one thread per connected pool process, all feeding one BulkWriter
+    logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO))
+    # Ctrl-C goes to the whole process group; keep writing through the
+    # consumer's grace period and stop when it says so (or on SIGTERM)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    writer = BulkWriter(dsn, flush_rows, flush_ms)
+    listener = Listener(address, family='AF_UNIX', authkey=authkey)
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (OSError, EOFError):
+                    return
+                if message[0] == 'shutdown':
+                    stop.set()
+                    conn.send(('ok', None))
+                    return
+                _, table, rows = message
+                try:
+                    conn.send(('ok', writer.write(table, rows).wait()))
+                except Exception as e:
+                    conn.send(('error', str(e)))
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # a client that failed the handshake
+                logger.warning(f"rejected writer connection: {e}")
+                continue
+            threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    stop.wait()
+    writer.close()
+    logger.info(f"writer stopped after {writer.stats['flushes']} flushes, "
+                f"{writer.stats['rows']} rows ({writer.stats['inserted']} new)")
+
+
+class WriterProcess:
+    #handle on the writer process start_server() started
+
+    def __init__(self, process, address, authkey):
+        self.process = process
+        self.address = address
+        self.authkey = authkey
+        self._pid = os.getpid()
+
+    def stop(self, timeout=30):
+        #flush what is buffered and end the writer process (pool processes
+        #forked from the crawler inherit this handle and its atexit hook)
+        if os.getpid() != self._pid:
+            return
+        if self.process.is_alive():
+            try:
+                with Client(self.address, family='AF_UNIX', authkey=self.authkey) as conn:
+                    conn.send(('shutdown',))
+                    conn.recv()
+            except (OSError, EOFError):
+                self.process.terminate()
+            self.process.join(timeout)
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+def start_server(dsn=None, flush_rows=None, flush_ms=None):
+    """
+    Start the writer process of a crawler, before its Consumer forks the
+    pool processes: get_writer() in them (and in this process) then writes
+    through it. Flushes every BULK_FLUSH_ROWS rows / BULK_FLUSH_MS ms.
+    """
+    dsn = dsn or os.getenv('DATABASE_URL')
+    if not dsn:
+        raise ValueError("DATABASE_URL not found in environment variables!")
+    flush_rows = flush_rows or int(os.getenv('BULK_FLUSH_ROWS', FLUSH_ROWS))
+    flush_ms = flush_ms or float(os.getenv('BULK_FLUSH_MS', FLUSH_MS))
+
+    address = os.path.join(tempfile.mkdtemp(prefix='bulk_writer_'), 'writer.sock')
+    authkey = secrets.token_bytes(16)
+    process = multiprocessing.Process(target=_serve, args=(address, authkey, dsn, flush_rows, flush_ms),
+                                      name='bulk-writer', daemon=True)
+    process.start()
+    for _ in range(100):
+        if os.path.exists(address):
+            break
+        time.sleep(0.05)
+
+    # inherited by the pool processes forked from here on
+    os.environ['BULK_WRITER_ADDRESS'] = address
+    os.environ['BULK_WRITER_AUTHKEY'] = authkey.hex()
+    server = WriterProcess(process, address, authkey)
+    atexit.register(server.stop)
+    return server
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    #the writer of this process: a client of the crawler's writer process
+    #when start_server() ran, otherwise an in-process BulkWriter
+    global _writer, _writer_pid
+    with _writer_lock:
+        # a forked pool process must not reuse its parent's socket or thread
+        if _writer is None or _writer_pid != os.getpid():
+            address = os.getenv('BULK_WRITER_ADDRESS')
+            if address:
+                _writer = WriterClient(address, bytes.fromhex(os.environ['BULK_WRITER_AUTHKEY']))
+            else:
+                dsn = os.getenv('DATABASE_URL')
+                if not dsn:
+                    raise ValueError("DATABASE_URL not found in environment variables!")
+                _writer = BulkWriter(dsn, int(os.getenv('BULK_FLUSH_ROWS', FLUSH_ROWS)),
+                                     float(os.getenv('BULK_FLUSH_MS', FLUSH_MS)))
+                atexit.register(_writer.close)
+            _writer_pid = os.getpid()
+        return _writer
@@ -0,0 +1,112 @@
+#Result cache for the dashboard API
+#
+#Entries are keyed on (endpoint, normalized parameters, data watermark). The
+#watermark is a cheap fingerprint of the database (newest rows + scoring
+#progress, see ToxicityAnalyzer.get_watermark); when it moves every cached
+#result is dropped, so answers never outlive the data they were computed on.
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    LRU cache bounded by entry count and total bytes
+
+    - watermark_fn: callable returning a hashable data watermark
+    - watermark_ttl: seconds a watermark reading is trusted before asking
+      the database again (bounds staleness, saves a round trip per hit)
+    """
+
+    def __init__(self, watermark_fn, max_entries=256, max_bytes=64 * 1024 * 1024,
+                 watermark_ttl=5.0):
+        self.watermark_fn = watermark_fn
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.watermark_ttl = watermark_ttl
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._watermark_checked = 0.0
+
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def watermark(self):
+        #current watermark, re-read at most every watermark_ttl seconds
+        now = time.monotonic()
+        with self._lock:
+            if self._watermark is not None and now - self._watermark_checked < self.watermark_ttl:
+                return self._watermark
+
+        current = self.watermark_fn()
+
+        with self._lock:
+            if current != self._watermark:
+                # new data arrived: everything cached is now stale
+                if self._entries:
+                    self.stats['invalidations'] += 1
+                self._entries.clear()
+                self._bytes = 0
+                self._watermark = current
+            self._watermark_checked = now
+            return current
+
+    def get(self, key):
+        #returns (cached value or None, watermark the lookup was made at)
+        watermark = self.watermark()
+        with self._lock:
+            value = self._entries.get((key, watermark))
+            if value is None:
+                self.stats['misses'] += 1
+                return None, watermark
+            self._entries.move_to_end((key, watermark))
+            self.stats['hits'] += 1
+            return value, watermark
+
+    def put(self, key, watermark, value):
+        #value must be bytes (the serialized response body); pass the
+        #watermark from get() so a result computed before new data arrived
+        #is never stored under the newer watermark
+        full_key = (key, watermark)
+        size = len(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if watermark != self._watermark:
+                return
+            old = self._entries.pop(full_key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[full_key] = value
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,274 @@
+#Shared PostgreSQL connection pool for the dashboard
+#ToxicityAnalyzer and the Flask app borrow connections from here instead of
+#paying for a fresh psycopg2.connect (TCP + backend startup) on every API call
+
+import os
+import time
+import atexit
+import logging
+import threading
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+logger = logging.getLogger("db pool")
+
+
+class PoolTimeout(RuntimeError):
+    #raised when no connection frees up within the checkout timeout
+    pass
+
+
+class RequestSuperseded(RuntimeError):
+    #raised in a request whose client already sent a newer one for the same
+    #slot (dashboard panel); its running queries have been cancelled
+    pass
+
+
+class _Request:
+    #one API request: the connections it holds, so a newer request from the
+    #same client slot can cancel their running queries
+    def __init__(self, slot, seq, statement_timeout):
+        self.slot = slot
+        self.seq = seq
+        self.statement_timeout = statement_timeout
+        self.conns = set()
+        self.superseded = False
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool with blocking checkout
+
+    - minconn/maxconn: connections opened up front / hard cap (every
+      connection opened stays in the pool until it breaks)
+    - timeout: seconds to wait for a free connection before PoolTimeout
+    - check_after: connections idle longer than this get a `SELECT 1`
+      health check on checkout (0 = check every checkout)
+    - statement_timeout: default seconds a query may run (0 = no limit),
+      begin_request() can set another one per request
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=10.0, check_after=30.0,
+                 statement_timeout=0.0):
+        if minconn > maxconn:
+            raise ValueError("DB_POOL_MIN must not be larger than DB_POOL_MAX")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_after = check_after
+        self.statement_timeout = statement_timeout
+
+        self._pool = pg_pool.ThreadedConnectionPool(minconn, maxconn, dsn=dsn)
+        # psycopg2 closes a returned connection once `minconn` are idle;
+        # keep every connection warm (only minconn are opened up front)
+        self._pool.minconn = maxconn
+        # ThreadedConnectionPool raises instead of waiting when exhausted,
+        # the semaphore turns that into a bounded wait
+        self._slots = threading.BoundedSemaphore(maxconn)
+        # per-connection state, keyed on the connection itself: id()s of
+        # closed connections get reused by new ones
+        self._last_used = weakref.WeakKeyDictionary()
+        self._timeouts = weakref.WeakKeyDictionary()
+        self._requests = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self.stats = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'discarded': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'superseded': 0,
+            'cancelled_queries': 0,
+        }
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(conn)
+        if last_used is not None and time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _set_statement_timeout(self, conn, seconds):
+        #session setting, only re-sent when it changes for this connection
+        ms = int(seconds * 1000)
+        if self._timeouts.get(conn) == ms:
+            return
+        with conn.cursor() as cur:
+            cur.execute("SET statement_timeout = %s", (ms,))
+        conn.commit()
+        self._timeouts[conn] = ms
+
+    def getconn(self):
+        start = time.monotonic()
+        current = getattr(self._local, 'request', None)
+        if current is not None and current.superseded:
+            raise RequestSuperseded("a newer request replaced this one")
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.stats['timeouts'] += 1
+            raise PoolTimeout(f"no database connection free after {self.timeout}s")
+
+        try:
+            # a broken connection is dropped and replaced, at most once per slot
+            for _ in range(self.maxconn + 1):
+                conn = self._pool.getconn()
+                if self._is_healthy(conn):
+                    break
+                logger.warning("discarding broken pooled connection")
+                with self._lock:
+                    self.stats['discarded'] += 1
+                self._pool.putconn(conn, close=True)
+            else:
+                raise psycopg2.OperationalError("could not get a healthy connection")
+
+        except Exception:
+            self._slots.release()
+            raise
+
+        try:
+            timeout = self.statement_timeout
+            if current is not None and current.statement_timeout is not None:
+                timeout = current.statement_timeout
+            self._set_statement_timeout(conn, timeout)
+
+            if current is not None:
+                with self._lock:
+                    if not current.superseded:
+                        current.conns.add(conn)
+                if conn not in current.conns:
+                    raise RequestSuperseded("a newer request replaced this one")
+        except Exception:
+            self.putconn(conn)
+            raise
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self.stats['checkouts'] += 1
+            self.stats['wait_seconds_total'] += waited
+            self.stats['wait_seconds_max'] = max(self.stats['wait_seconds_max'], waited)
+        self._local.checkouts = getattr(self._local, 'checkouts', 0) + 1
+        self._local.wait = getattr(self._local, 'wait', 0.0) + waited
+        return conn
+
+    def putconn(self, conn):
+        current = getattr(self._local, 'request', None)
+        if current is not None:
+            with self._lock:
+                current.conns.discard(conn)
+        try:
+            # the pool itself rolls back open transactions (pd.read_sql leaves one)
+            broken = bool(conn.closed)
+            if not broken:
+                self._last_used[conn] = time.monotonic()
+            self._pool.putconn(conn, close=broken)
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    #per-request checkout timing and cancellation (requests are served one
+    #per thread)
+    def begin_request(self, slot=None, seq=None, statement_timeout=None):
+        #slot: client session + panel a request belongs to, seq: its number
+        #within the slot; a request with a higher seq cancels the queries of
+        #the one it replaces (an out-of-order older one is refused instead)
+        self._local.checkouts = 0
+        self._local.wait = 0.0
+        current = _Request(slot, seq, statement_timeout)
+        self._local.request = current
+        if slot is None:
+            return
+
+        with self._lock:
+            previous = self._requests.get(slot)
+            if previous is not None and seq is not None and previous.seq is not None \
+                    and seq < previous.seq:
+                previous, current.superseded = None, True
+                self.stats['superseded'] += 1
+            else:
+                self._requests[slot] = current
+        if previous is not None:
+            self._supersede(previous)
+
+    def _supersede(self, previous):
+        #cancel whatever the replaced request is running; conn.cancel() only
+        #sends a cancel packet, so it is safe from this thread. It is sent
+        #under the lock: putconn() takes a connection out of previous.conns
+        #under it too, so a connection already back in the pool (and maybe
+        #running another request's query) is never cancelled
+        with self._lock:
+            previous.superseded = True
+            self.stats['superseded'] += 1
+            for conn in previous.conns:
+                try:
+                    conn.cancel()
+                    self.stats['cancelled_queries'] += 1
+                except psycopg2.Error:
+                    pass
+
+    def end_request(self):
+        current = getattr(self._local, 'request', None)
+        self._local.request = None
+        if current is not None and current.slot is not None:
+            with self._lock:
+                if self._requests.get(current.slot) is current:
+                    del self._requests[current.slot]
+
+    def superseded(self):
+        #True when the current request was replaced by a newer one
+        current = getattr(self._local, 'request', None)
+        return current is not None and current.superseded
+
+    def raise_if_superseded(self):
+        if self.superseded():
+            raise RequestSuperseded("a newer request replaced this one")
+
+    def request_wait(self):
+        return getattr(self._local, 'checkouts', 0), getattr(self._local, 'wait', 0.0)
+
+    def closeall(self):
+        if not self._pool.closed:
+            self._pool.closeall()
+
+
+_shared_pool = None
+_shared_lock = threading.Lock()
+
+
+def get_pool(dsn=None):
+    #process-wide pool, sized from DB_POOL_MIN / DB_POOL_MAX / DB_POOL_TIMEOUT / DB_POOL_CHECK_AFTER,
+    #queries limited to DB_STATEMENT_TIMEOUT seconds (0 = no limit)
+    global _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            dsn = dsn or os.getenv('DATABASE_URL')
+            if not dsn:
+                raise ValueError("DATABASE_URL not found in environment variables!")
+            _shared_pool = ConnectionPool(
+                dsn,
+                minconn=int(os.getenv('DB_POOL_MIN', 1)),
+                maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+                timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+                check_after=float(os.getenv('DB_POOL_CHECK_AFTER', 30)),
+                statement_timeout=float(os.getenv('DB_STATEMENT_TIMEOUT', 0)),
+            )
+            atexit.register(_shared_pool.closeall)
+        return _shared_pool
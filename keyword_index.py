@@ -0,0 +1,210 @@
+#Inverted keyword index: one (term, source, post_key, created_at) row per
+#distinct word of every post/comment, so "which posts mention X" is an index
+#probe on keyword_index instead of an ILIKE scan over JSONB.
+#
+#Filled at ingest by chan_crawler.py / reddit_crawler.py, backfill with:
+#   python3 keyword_index.py backfill [posts|reddit_posts|reddit_comments|all]
+#
+#post_key per source table:
+#   posts            board_name/post_number
+#   reddit_posts     subreddit/post_id
+#   reddit_comments  post_id/comment_id
+
+import os
+import re
+import sys
+import html
+import datetime
+
+from psycopg2.extras import execute_values
+
+# what each source table indexes, how its rows map to a post_key, and how an
+# index row `k` joins back to its source row `p` (posts.created_at is a plain
+# TIMESTAMP, indexed as that wall-clock time in UTC, so the index side is
+# read back in UTC whatever the session TimeZone and the posts index stays usable)
+SOURCES = {
+    'posts': {
+        'text': "COALESCE(data->>'sub', '') || ' ' || COALESCE(data->>'com', '')",
+        'key': "board_name || '/' || post_number",
+        'join': ("p.board_name = split_part(k.post_key, '/', 1) "
+                 "AND p.post_number = split_part(k.post_key, '/', 2)::bigint "
+                 "AND p.created_at = (k.created_at AT TIME ZONE 'UTC')"),
+    },
+    'reddit_posts': {
+        'text': "COALESCE(title, '') || ' ' || COALESCE(data->>'selftext', '')",
+        'key': "subreddit || '/' || post_id",
+        'join': ("p.subreddit = split_part(k.post_key, '/', 1) "
+                 "AND p.post_id = split_part(k.post_key, '/', 2) "
+                 "AND p.created_at = k.created_at"),
+    },
+    'reddit_comments': {
+        'text': "COALESCE(data->>'body', '')",
+        'key': "post_id || '/' || comment_id",
+        'join': ("p.post_id = split_part(k.post_key, '/', 1) "
+                 "AND p.comment_id = split_part(k.post_key, '/', 2) "
+                 "AND p.created_at = k.created_at"),
+    },
+}
+
+TAG_RE = re.compile(r'<[^>]+>')
+TOKEN_RE = re.compile(r"[a-z][a-z0-9]+")
+
+# very common words are never looked up, leaving them out keeps the index small
+STOP_WORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in is it its
+me my no not of on or our she so than that the their them then there these
+they this to was we were what when which who will with you your
+""".split())
+
+
+def clean_text(text):
+    #lowercase text with 4chan HTML tags and entities removed
+    return html.unescape(TAG_RE.sub(' ', text or '')).lower()
+
+
+def extract_terms(text):
+    #distinct lowercase word tokens of a post
+    if not text:
+        return set()
+    return {term for term in TOKEN_RE.findall(clean_text(text)) if term not in STOP_WORDS}
+
+
+def keyword_words(keyword):
+    #the index terms a keyword is made of, tokenized like post text
+    #('climate change' -> climate, change; 'covid-19' -> covid); a post
+    #matches the keyword when it contains all of them. A keyword with no
+    #indexed word (stop words, numbers, single letters) is a ValueError
+    words = [word for word in dict.fromkeys(TOKEN_RE.findall(clean_text(keyword)))
+             if word not in STOP_WORDS]
+    if not words:
+        raise ValueError(f"keyword {keyword!r} has no searchable word "
+                         "(stop words, numbers and single letters are not indexed)")
+    return words
+
+
+def keyword_variants(word):
+    #index terms one keyword word matches: the word and its plural
+    #('immigrant' -> immigrant, immigrants), but not longer words ('jewelry')
+    word = word.strip().lower()
+    return [word, word + 's', word + 'es']
+
+
+def keyword_params(keywords):
+    #query parameters for keyword_posts_sql(): every index term with the
+    #keyword it counts for, the position of the keyword word it is a
+    #variant of, and the keyword's number of words
+    params = {'terms': [], 'keywords': [], 'words': [], 'word_counts': []}
+    for keyword in keywords:
+        words = keyword_words(keyword)
+        for position, word in enumerate(words):
+            for variant in keyword_variants(word):
+                params['terms'].append(variant)
+                params['keywords'].append(keyword)
+                params['words'].append(position)
+                params['word_counts'].append(len(words))
+    return params
+
+
+def keyword_posts_sql(source):
+    #(keyword, post_key, created_at) of every `source` row containing all
+    #words of a keyword; expects the parameters of keyword_params()
+    return f"""
+        SELECT v.keyword, i.post_key, i.created_at
+        FROM keyword_index i
+        JOIN unnest(%(terms)s::text[], %(keywords)s::text[], %(words)s::int[],
+                    %(word_counts)s::int[]) as v(term, keyword, word, word_count)
+            ON v.term = i.term
+        WHERE i.source = '{source}'
+        GROUP BY v.keyword, i.post_key, i.created_at
+        HAVING COUNT(DISTINCT v.word) = MAX(v.word_count)
+    """
+
+
+def keyword_hits_sql(source, tablesample=''):
+    #FROM clause yielding each `source` row (as p) once per keyword it
+    #contains (k.keyword); expects the parameters of keyword_params()
+    #tablesample: optional TABLESAMPLE clause applied to the source table
+    return f"""
+        ({keyword_posts_sql(source)}) as k
+        JOIN {source} p {tablesample} ON {SOURCES[source]['join']}
+    """
+
+
+def matching_posts_sql(source):
+    #FROM clause yielding each `source` row (as p) that contains any of the
+    #keywords of keyword_params(), once per row; k.post_key identifies it
+    return f"""
+        (SELECT DISTINCT post_key, created_at
+         FROM ({keyword_posts_sql(source)}) as hits) as k
+        JOIN {source} p ON {SOURCES[source]['join']}
+    """
+
+
+def index_rows(source, post_key, created_at, text):
+    if created_at.tzinfo is None:
+        # posts.created_at is a plain TIMESTAMP: store that wall-clock time
+        # as UTC so the stored instant does not depend on the session TimeZone
+        created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+    return [(term, source, post_key, created_at) for term in extract_terms(text)]
+
+
+def insert_index_rows(cur, rows, page_size=1000):
+    #rows from index_rows(); re-indexing the same post is a no-op
+    if rows:
+        execute_values(cur, """
+            INSERT INTO keyword_index (term, source, post_key, created_at)
+            VALUES %s
+            ON CONFLICT DO NOTHING
+        """, rows, page_size=page_size)
+
+
+def backfill(read_conn, write_conn, source, batch_size=5000):
+    #index every existing row of one source table (idempotent)
+    #rows stream through a server-side cursor on read_conn while write_conn
+    #commits every batch, so an interrupted backfill keeps its progress
+    spec = SOURCES[source]
+    read = read_conn.cursor(name=f'keyword_backfill_{source}')
+    read.itersize = batch_size
+    read.execute(f"SELECT {spec['key']}, created_at, {spec['text']} FROM {source}")
+
+    write = write_conn.cursor()
+    indexed = 0
+    while True:
+        batch = read.fetchmany(batch_size)
+        if not batch:
+            break
+        rows = []
+        for post_key, created_at, text in batch:
+            rows.extend(index_rows(source, post_key, created_at, text))
+        insert_index_rows(write, rows)
+        write_conn.commit()
+        indexed += len(batch)
+        print(f"  {source}: {indexed:,} rows indexed")
+    read.close()
+    read_conn.rollback()
+    write.close()
+    return indexed
+
+
+if __name__ == "__main__":
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        print("Usage: python3 keyword_index.py backfill [posts|reddit_posts|reddit_comments|all]")
+        sys.exit(1)
+
+    target = sys.argv[2] if len(sys.argv) > 2 else 'all'
+    sources = list(SOURCES) if target == 'all' else [target]
+    if any(source not in SOURCES for source in sources):
+        print("Invalid. Use: posts, reddit_posts, reddit_comments, or all")
+        sys.exit(1)
+
+    read_conn = psycopg2.connect(dsn=os.getenv("DATABASE_URL"))
+    write_conn = psycopg2.connect(dsn=os.getenv("DATABASE_URL"))
+    for source in sources:
+        backfill(read_conn, write_conn, source)
+    read_conn.close()
+    write_conn.close()
@@ -0,0 +1,83 @@
+#Single-pass multi-keyword matching for in-memory text
+#
+#Each document is tokenized once with the same rules as the keyword index
+#(keyword_index.py), and its tokens are intersected with the variants of all
+#keywords at once; a keyword of several words needs all of them. The result is one bitmask per document (bit i set = keyword
+#i present), so counting by group is a vectorized numpy/pandas operation
+#instead of a str.contains pass per keyword.
+
+import numpy as np
+import pandas as pd
+
+from keyword_index import TOKEN_RE, clean_text, keyword_variants, keyword_words
+
+MAX_KEYWORDS = 64
+
+
+class KeywordMatcher:
+    """
+    Matches a fixed keyword list as whole words (plus plurals, like the index);
+    a keyword of several words matches documents containing all of them
+
+    - mask(text): int bitmask of the keywords in one document
+    - masks(texts): uint64 array of bitmasks, one per document
+    - presence(masks): bool matrix (documents x keywords)
+    - counts(masks, groups): documents mentioning each keyword, per group
+    """
+
+    def __init__(self, keywords):
+        self.keywords = list(dict.fromkeys(k.strip().lower() for k in keywords if k.strip()))
+        if not self.keywords:
+            raise ValueError("KeywordMatcher needs at least one keyword")
+        if len(self.keywords) > MAX_KEYWORDS:
+            raise ValueError(f"KeywordMatcher supports at most {MAX_KEYWORDS} keywords")
+
+        # every word of every keyword gets a bit; variant -> bits of the words
+        # it belongs to ('jews' counts for both 'jew' and 'jews' when both
+        # are tracked), and per keyword the bits of all its words
+        self._bits = {}
+        self._needs = []
+        word_bit = 0
+        for keyword in self.keywords:
+            need = 0
+            for word in keyword_words(keyword):
+                for variant in keyword_variants(word):
+                    self._bits[variant] = self._bits.get(variant, 0) | (1 << word_bit)
+                need |= 1 << word_bit
+                word_bit += 1
+            self._needs.append(need)
+        self._vocabulary = frozenset(self._bits)
+
+    def mask(self, text):
+        if not text:
+            return 0
+        words = 0
+        for term in self._vocabulary.intersection(TOKEN_RE.findall(clean_text(text))):
+            words |= self._bits[term]
+        if not words:
+            return 0
+        bits = 0
+        for i, need in enumerate(self._needs):
+            if words & need == need:
+                bits |= 1 << i
+        return bits
+
+    def masks(self, texts):
+        return np.fromiter((self.mask(text) for text in texts), dtype=np.uint64)
+
+    def names(self, mask):
+        #keywords set in one bitmask, in keyword order
+        return [keyword for i, keyword in enumerate(self.keywords) if mask >> i & 1]
+
+    def presence(self, masks):
+        masks = np.asarray(masks, dtype=np.uint64)
+        shifts = np.arange(len(self.keywords), dtype=np.uint64)
+        return (masks[:, None] >> shifts) & np.uint64(1) == 1
+
+    def counts(self, masks, groups=None):
+        #Series keyword -> documents, or a DataFrame (group x keyword) when
+        #groups (one label per document) is given
+        presence = pd.DataFrame(self.presence(masks), columns=self.keywords)
+        if groups is None:
+            return presence.sum()
+        return presence.groupby(np.asarray(groups)).sum()
@@ -0,0 +1,136 @@
+#Per-endpoint performance metrics for the dashboard API
+#
+#Every /api/* request is split into phases, each kept as a latency histogram
+#per endpoint and served in Prometheus text format at /api/_metrics:
+#
+#- sql        time in analysis queries (ToxicityAnalyzer._read_sql)
+#- compute    time in the analyzer outside those queries (pandas/NumPy)
+#- serialize  time encoding the result (transport.encode)
+#- total      whole request, cache lookups included
+#
+#plus histograms of the rows the queries fetched and of the response size.
+#Phases are collected per thread between begin() and finish(); queries run
+#outside a request (scripts, notebooks) record nothing.
+
+import time
+import threading
+from contextlib import contextmanager
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+ROWS_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """
+    Prometheus-style histogram with fixed upper bounds, one series per
+    label tuple (counts are per bucket, cumulated only when rendered)
+    """
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+
+    def observe(self, label_values, value):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total) in sorted(self._series.items()):
+            labels = ','.join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Metrics:
+    #histograms of every finished request plus the current request's phases
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.latency = Histogram('dashboard_request_seconds', 'Time per API request phase',
+                                 ('endpoint', 'phase'), SECONDS_BUCKETS)
+        self.rows = Histogram('dashboard_rows_fetched', 'Rows fetched by the queries of one API request',
+                              ('endpoint',), ROWS_BUCKETS)
+        self.size = Histogram('dashboard_response_bytes', 'API response body size',
+                              ('endpoint', 'cache'), BYTES_BUCKETS)
+
+    def begin(self):
+        self._local.current = {'started': time.perf_counter(), 'sql': 0.0, 'rows': 0,
+                               'compute': None, 'serialize': None, 'cache': 'none'}
+
+    def _current(self):
+        return getattr(self._local, 'current', None)
+
+    def record_query(self, seconds, rows):
+        current = self._current()
+        if current is not None:
+            current['sql'] += seconds
+            current['rows'] += rows
+
+    def set_cache(self, status):
+        current = self._current()
+        if current is not None:
+            current['cache'] = status
+
+    @contextmanager
+    def timed(self, phase):
+        #time the block as `phase`; 'compute' excludes the queries run in it,
+        #'sql' covers queries not run through _read_sql (no row count)
+        started = time.perf_counter()
+        current = self._current()
+        sql_before = current['sql'] if current is not None else 0.0
+        try:
+            yield
+        finally:
+            if current is not None:
+                elapsed = time.perf_counter() - started
+                if phase == 'compute':
+                    elapsed -= current['sql'] - sql_before
+                current[phase] = (current[phase] or 0.0) + elapsed
+
+    def finish(self, endpoint, response_bytes):
+        current = self._current()
+        self._local.current = None
+        if current is None:
+            return
+        total = time.perf_counter() - current['started']
+        with self._lock:
+            self.latency.observe((endpoint, 'total'), total)
+            # phases that did not run (cache hits) are left out of their histogram
+            for phase in ('compute', 'serialize'):
+                if current[phase] is not None:
+                    self.latency.observe((endpoint, phase), current[phase])
+            if current['compute'] is not None or current['sql']:
+                self.latency.observe((endpoint, 'sql'), current['sql'])
+                self.rows.observe((endpoint,), current['rows'])
+            if response_bytes is not None:
+                self.size.observe((endpoint, current['cache']), response_bytes)
+
+    def render(self):
+        #Prometheus text exposition format (version 0.0.4)
+        with self._lock:
+            lines = self.latency.render() + self.rows.render() + self.size.render()
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,12 @@
+-- Per (platform, day) KLL quantile sketches of toxicity scores (see sketch.py)
+-- n is the number of scored rows the sketch was built from; a day whose
+-- scored count no longer matches is rebuilt by the dashboard
+
+CREATE TABLE IF NOT EXISTS toxicity_sketches (
+  platform TEXT NOT NULL,
+  day DATE NOT NULL,
+  n BIGINT NOT NULL,
+  sketch BYTEA NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (platform, day)
+);
@@ -0,0 +1,187 @@
+-- Hourly toxicity rollups (Timescale continuous aggregates)
+--
+-- One row per hour per board/subreddit with row counts, per-attribute
+-- counts and sums for the six Perspective scores (mean = sum_x / n_x) and
+-- the 20-bin toxicity histogram the dashboard draws (hist_01 = [0, 0.05) ...
+-- hist_20 = [0.95, 1]).
+--
+-- materialized_only = false makes these real-time aggregates: a query reads
+-- the materialized hours and only aggregates raw rows for the tail that the
+-- refresh policy has not materialized yet. start_offset => NULL lets the
+-- policy pick up invalidated hours of any age, which matters because
+-- perspective_toxicity.py scores old rows long after they were crawled.
+--
+-- The aggregates start empty; the 20261017100001..3 migrations materialize
+-- the existing rows (refresh_continuous_aggregate cannot run in a
+-- transaction, so each gets a no-transaction migration of its own).
+
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS toxicity_scores JSONB;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS toxicity_scores JSONB;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS toxicity_scores JSONB;
+
+-- the six typed score columns (see 20261017130000_add_toxicity_columns.sql,
+-- which also indexes them) so the rollups count exactly the rows the typed
+-- column queries count as scored
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS toxicity DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS severe_toxicity DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS identity_attack DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS insult DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS profanity DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS threat DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS toxicity DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS severe_toxicity DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS identity_attack DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS insult DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS profanity DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS threat DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS toxicity DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS severe_toxicity DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS identity_attack DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS insult DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS profanity DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS threat DOUBLE PRECISION;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS posts_toxicity_hourly
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+  time_bucket(INTERVAL '1 hour', created_at) AS bucket,
+  board_name AS community,
+  COUNT(*) AS n_rows,
+  COUNT(*) FILTER (WHERE data->>'resto' = '0') AS n_threads,
+  COUNT(toxicity) AS n_toxicity,
+  SUM(toxicity) AS sum_toxicity,
+  COUNT(severe_toxicity) AS n_severe_toxicity,
+  SUM(severe_toxicity) AS sum_severe_toxicity,
+  COUNT(identity_attack) AS n_identity_attack,
+  SUM(identity_attack) AS sum_identity_attack,
+  COUNT(insult) AS n_insult,
+  SUM(insult) AS sum_insult,
+  COUNT(profanity) AS n_profanity,
+  SUM(profanity) AS sum_profanity,
+  COUNT(threat) AS n_threat,
+  SUM(threat) AS sum_threat,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) <= 1) AS hist_01,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 2) AS hist_02,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 3) AS hist_03,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 4) AS hist_04,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 5) AS hist_05,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 6) AS hist_06,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 7) AS hist_07,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 8) AS hist_08,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 9) AS hist_09,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 10) AS hist_10,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 11) AS hist_11,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 12) AS hist_12,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 13) AS hist_13,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 14) AS hist_14,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 15) AS hist_15,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 16) AS hist_16,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 17) AS hist_17,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 18) AS hist_18,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 19) AS hist_19,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) >= 20) AS hist_20
+FROM posts
+GROUP BY bucket, board_name
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('posts_toxicity_hourly',
+  start_offset => NULL,
+  end_offset => INTERVAL '1 hour',
+  schedule_interval => INTERVAL '30 minutes',
+  if_not_exists => TRUE);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reddit_posts_toxicity_hourly
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+  time_bucket(INTERVAL '1 hour', created_at) AS bucket,
+  subreddit AS community,
+  COUNT(*) AS n_rows,
+  COUNT(toxicity) AS n_toxicity,
+  SUM(toxicity) AS sum_toxicity,
+  COUNT(severe_toxicity) AS n_severe_toxicity,
+  SUM(severe_toxicity) AS sum_severe_toxicity,
+  COUNT(identity_attack) AS n_identity_attack,
+  SUM(identity_attack) AS sum_identity_attack,
+  COUNT(insult) AS n_insult,
+  SUM(insult) AS sum_insult,
+  COUNT(profanity) AS n_profanity,
+  SUM(profanity) AS sum_profanity,
+  COUNT(threat) AS n_threat,
+  SUM(threat) AS sum_threat,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) <= 1) AS hist_01,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 2) AS hist_02,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 3) AS hist_03,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 4) AS hist_04,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 5) AS hist_05,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 6) AS hist_06,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 7) AS hist_07,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 8) AS hist_08,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 9) AS hist_09,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 10) AS hist_10,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 11) AS hist_11,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 12) AS hist_12,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 13) AS hist_13,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 14) AS hist_14,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 15) AS hist_15,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 16) AS hist_16,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 17) AS hist_17,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 18) AS hist_18,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 19) AS hist_19,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) >= 20) AS hist_20
+FROM reddit_posts
+GROUP BY bucket, subreddit
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('reddit_posts_toxicity_hourly',
+  start_offset => NULL,
+  end_offset => INTERVAL '1 hour',
+  schedule_interval => INTERVAL '30 minutes',
+  if_not_exists => TRUE);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS reddit_comments_toxicity_hourly
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+  time_bucket(INTERVAL '1 hour', created_at) AS bucket,
+  subreddit AS community,
+  COUNT(*) AS n_rows,
+  COUNT(toxicity) AS n_toxicity,
+  SUM(toxicity) AS sum_toxicity,
+  COUNT(severe_toxicity) AS n_severe_toxicity,
+  SUM(severe_toxicity) AS sum_severe_toxicity,
+  COUNT(identity_attack) AS n_identity_attack,
+  SUM(identity_attack) AS sum_identity_attack,
+  COUNT(insult) AS n_insult,
+  SUM(insult) AS sum_insult,
+  COUNT(profanity) AS n_profanity,
+  SUM(profanity) AS sum_profanity,
+  COUNT(threat) AS n_threat,
+  SUM(threat) AS sum_threat,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) <= 1) AS hist_01,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 2) AS hist_02,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 3) AS hist_03,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 4) AS hist_04,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 5) AS hist_05,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 6) AS hist_06,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 7) AS hist_07,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 8) AS hist_08,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 9) AS hist_09,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 10) AS hist_10,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 11) AS hist_11,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 12) AS hist_12,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 13) AS hist_13,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 14) AS hist_14,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 15) AS hist_15,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 16) AS hist_16,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 17) AS hist_17,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 18) AS hist_18,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) = 19) AS hist_19,
+  COUNT(*) FILTER (WHERE width_bucket(toxicity, 0, 1, 20) >= 20) AS hist_20
+FROM reddit_comments
+GROUP BY bucket, subreddit
+WITH NO DATA;
+
+SELECT add_continuous_aggregate_policy('reddit_comments_toxicity_hourly',
+  start_offset => NULL,
+  end_offset => INTERVAL '1 hour',
+  schedule_interval => INTERVAL '30 minutes',
+  if_not_exists => TRUE);
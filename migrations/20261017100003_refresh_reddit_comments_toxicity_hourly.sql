@@ -0,0 +1,8 @@
+-- no-transaction
+-- Materialize reddit_comments_toxicity_hourly for the rows that existed when it was created
+-- (20261017100000_create_toxicity_rollups.sql). refresh_continuous_aggregate
+-- refuses to run inside a transaction block, and a multi-statement migration
+-- runs as one implicit transaction even with no-transaction, so each refresh
+-- is its own migration.
+
+CALL refresh_continuous_aggregate('reddit_comments_toxicity_hourly', NULL, NULL);
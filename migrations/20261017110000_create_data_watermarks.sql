@@ -0,0 +1,9 @@
+-- Scoring progress per table, bumped by perspective_toxicity.py with every
+-- committed batch. The dashboard result cache uses it (together with the
+-- newest created_at per table) as its data watermark.
+
+CREATE TABLE IF NOT EXISTS data_watermarks (
+  table_name TEXT PRIMARY KEY,
+  scored_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  rows_scored BIGINT NOT NULL DEFAULT 0
+);
@@ -0,0 +1,22 @@
+-- Inverted keyword index, one row per distinct word per post/comment
+-- (filled by the crawlers, backfilled with `python3 keyword_index.py backfill`)
+--
+-- source names the table the row came from (posts, reddit_posts,
+-- reddit_comments); post_key is its natural key joined with '/', see
+-- keyword_index.py. created_at is copied from the source row so lookups can
+-- be restricted to a time range and joins back hit a single chunk.
+
+CREATE TABLE IF NOT EXISTS keyword_index (
+  term TEXT NOT NULL,
+  source TEXT NOT NULL,
+  post_key TEXT NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL
+);
+
+SELECT create_hypertable('keyword_index', 'created_at',
+  chunk_time_interval => INTERVAL '1 day',
+  if_not_exists => TRUE);
+
+-- lookups are always by term (and source), optionally by time
+CREATE UNIQUE INDEX IF NOT EXISTS keyword_index_uniq
+  ON keyword_index (term, source, created_at, post_key);
@@ -0,0 +1,57 @@
+-- Perspective scores as typed columns
+--
+-- toxicity_scores JSONB stays the record of what the API returned; the six
+-- attributes are also stored as typed columns so analytical queries read
+-- them without parsing JSON per row. DOUBLE PRECISION holds exactly the value
+-- the old ::float cast produced, so thresholds behave as before.
+-- perspective_toxicity.py writes both in the same UPDATE. Fill rows scored before this migration with
+--   python3 "Data Analysis/perspective_toxicity.py" backfill
+--
+-- A scored row has toxicity IS NOT NULL (Perspective returns all six
+-- attributes or fails the request).
+
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS toxicity DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS severe_toxicity DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS identity_attack DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS insult DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS profanity DOUBLE PRECISION;
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS threat DOUBLE PRECISION;
+
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS toxicity DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS severe_toxicity DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS identity_attack DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS insult DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS profanity DOUBLE PRECISION;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS threat DOUBLE PRECISION;
+
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS toxicity DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS severe_toxicity DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS identity_attack DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS insult DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS profanity DOUBLE PRECISION;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS threat DOUBLE PRECISION;
+
+-- threshold filters (toxicity > t) and group counts over scored rows become
+-- index-only scans: the partial index holds scored rows only and carries
+-- every attribute plus the timestamp
+CREATE INDEX IF NOT EXISTS posts_toxicity_scored_idx
+  ON posts (toxicity)
+  INCLUDE (created_at, severe_toxicity, identity_attack, insult, profanity, threat)
+  WHERE toxicity IS NOT NULL;
+CREATE INDEX IF NOT EXISTS reddit_posts_toxicity_scored_idx
+  ON reddit_posts (toxicity)
+  INCLUDE (created_at, severe_toxicity, identity_attack, insult, profanity, threat)
+  WHERE toxicity IS NOT NULL;
+CREATE INDEX IF NOT EXISTS reddit_comments_toxicity_scored_idx
+  ON reddit_comments (toxicity)
+  INCLUDE (created_at, severe_toxicity, identity_attack, insult, profanity, threat)
+  WHERE toxicity IS NOT NULL;
+
+-- rows arrive in created_at order, so a BRIN index answers date-range
+-- filters for a few pages per chunk instead of a full btree
+CREATE INDEX IF NOT EXISTS posts_created_at_brin
+  ON posts USING BRIN (created_at) WITH (pages_per_range = 32);
+CREATE INDEX IF NOT EXISTS reddit_posts_created_at_brin
+  ON reddit_posts USING BRIN (created_at) WITH (pages_per_range = 32);
+CREATE INDEX IF NOT EXISTS reddit_comments_created_at_brin
+  ON reddit_comments USING BRIN (created_at) WITH (pages_per_range = 32);
@@ -0,0 +1,18 @@
+-- When each row was scored
+--
+-- perspective_toxicity.py sets scored_at = now() in the same UPDATE that
+-- writes the scores. The TF-IDF model (tfidf_model.py) refreshes by reading
+-- only rows scored since its last run; rows scored before this migration
+-- keep scored_at NULL and are picked up by the first (full) model build.
+
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS scored_at TIMESTAMPTZ;
+ALTER TABLE reddit_posts ADD COLUMN IF NOT EXISTS scored_at TIMESTAMPTZ;
+ALTER TABLE reddit_comments ADD COLUMN IF NOT EXISTS scored_at TIMESTAMPTZ;
+
+-- partial: only rows scored from now on are ever looked up by scored_at
+CREATE INDEX IF NOT EXISTS posts_scored_at_idx
+  ON posts (scored_at) WHERE scored_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS reddit_posts_scored_at_idx
+  ON reddit_posts (scored_at) WHERE scored_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS reddit_comments_scored_at_idx
+  ON reddit_comments (scored_at) WHERE scored_at IS NOT NULL;
@@ -0,0 +1,20 @@
+-- Per-thread crawl progress, kept by chan_crawler.py
+--
+-- max_post_number is the highest post_number stored for the thread, so a
+-- re-crawl inserts only the posts above it. post_count is how many posts the
+-- last crawl saw at or below it: fewer on the next crawl means posts were
+-- deleted. edit_hash fingerprints the editable parts of those posts (text,
+-- file deletions, OP flags); a change triggers an update of the changed rows.
+
+CREATE TABLE IF NOT EXISTS crawl_thread_state (
+  board_name TEXT NOT NULL,
+  thread_number BIGINT NOT NULL,
+  max_post_number BIGINT NOT NULL,
+  post_count INTEGER NOT NULL,
+  edit_hash TEXT NOT NULL,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (board_name, thread_number)
+);
+
+-- set when a post disappears from its (still live) thread; the row is kept
+ALTER TABLE posts ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
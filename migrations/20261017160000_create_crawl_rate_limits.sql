@@ -0,0 +1,11 @@
+-- Per-host request budget shared by all crawler processes, kept by
+-- crawl_engine.PostgresLimiter
+--
+-- tat is the host's "theoretical arrival time" (GCRA): every request moves
+-- it one interval (1 / requests per second) later and waits until it is
+-- within the burst tolerance of now. A 429 moves it past the pause.
+
+CREATE TABLE IF NOT EXISTS crawl_rate_limits (
+  host TEXT PRIMARY KEY,
+  tat TIMESTAMPTZ NOT NULL
+);
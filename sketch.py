@@ -0,0 +1,219 @@
+#Mergeable quantile sketches for toxicity scores
+#
+#A KLL sketch (Karnin, Lang & Liberty 2016) keeps a few hundred weighted
+#samples no matter how many scores go in. Sketches can be fed incrementally,
+#merged (across platforms or days) and serialized, so the dashboard keeps one
+#per (platform, day) in the toxicity_sketches table and merges the days it needs.
+#
+#Error bound: with k=200 a quantile/CDF answer is within ~1.3% of the true
+#normalized rank (99% confidence). See KLLSketch.rank_error().
+
+import struct
+import numpy as np
+import pandas as pd
+
+DEFAULT_K = 200
+
+_HEADER = struct.Struct('<4sHqH')
+_MAGIC = b'KLL1'
+
+
+class KLLSketch:
+
+    def __init__(self, k=DEFAULT_K, seed=None):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        # top level holds k items, each level below holds 2/3 of the one above
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        #add one score or an array of scores (NaNs are ignored)
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if values.size:
+            self.n += values.size
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        #fold another sketch into this one (in place)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _compress(self):
+        # compact the lowest over-full level: sort it, keep every other item
+        # (random offset) and promote those to the next level at double weight
+        while True:
+            for level, items in enumerate(self.levels):
+                if len(items) > self._capacity(level):
+                    break
+            else:
+                return
+
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+
+            items = np.sort(self.levels[level])
+            # an odd item out stays behind so total weight is preserved
+            leftover = items[:len(items) % 2]
+            pairs = items[len(leftover):]
+            offset = self._rng.integers(2)
+
+            self.levels[level] = leftover
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], pairs[offset::2]])
+
+    def _sorted_view(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(len(items_at), 2 ** level, dtype=np.int64)
+            for level, items_at in enumerate(self.levels)
+        ])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self, qs):
+        #values at the given ranks (0..1)
+        qs = np.clip(np.asarray(qs, dtype=np.float64), 0, 1)
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        items, cumulative = self._sorted_view()
+        idx = np.searchsorted(cumulative, qs * self.n, side='left')
+        return items[np.minimum(idx, len(items) - 1)]
+
+    def cdf(self, xs):
+        #fraction of scores <= each x
+        xs = np.asarray(xs, dtype=np.float64)
+        if self.n == 0:
+            return np.full(xs.shape, np.nan)
+        items, cumulative = self._sorted_view()
+        idx = np.searchsorted(items, xs, side='right')
+        below = np.where(idx > 0, cumulative[np.maximum(idx - 1, 0)], 0)
+        return below / self.n
+
+    def cdf_curve(self, points=200):
+        #fixed-resolution CDF: `points` evenly spaced ranks and their values
+        ranks = np.linspace(0, 1, points)
+        return self.quantiles(ranks), ranks
+
+    def rank_error(self):
+        #normalized rank error at 99% confidence (empirical KLL constants
+        #from Apache DataSketches; ~0.0133 for k=200)
+        return 2.296 / self.k ** 0.9723
+
+    def to_bytes(self):
+        # scores only need float32 precision, which halves the stored size
+        sizes = np.array([len(items) for items in self.levels], dtype='<u4')
+        body = np.concatenate(self.levels).astype('<f4')
+        return _HEADER.pack(_MAGIC, self.k, self.n, len(self.levels)) + sizes.tobytes() + body.tobytes()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        blob = bytes(blob)
+        magic, k, n, num_levels = _HEADER.unpack_from(blob)
+        if magic != _MAGIC:
+            raise ValueError("not a serialized KLL sketch")
+        offset = _HEADER.size
+        sizes = np.frombuffer(blob, dtype='<u4', count=num_levels, offset=offset)
+        offset += sizes.nbytes
+        body = np.frombuffer(blob, dtype='<f4', offset=offset).astype(np.float64)
+
+        sketch = cls(k=k)
+        sketch.n = n
+        sketch.levels = np.split(body, np.cumsum(sizes)[:-1])
+        return sketch
+
+
+class SketchStore:
+    """
+    Per (platform, day) sketches persisted in the toxicity_sketches table
+
+    A day is rebuilt whenever its stored row count no longer matches the
+    number of scored rows for that day (new posts or late Perspective scores).
+    The stored count is the one the caller compared against when it rebuilt
+    the day (the rollup's count when rollups are used), so a rollup that
+    lags the raw rows does not make the day look stale on every request.
+    """
+
+    def __init__(self, k=DEFAULT_K):
+        self.k = k
+
+    def load(self, conn, start_date=None, end_date=None):
+        query = "SELECT platform, day, n, sketch FROM toxicity_sketches WHERE TRUE"
+        params = []
+        if start_date:
+            query += " AND day >= %s"
+            params.append(start_date)
+        if end_date:
+            query += " AND day <= %s"
+            params.append(end_date)
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            return {
+                (platform, day): (n, KLLSketch.from_bytes(blob))
+                for platform, day, n, blob in cur.fetchall()
+            }
+
+    def stale_days(self, current, stored):
+        #current: (platform, day) -> scored count now in the database
+        #returns the days whose sketch is missing or outdated
+        return {
+            key: n for key, n in current.items()
+            if key not in stored or stored[key][0] != n
+        }
+
+    def rebuild(self, conn, daily_scores_query, days, params=None, chunk_size=50000):
+        #stream scores for the given days once and sketch them per (platform, day)
+        #params: named parameters of daily_scores_query
+        sketches = {}
+        with conn.cursor(name='sketch_rebuild') as cur:
+            cur.itersize = chunk_size
+            cur.execute(
+                f"SELECT platform, day, toxicity FROM ({daily_scores_query}) as s "
+                "WHERE day = ANY(%(sketch_days)s)",
+                {**(params or {}), 'sketch_days': sorted({day for _, day in days})}
+            )
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                chunk = pd.DataFrame(rows, columns=['platform', 'day', 'toxicity'])
+                for key, scores in chunk.groupby(['platform', 'day'])['toxicity']:
+                    sketches.setdefault(key, KLLSketch(self.k)).update(scores.to_numpy())
+        return {key: sketch for key, sketch in sketches.items() if key in days}
+
+    def save(self, conn, sketches, counts=None):
+        #counts: (platform, day) -> the count to store instead of sketch.n
+        counts = counts or {}
+        with conn.cursor() as cur:
+            cur.executemany("""
+                INSERT INTO toxicity_sketches (platform, day, n, sketch, updated_at)
+                VALUES (%s, %s, %s, %s, now())
+                ON CONFLICT (platform, day) DO UPDATE
+                SET n = EXCLUDED.n, sketch = EXCLUDED.sketch, updated_at = now()
+            """, [
+                (platform, day, counts.get((platform, day), sketch.n), sketch.to_bytes())
+                for (platform, day), sketch in sketches.items()
+            ])
+        conn.commit()
+
+
+if __name__ == "__main__":
+    #how to run: python3 sketch.py   (builds/refreshes every day's sketch)
+    from dotenv import load_dotenv
+    from analysis import ToxicityAnalyzer
+
+    load_dotenv()
+    merged = ToxicityAnalyzer().get_sketches(platform='all')
+    for platform, sketch in merged.items():
+        print(f"{platform}: {sketch.n:,} scores, median {sketch.quantiles([0.5])[0]:.3f}")
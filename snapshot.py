@@ -0,0 +1,339 @@
+#Offline columnar snapshots of the scored corpus
+#
+#export() copies every scored post/comment into Parquet files partitioned by
+#platform and day (hive layout: platform=4chan/day=2025-01-31/*.parquet) with
+#the six Perspective attributes as typed columns. SnapshotAnalyzer answers
+#the ToxicityAnalyzer methods from such a directory instead of Postgres, so
+#heavy analysis can run on another machine without touching the ingest
+#database. Reads are memory-mapped, only the needed columns are read and
+#platform/date filters skip whole partitions.
+#
+#   python3 snapshot.py export <dir> [start_date] [end_date]
+#
+#   analyzer = SnapshotAnalyzer('<dir>')
+#   analyzer.get_multi_attribute_toxicity(platform='all', breakdown='day')
+#
+#Needs pyarrow.
+
+import os
+import sys
+import json
+import shutil
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from analysis import (ATTRIBUTES, COMMUNITY_COLUMNS, HISTOGRAM_BINS, PLATFORM_TABLES,
+                      ToxicityAnalyzer, check_accuracy, date_params, date_range)
+from keyword_index import SOURCES as INDEX_SOURCES, extract_terms, keyword_variants, keyword_words
+from sketch import KLLSketch, SketchStore
+from tfidf_model import SOURCES as TFIDF_SOURCES, ModelFile, TfidfModel
+
+MANIFEST = 'manifest.json'
+
+# columns of every snapshot row besides the platform/day partition keys;
+# text is the TF-IDF document, terms the distinct words the keyword index holds
+SCHEMA = pa.schema(
+    [
+        ('source', pa.string()),
+        ('community', pa.string()),
+        ('post_key', pa.string()),
+        ('created_at', pa.timestamp('us')),
+    ]
+    + [(attr, pa.float64()) for attr in ATTRIBUTES]
+    + [
+        ('text', pa.string()),
+        ('terms', pa.list_(pa.string())),
+        ('platform', pa.string()),
+        ('day', pa.date32()),
+    ]
+)
+PARTITIONING = ds.partitioning(
+    pa.schema([('platform', pa.string()), ('day', pa.date32())]), flavor='hive'
+)
+
+TFIDF_TEXT = {table: text for _, table, text in TFIDF_SOURCES}
+
+
+def export(conn, path, start_date=None, end_date=None, chunk_size=50000):
+    """
+    Write the scored rows of all three tables to a snapshot directory
+
+    The snapshot is built next to `path` and swapped in when complete, so
+    readers of an older snapshot at `path` never see a partial one.
+    Returns rows written per table.
+    """
+    tmp = f"{path.rstrip(os.sep)}.partial"
+    shutil.rmtree(tmp, ignore_errors=True)
+    params = date_params(start_date, end_date)
+
+    rows = {}
+    for platform, table in PLATFORM_TABLES:
+        # created_at::timestamp is the session-local time, which is also what
+        # DATE(created_at) and the analyzer's date filters use
+        conditions = ['toxicity IS NOT NULL'] + date_range(table, params)
+        query = f"""
+            SELECT
+                {COMMUNITY_COLUMNS[table]},
+                {INDEX_SOURCES[table]['key']},
+                created_at::timestamp,
+                {', '.join(ATTRIBUTES)},
+                {TFIDF_TEXT[table]},
+                {INDEX_SOURCES[table]['text']},
+                DATE(created_at)
+            FROM {table}
+            WHERE {' AND '.join(conditions)}
+        """
+        rows[table] = 0
+        with conn.cursor(name=f'snapshot_{table}') as cur:
+            cur.itersize = chunk_size
+            cur.execute(query, params)
+            chunk_number = 0
+            while True:
+                batch = cur.fetchmany(chunk_size)
+                if not batch:
+                    break
+                _write_chunk(tmp, table, platform, batch, chunk_number)
+                rows[table] += len(batch)
+                chunk_number += 1
+                print(f"  {table}: {rows[table]:,} rows")
+        conn.rollback()
+
+    os.makedirs(tmp, exist_ok=True)
+    with open(os.path.join(tmp, MANIFEST), 'w') as f:
+        json.dump({
+            'exported_at': datetime.now(timezone.utc).isoformat(),
+            'start_date': str(start_date) if start_date else None,
+            'end_date': str(end_date) if end_date else None,
+            'rows': rows,
+        }, f, indent=2)
+
+    old = f"{path.rstrip(os.sep)}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    return rows
+
+
+def _write_chunk(path, table, platform, batch, chunk_number):
+    communities, keys, created, *columns = zip(*batch)
+    scores = columns[:len(ATTRIBUTES)]
+    text, index_text, days = columns[len(ATTRIBUTES):]
+    data = {
+        'source': [table] * len(batch),
+        'community': communities,
+        'post_key': keys,
+        'created_at': created,
+        **{attr: values for attr, values in zip(ATTRIBUTES, scores)},
+        'text': text,
+        'terms': [sorted(extract_terms(t)) for t in index_text],
+        'platform': [platform] * len(batch),
+        'day': days,
+    }
+    ds.write_dataset(
+        pa.table({name: list(values) for name, values in data.items()}, schema=SCHEMA),
+        path,
+        format='parquet',
+        partitioning=PARTITIONING,
+        basename_template=f'{table}-{chunk_number}-{{i}}.parquet',
+        existing_data_behavior='overwrite_or_ignore',
+    )
+
+
+class SnapshotAnalyzer(ToxicityAnalyzer):
+    """
+    ToxicityAnalyzer answering from a snapshot directory instead of Postgres
+
+    Only the data access is replaced; every public method returns the same
+    structure as the database-backed analyzer. Sketches and the TF-IDF
+    model are built from the snapshot in memory (the snapshot is
+    immutable, so they are cached for the analyzer's lifetime); a
+    tfidf_model.joblib placed in the snapshot directory is used instead when
+    present.
+    """
+
+    def __init__(self, path):
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            raise ValueError(f"{path} is not a snapshot (no {MANIFEST}), run snapshot.py export")
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.pool = None
+        # only its k is used, sketches are never persisted from a snapshot
+        self.sketch_store = SketchStore()
+        self.use_rollups = False
+        self._trace = threading.local()
+        self.tfidf_model = ModelFile(os.path.join(path, 'tfidf_model.joblib'))
+        self._dataset = ds.dataset(
+            path, format='parquet', partitioning=PARTITIONING,
+            filesystem=fs.LocalFileSystem(use_mmap=True),
+            ignore_prefixes=['.', '_', 'manifest', 'tfidf_model'],
+        )
+        self._sketches = {}
+        self._tfidf_models = {}
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        raise RuntimeError("SnapshotAnalyzer has no database connection")
+
+    def get_watermark(self):
+        return (self.manifest['exported_at'],)
+
+    def _sample(self, accuracy, tables):
+        # columnar scans of a local snapshot are fast already, never sample
+        check_accuracy(accuracy)
+        return None
+
+    #---------- reading ----------
+
+    def _table(self, platform, start_date=None, end_date=None, columns=(), sources=None):
+        #pyarrow Table of the scored rows behind `platform`; platform/day
+        #filters prune partitions, only `columns` are read
+        platforms = [plat for plat, _ in PLATFORM_TABLES if platform in [plat, 'all']]
+        if not platforms:
+            raise ValueError(f"unknown platform {platform!r}, use 4chan, reddit or all")
+        params = date_params(start_date, end_date)
+
+        condition = ds.field('platform').isin(sorted(set(platforms)))
+        if 'range_start' in params:
+            condition &= ds.field('day') >= params['range_start']
+        if 'range_end' in params:
+            condition &= ds.field('day') < params['range_end']
+        if sources is not None:
+            condition &= ds.field('source').isin(sources)
+        return self._dataset.to_table(columns=list(columns), filter=condition)
+
+    def _frame(self, platform, start_date=None, end_date=None, columns=(), sources=None):
+        return self._table(platform, start_date, end_date, columns, sources).to_pandas()
+
+    def _keyword_rows(self, table, keywords):
+        #keyword -> indices of the rows whose terms contain every word of the
+        #keyword (or its plural), like a keyword_index lookup
+        terms = table['terms'].combine_chunks()
+        flat = pc.list_flatten(terms)
+        parents = pc.list_parent_indices(terms).to_numpy()
+        rows = {}
+        for keyword in keywords:
+            matched = None
+            for word in keyword_words(keyword):
+                hit = pc.is_in(flat, value_set=pa.array(keyword_variants(word))).to_numpy(zero_copy_only=False)
+                found = np.unique(parents[hit])
+                matched = found if matched is None else np.intersect1d(matched, found, assume_unique=True)
+            rows[keyword] = matched
+        return rows
+
+    #---------- data access overridden from ToxicityAnalyzer ----------
+
+    def _scores_frame(self, platform, start_date, end_date, sample=None):
+        return self._frame(platform, start_date, end_date, ['toxicity', 'day', 'platform'])
+
+    def _histogram_from_buckets(self, platform, start_date, end_date, sample=None):
+        #same bins as width_bucket(toxicity, 0, 1, 20) clamped to 1..20
+        df = self._scores_frame(platform, start_date, end_date)
+        histograms = {}
+        totals = {}
+        squares = {}
+        for plat, scores in df.groupby('platform')['toxicity']:
+            buckets = np.clip(np.floor(scores.to_numpy() * HISTOGRAM_BINS), 0, HISTOGRAM_BINS - 1)
+            histograms[plat] = np.bincount(buckets.astype(np.int64), minlength=HISTOGRAM_BINS)
+            totals[plat] = float(scores.sum())
+            squares[plat] = float((scores.to_numpy() ** 2).sum())
+        return histograms, totals, squares
+
+    def get_sketches(self, platform='all', start_date=None, end_date=None, refresh=True):
+        key = (platform, str(start_date), str(end_date))
+        with self._lock:
+            if key not in self._sketches:
+                df = self._scores_frame(platform, start_date, end_date)
+                self._sketches[key] = {
+                    plat: KLLSketch(self.sketch_store.k).update(scores.to_numpy())
+                    for plat, scores in df.groupby('platform')['toxicity']
+                }
+            # callers add merged entries to the dict they get
+            return dict(self._sketches[key])
+
+    def _keyword_counts(self, platform, threshold, keywords, sample=None):
+        # 4chan posts without a comment body are left out, as in the database path
+        table = self._table(platform, columns=['source', 'toxicity', 'text', 'terms'],
+                            sources=['posts', 'reddit_posts'])
+        keep = pc.or_(pc.not_equal(table['source'], 'posts'), pc.is_valid(table['text']))
+        table = table.filter(keep)
+        toxic = (table['toxicity'].to_numpy() > threshold)
+
+        counts = {
+            keyword: (int(toxic[rows].sum()), int(len(rows) - toxic[rows].sum()))
+            for keyword, rows in self._keyword_rows(table, keywords).items()
+        }
+        hits = pd.DataFrame.from_dict(counts, orient='index', columns=['high', 'low'])
+        return hits, int(toxic.sum()), int(len(toxic) - toxic.sum())
+
+    def _attribute_totals(self, platform, start_date, end_date, group_by, sample=None):
+        df = self._frame(platform, start_date, end_date,
+                         ATTRIBUTES + ['community', 'day', 'platform'])
+        grouped = df.groupby(list(group_by), dropna=False)[ATTRIBUTES]
+        counts = grouped.count().add_prefix('n_')
+        sums = grouped.sum().add_prefix('sum_')
+        return pd.concat([counts, sums], axis=1).reset_index()
+
+    def _temporal_series(self, keywords, window_days, platform, sample=None):
+        # keyword timelines cover 4chan posts and reddit submissions
+        table = self._table(platform, columns=['platform', 'day', 'toxicity', 'terms'],
+                            sources=['posts', 'reddit_posts'])
+        frame = table.drop_columns(['terms']).to_pandas()
+
+        hits = pd.concat([
+            frame.iloc[rows].assign(keyword=keyword)
+            for keyword, rows in self._keyword_rows(table, keywords).items()
+        ])
+        columns = ['keyword', 'platform', 'peak_date', 'days_from_peak', 'volume', 'toxicity']
+        if hits.empty:
+            return pd.DataFrame(columns=columns)
+
+        daily = (hits.groupby(['keyword', 'platform', 'day'])['toxicity']
+                 .agg(volume='count', toxicity='mean').reset_index())
+        # busiest day per keyword and platform, earliest on ties
+        peaks = (daily.sort_values(['volume', 'day'], ascending=[False, True])
+                 .drop_duplicates(['keyword', 'platform'])
+                 .rename(columns={'day': 'peak_date'})[['keyword', 'platform', 'peak_date']])
+        daily = daily.merge(peaks, on=['keyword', 'platform'])
+        daily['days_from_peak'] = (pd.to_datetime(daily['day']) - pd.to_datetime(daily['peak_date'])).dt.days
+        daily = daily[daily['days_from_peak'].abs() <= int(window_days)]
+        return daily.sort_values(['keyword', 'platform', 'day'])[columns]
+
+    def _sampled_tfidf_model(self, platform):
+        #term counts of every snapshot document of the platform
+        corpus = '4chan' if platform == '4chan' else 'reddit'
+        with self._lock:
+            if corpus not in self._tfidf_models:
+                table = self._table(corpus, columns=['toxicity', 'text'])
+                texts = table['text'].to_pylist()
+                keep = [i for i, text in enumerate(texts) if text is not None and len(text) > 10]
+                model = TfidfModel()
+                toxicity = table['toxicity'].to_numpy()
+                model.add([corpus] * len(keep), toxicity[keep].tolist(), keep, [texts[i] for i in keep])
+                self._tfidf_models[corpus] = model
+            return self._tfidf_models[corpus]
+
+
+if __name__ == "__main__":
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    if len(sys.argv) < 3 or sys.argv[1] != 'export':
+        print("Usage: python3 snapshot.py export <dir> [start_date] [end_date]")
+        sys.exit(1)
+
+    conn = psycopg2.connect(dsn=os.getenv("DATABASE_URL"))
+    written = export(conn, sys.argv[2], *sys.argv[3:5])
+    conn.close()
+    print(f"snapshot written to {sys.argv[2]}: {written}")
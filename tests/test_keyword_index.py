@@ -0,0 +1,108 @@
+#Keyword lookups for the keyword shapes the dashboard accepts: single words,
+#several words ('climate change'), hyphenated ('covid-19') and stop words.
+#The SQL tests run against DATABASE_URL on temp tables that shadow
+#keyword_index/posts for the session, and are skipped without a database.
+
+import os
+import sys
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from keyword_index import (SOURCES, index_rows, insert_index_rows, keyword_params,
+                           keyword_words, matching_posts_sql, keyword_hits_sql)
+from keyword_matcher import KeywordMatcher
+
+POSTS = {
+    1: "Climate change is real",
+    2: "the climate is changing, changes everywhere",
+    3: "no weather talk here, only climate",
+    4: "COVID-19 cases are up",
+    5: "immigrants at the border",
+}
+
+
+def test_keyword_words():
+    assert keyword_words('ukraine') == ['ukraine']
+    assert keyword_words('Climate Change') == ['climate', 'change']
+    assert keyword_words('covid-19') == ['covid']
+    assert keyword_words('the donald') == ['donald']
+
+
+@pytest.mark.parametrize('keyword', ['the', 'x', '19', ' , '])
+def test_unindexed_keyword_is_rejected(keyword):
+    with pytest.raises(ValueError):
+        keyword_params([keyword])
+
+
+def test_matcher_needs_every_word():
+    matcher = KeywordMatcher(['climate change', 'covid-19', 'immigrant'])
+    found = {number: matcher.names(matcher.mask(text)) for number, text in POSTS.items()}
+    assert found == {
+        1: ['climate change'],
+        2: ['climate change'],
+        3: [],
+        4: ['covid-19'],
+        5: ['immigrant'],
+    }
+    with pytest.raises(ValueError):
+        KeywordMatcher(['ukraine', 'the'])
+
+
+@pytest.fixture
+def conn():
+    psycopg2 = pytest.importorskip('psycopg2')
+    if not os.getenv('DATABASE_URL'):
+        pytest.skip('DATABASE_URL not set')
+    conn = psycopg2.connect(dsn=os.getenv('DATABASE_URL'))
+    with conn.cursor() as cur:
+        # temp tables come first on the search_path, so the queries read these
+        cur.execute("""
+            CREATE TEMP TABLE keyword_index (term TEXT, source TEXT, post_key TEXT,
+                                             created_at TIMESTAMPTZ);
+            CREATE TEMP TABLE posts (board_name TEXT, thread_number BIGINT, post_number BIGINT,
+                                     created_at TIMESTAMP, data JSONB);
+        """)
+        rows = []
+        for number, text in POSTS.items():
+            created = datetime.datetime(2025, 11, 1, 12, number)
+            cur.execute("INSERT INTO posts VALUES ('pol', 1, %s, %s, '{}')", (number, created))
+            rows.extend(index_rows('posts', f'pol/{number}', created, text))
+        # a session east of UTC indexes, one west of it queries
+        cur.execute("SET TIME ZONE 'Asia/Tokyo'")
+        insert_index_rows(cur, rows)
+        cur.execute("SET TIME ZONE 'America/New_York'")
+    yield conn
+    conn.rollback()
+    conn.close()
+
+
+def matches(conn, keywords):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT k.keyword, p.post_number
+            FROM {keyword_hits_sql('posts')}
+            ORDER BY 1, 2
+        """, keyword_params(keywords))
+        return cur.fetchall()
+
+
+def test_hits_need_every_word(conn):
+    assert matches(conn, ['climate change']) == [('climate change', 1), ('climate change', 2)]
+
+
+def test_hyphenated_and_plural(conn):
+    assert matches(conn, ['covid-19', 'immigrant']) == [('covid-19', 4), ('immigrant', 5)]
+
+
+def test_matching_posts_once_per_row(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT p.post_number FROM {matching_posts_sql('posts')} ORDER BY 1",
+                    keyword_params(['climate', 'climate change']))
+        assert [row[0] for row in cur.fetchall()] == [1, 2, 3]
+
+
+def test_posts_join_ignores_session_time_zone(conn):
+    assert 'AT TIME ZONE' in SOURCES['posts']['join']
+    assert matches(conn, ['border']) == [('border', 5)]
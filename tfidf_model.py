@@ -0,0 +1,381 @@
+#Persisted TF-IDF model of the whole scored corpus
+#
+#Keeps the raw term counts (documents x unigrams/bigrams, sparse) of every
+#scored post and comment on disk, next to each document's platform and
+#toxicity. get_tfidf_toxic_words() picks the toxic rows for any platform and
+#threshold and derives TF-IDF from the stored counts, get_contrastive_terms()
+#scores toxic against non-toxic counts at many thresholds at once; nothing is
+#tokenized per request.
+#
+#Refresh from cron / a worker:
+#   python3 tfidf_model.py              add documents scored since the last run
+#   python3 tfidf_model.py --full       re-read the whole corpus
+#   python3 tfidf_model.py --every 600  keep refreshing every 600s
+#The model file is TFIDF_PATH (default tfidf_model.joblib).
+
+import os
+import sys
+import time
+import logging
+import threading
+from datetime import timedelta
+
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, ENGLISH_STOP_WORDS
+
+from keyword_index import SOURCES as KEY_SOURCES
+
+logger = logging.getLogger("tfidf model")
+
+# HTML markup and site boilerplate on top of the English stop words
+STOP_WORDS = list(ENGLISH_STOP_WORDS) + [
+    'span', 'br', 'quote', 'gt', 'class', 'href',
+    '039', 'quot', 'div', 'greentext', 'http', 'https',
+    'www', 'com', 'html', 'link', 'post', 'thread'
+]
+TOKEN_PATTERN = r'\b[a-zA-Z]{2,}\b'
+
+# vocabulary bound: terms seen in fewer than MIN_DF documents are pruned
+# whenever the vocabulary grows past PRUNE_AT, keeping the MAX_TERMS most
+# frequent ones
+MIN_DF = 2
+MAX_TERMS = 200000
+PRUNE_AT = 4 * MAX_TERMS
+
+# vocabulary columns contrast_terms() scores at a time: per block the
+# per-bin counts are a dense (thresholds + 1) x CONTRAST_BLOCK array, so
+# memory does not grow with the vocabulary
+CONTRAST_BLOCK = 4096
+
+# scores commit in batches (scored_at is set before the commit), so each
+# refresh re-reads a little before the previous one started; documents
+# already in the model are matched by key and not counted twice
+LOOKBACK = timedelta(hours=1)
+
+# (platform, table, document text) -- the fields the analysis always used
+SOURCES = [
+    ('4chan', 'posts', "data->>'com'"),
+    ('reddit', 'reddit_posts', "title || ' ' || COALESCE(data->>'selftext', '')"),
+    ('reddit', 'reddit_comments', "data->>'body'"),
+]
+
+
+class TfidfModel:
+    """
+    Term counts of every scored document, refreshed incrementally
+
+    - counts: CSR matrix, one row per document, int32 counts per term
+    - terms / vocabulary: column -> term and term -> column
+    - platform, toxicity: per-document arrays for filtering
+    - rows: 'table/post_key' -> row of every document already counted
+    - scored_until: when the last refresh started (next refresh reads rows
+      scored since then)
+    """
+
+    def __init__(self):
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.int32)
+        self.terms = []
+        self.vocabulary = {}
+        self.platform = np.empty(0, dtype='<U6')
+        self.toxicity = np.empty(0)
+        self.rows = {}
+        self.scored_until = None
+        self.updated_at = None
+        self._analyzer = CountVectorizer(
+            stop_words=STOP_WORDS,
+            ngram_range=(1, 2),
+            token_pattern=TOKEN_PATTERN
+        ).build_analyzer()
+
+    @property
+    def documents(self):
+        return self.counts.shape[0]
+
+    #---------- building ----------
+
+    def _count(self, texts):
+        #CSR rows for a batch of texts, adding unseen terms to the vocabulary
+        indptr = [0]
+        indices = []
+        values = []
+        for text in texts:
+            row = {}
+            for term in self._analyzer(text or ''):
+                column = self.vocabulary.get(term)
+                if column is None:
+                    column = self.vocabulary[term] = len(self.terms)
+                    self.terms.append(term)
+                row[column] = row.get(column, 0) + 1
+            indices.extend(row.keys())
+            values.extend(row.values())
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.array(values, dtype=np.int32), np.array(indices, dtype=np.int64), indptr),
+            shape=(len(texts), len(self.terms))
+        )
+
+    def add(self, platforms, toxicities, keys, texts):
+        #append new documents; documents already counted only get their
+        #(re-scored) toxicity updated, their text is not re-tokenized
+        new = []
+        for i, key in enumerate(keys):
+            row = self.rows.get(key)
+            if row is None:
+                new.append(i)
+            else:
+                self.toxicity[row] = toxicities[i]
+        if not new:
+            return 0
+        rows = self._count([texts[i] for i in new])
+        old = self.counts
+        old.resize((old.shape[0], len(self.terms)))
+        self.counts = sparse.vstack([old, rows], format='csr')
+        self.platform = np.concatenate([self.platform, np.array([platforms[i] for i in new], dtype='<U6')])
+        self.toxicity = np.concatenate([self.toxicity, np.array([toxicities[i] for i in new], dtype=np.float64)])
+        first = len(self.rows)
+        self.rows.update((keys[i], first + n) for n, i in enumerate(new))
+        if len(self.terms) > PRUNE_AT:
+            self.prune()
+        return len(new)
+
+    def prune(self, min_df=MIN_DF, max_terms=MAX_TERMS):
+        #drop rare terms and keep at most max_terms by document frequency
+        df = np.bincount(self.counts.indices, minlength=len(self.terms))
+        candidates = np.flatnonzero(df >= min_df)
+        keep = np.sort(candidates[np.argsort(-df[candidates], kind='stable')[:max_terms]])
+        self.counts = self.counts[:, keep].tocsr()
+        self.terms = [self.terms[i] for i in keep]
+        self.vocabulary = {term: i for i, term in enumerate(self.terms)}
+        logger.info(f"pruned vocabulary to {len(self.terms):,} terms")
+
+    def refresh(self, conn, full=False, chunk_size=20000):
+        #pull documents scored since the last refresh (or all of them)
+        if full:
+            self.__init__()
+
+        conditions = ["toxicity IS NOT NULL"]
+        params = {}
+        if self.scored_until is not None:
+            conditions.append("scored_at >= %(since)s")
+            params['since'] = self.scored_until - LOOKBACK
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT now()")
+            started = cur.fetchone()[0]
+
+        added = 0
+        for plat, table, text in SOURCES:
+            key = f"'{table}/' || {KEY_SOURCES[table]['key']}"
+            with conn.cursor(name=f'tfidf_{table}') as cur:
+                cur.itersize = chunk_size
+                cur.execute(f"""
+                    SELECT {key}, toxicity, {text}
+                    FROM {table}
+                    WHERE {' AND '.join(conditions)}
+                    AND LENGTH({text}) > 10
+                """, params)
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    keys, toxicities, texts = zip(*rows)
+                    added += self.add([plat] * len(rows), toxicities, keys, texts)
+            conn.rollback()
+
+        if self.scored_until is None and self.documents:
+            self.prune()
+        self.scored_until = started
+        self.updated_at = time.time()
+        logger.info(f"added {added:,} documents ({self.documents:,} total, {len(self.terms):,} terms)")
+        return added
+
+    #---------- persistence ----------
+
+    def save(self, path):
+        #write to a temp file and swap it in, readers never see half a model
+        #(a plain dict of arrays, so loading doesn't depend on module paths)
+        state = {name: value for name, value in self.__dict__.items() if name != '_analyzer'}
+        tmp = f"{path}.tmp"
+        joblib.dump(state, tmp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        model = cls()
+        model.__dict__.update(joblib.load(path))
+        return model
+
+    #---------- querying ----------
+
+    def top_terms(self, platform, threshold, top_n=20, max_features=500, min_df=2, max_df=0.8):
+        """
+        Top terms by mean TF-IDF over the toxic documents of a platform
+
+        Mirrors fitting TfidfVectorizer(max_features, min_df, max_df) on the
+        toxic documents: document frequencies, feature selection by total
+        count, smoothed IDF and L2-normalized rows are all computed on that
+        subset, from the stored counts.
+        """
+        on_platform = self.platform == platform
+        toxic = on_platform & (self.toxicity > threshold)
+        n_toxic = int(toxic.sum())
+        n_nontoxic = int((on_platform & (self.toxicity <= threshold)).sum())
+
+        subset = self.counts[toxic]
+        df = np.bincount(subset.indices, minlength=subset.shape[1])
+        totals = np.asarray(subset.sum(axis=0)).ravel()
+
+        # most frequent terms, ties broken alphabetically like the vectorizer's
+        # sorted vocabulary
+        candidates = np.flatnonzero((df >= min_df) & (df <= max_df * n_toxic))
+        names = np.array(self.terms, dtype=object)[candidates]
+        features = candidates[np.lexsort((names, -totals[candidates]))[:max_features]]
+        if not len(features):
+            return [], [], n_toxic, n_nontoxic
+
+        idf = np.log((1 + n_toxic) / (1 + df[features])) + 1
+        tfidf = subset[:, features].astype(np.float64).multiply(idf).tocsr()
+        norms = np.sqrt(np.asarray(tfidf.multiply(tfidf).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        mean = np.asarray((sparse.diags(1 / norms) @ tfidf).mean(axis=0)).ravel()
+
+        top = np.lexsort((np.array(self.terms, dtype=object)[features], -mean))[:top_n]
+        return [self.terms[features[i]] for i in top], mean[top].tolist(), n_toxic, n_nontoxic
+
+    def contrast_terms(self, platform, thresholds, top_n=20, min_df=MIN_DF, prior_scale=1.0):
+        """
+        Terms over-represented in toxic vs non-toxic documents, per threshold
+
+        Log-odds ratio with an informative Dirichlet prior (Monroe, Colaresi &
+        Quinn 2008, "Fightin' Words"): the prior is the platform's own term
+        counts (times prior_scale), which shrinks rare terms towards zero, and
+        terms are ranked by the z-score of their log-odds.
+
+        All thresholds come from one pass over the counts: documents are
+        binned by how many thresholds their score exceeds, term counts are
+        summed per bin with a sparse product, and a cumulative sum over the
+        bins gives the toxic counts at every threshold. Terms are scored
+        CONTRAST_BLOCK columns at a time, keeping each threshold's top_n.
+
+        Returns one dict per threshold (in the given order) with the toxic /
+        non-toxic document counts, terms, z-scores and log-odds.
+        """
+        docs = np.flatnonzero(self.platform == platform)
+        counts = self.counts[docs]
+        toxicity = self.toxicity[docs]
+        df = np.bincount(counts.indices, minlength=counts.shape[1])
+        columns = np.flatnonzero(df >= min_df)
+        counts = counts[:, columns]
+
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        order = np.argsort(thresholds)
+        # bin b = number of thresholds below the score, so a document is
+        # toxic (score > t) at exactly the b lowest thresholds
+        bins = np.searchsorted(thresholds[order], toxicity, side='left')
+        membership = sparse.csr_matrix(
+            (np.ones(len(docs)), (bins, np.arange(len(docs)))),
+            shape=(len(thresholds) + 1, len(docs))
+        )
+        docs_per_bin = np.bincount(bins, minlength=len(thresholds) + 1)
+        tokens_per_bin = membership @ np.asarray(counts.sum(axis=1)).ravel()
+
+        # row j: the documents (and their tokens) above sorted threshold j
+        toxic_docs = np.cumsum(docs_per_bin[::-1])[::-1][1:]
+        n_toxic = np.cumsum(tokens_per_bin[::-1])[::-1][1:, None]
+        n_nontoxic = tokens_per_bin.sum() - n_toxic
+        alpha0 = prior_scale * tokens_per_bin.sum()
+
+        # equal scores ranked alphabetically, independent of insertion order
+        names = np.array(self.terms, dtype=object)[columns]
+        best = [np.empty(0, dtype=np.int64)] * len(thresholds)
+        best_z = [np.empty(0)] * len(thresholds)
+        best_log_odds = [np.empty(0)] * len(thresholds)
+        for start in range(0, len(columns), CONTRAST_BLOCK):
+            block = slice(start, start + CONTRAST_BLOCK)
+            per_bin = (membership @ counts[:, block]).toarray()
+            toxic = np.cumsum(per_bin[::-1], axis=0)[::-1][1:]
+            total = per_bin.sum(axis=0)
+            nontoxic = total - toxic
+
+            alpha = prior_scale * total
+            with np.errstate(divide='ignore', invalid='ignore'):
+                log_odds = (np.log((toxic + alpha) / (n_toxic + alpha0 - toxic - alpha))
+                            - np.log((nontoxic + alpha) / (n_nontoxic + alpha0 - nontoxic - alpha)))
+                z = log_odds / np.sqrt(1 / (toxic + alpha) + 1 / (nontoxic + alpha))
+            log_odds = np.nan_to_num(log_odds, nan=0.0, posinf=0.0, neginf=0.0)
+            z = np.nan_to_num(z, nan=0.0, posinf=0.0, neginf=0.0)
+
+            index = np.arange(start, start + per_bin.shape[1])
+            for row in range(len(thresholds)):
+                # the block's top_n (ties included) merged with the running top_n
+                if len(index) > top_n:
+                    kth = np.partition(z[row], -top_n)[-top_n]
+                    keep = z[row] >= kth
+                else:
+                    keep = slice(None)
+                candidates = np.concatenate([best[row], index[keep]])
+                candidate_z = np.concatenate([best_z[row], z[row][keep]])
+                candidate_log_odds = np.concatenate([best_log_odds[row], log_odds[row][keep]])
+                top = np.lexsort((names[candidates], -candidate_z))[:top_n]
+                best[row] = candidates[top]
+                best_z[row] = candidate_z[top]
+                best_log_odds[row] = candidate_log_odds[top]
+
+        results = [None] * len(thresholds)
+        for row, index in enumerate(order):
+            results[index] = {
+                'threshold': float(thresholds[index]),
+                'toxic_posts_analyzed': int(toxic_docs[row]),
+                'nontoxic_posts_analyzed': int(len(docs) - toxic_docs[row]),
+                'top_words': [self.terms[columns[i]] for i in best[row]],
+                'scores': best_z[row].tolist(),
+                'log_odds': best_log_odds[row].tolist(),
+            }
+        return results
+
+
+class ModelFile:
+    #the model on disk, reloaded when a refresh job replaces the file
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv('TFIDF_PATH', 'tfidf_model.joblib')
+        self._model = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        #current model, or None until one has been built
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                self._model = TfidfModel.load(self.path)
+                self._mtime = mtime
+            return self._model
+
+
+if __name__ == "__main__":
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    path = os.getenv('TFIDF_PATH', 'tfidf_model.joblib')
+    full = '--full' in sys.argv
+    every = float(sys.argv[sys.argv.index('--every') + 1]) if '--every' in sys.argv else None
+
+    model = TfidfModel.load(path) if os.path.exists(path) and not full else TfidfModel()
+    conn = psycopg2.connect(dsn=os.getenv("DATABASE_URL"))
+    while True:
+        if model.refresh(conn, full=full) or full:
+            model.save(path)
+        full = False
+        if every is None:
+            break
+        time.sleep(every)
+    conn.close()
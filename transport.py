@@ -0,0 +1,128 @@
+#Response encoding for the dashboard API
+#
+#- JSON goes through orjson when it is installed (NumPy arrays are written
+#  straight from their buffers, no .tolist()), otherwise through the stdlib
+#  encoder with a NumPy fallback
+#- clients sending `Accept: application/x-f32-pack` get the packed format:
+#  a JSON header in which every float array is replaced by a reference into
+#  one little-endian Float32 blob that the dashboard reads as Float32Array views
+#- bodies are gzip or brotli (when the brotli package is installed)
+#  compressed as the client's Accept-Encoding allows
+#
+#Packed layout: b'F32P' | uint32 header length | header JSON (space padded to
+#a multiple of 4 bytes) | float32 values. A float array in the header reads
+#{"$f32": [offset, length]}, counted in floats from the start of the blob.
+
+import gzip
+import json
+import struct
+import decimal
+from datetime import date
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+JSON = 'application/json'
+F32_PACK = 'application/x-f32-pack'
+PACK_MAGIC = b'F32P'
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def _default(obj):
+    #what neither encoder handles natively
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    #JSON bytes; NaN/inf are written as null by both encoders
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(_finite(obj), default=_default, allow_nan=False).encode('utf-8')
+
+
+def _finite(obj):
+    #stdlib json writes NaN literally (invalid JSON), match orjson's null
+    if isinstance(obj, float) and not np.isfinite(obj):
+        return None
+    if isinstance(obj, dict):
+        return {key: _finite(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(value) for value in obj]
+    if isinstance(obj, np.ndarray) and obj.dtype.kind == 'f':
+        return _finite(obj.tolist())
+    return obj
+
+
+def pack(obj):
+    #packed Float32 body: float arrays go to the blob, the rest stays JSON
+    chunks = []
+    offset = 0
+
+    def extract(value):
+        nonlocal offset
+        if isinstance(value, np.ndarray) and value.dtype.kind == 'f':
+            chunk = np.ascontiguousarray(value, dtype='<f4').ravel()
+            chunks.append(chunk)
+            ref = {'$f32': [offset, len(chunk)]}
+            offset += len(chunk)
+            return ref
+        if isinstance(value, dict):
+            return {key: extract(item) for key, item in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [extract(item) for item in value]
+        return value
+
+    header = dumps(extract(obj))
+    header += b' ' * (-len(header) % 4)
+    blob = np.concatenate(chunks).tobytes() if chunks else b''
+    return PACK_MAGIC + struct.pack('<I', len(header)) + header + blob
+
+
+def negotiate(accept, accept_encoding):
+    #(mimetype, content encoding or None) for a request's Accept headers;
+    #JSON is the default, the packed format is only sent when asked for
+    mimetype = F32_PACK if F32_PACK in (accept or '') else JSON
+    encodings = {part.split(';')[0].strip() for part in (accept_encoding or '').split(',')}
+    if brotli is not None and 'br' in encodings:
+        return mimetype, 'br'
+    if 'gzip' in encodings:
+        return mimetype, 'gzip'
+    return mimetype, None
+
+
+def encode(obj, mimetype=JSON, encoding=None):
+    #response body for a negotiated representation
+    body = pack(obj) if mimetype == F32_PACK else dumps(obj)
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    return body
+
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    #app.json provider so jsonify() accepts analyzer results holding arrays
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj).decode('utf-8')